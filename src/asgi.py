@@ -0,0 +1,155 @@
+# ASGI entry point for high-concurrency deployments, serves the same routes and responses as main.py:
+#   uvicorn asgi:app --port 8080
+# The Flask app runs unchanged, each request runs in a greenlet on the event loop and the DB
+# engines use an async driver (asyncpg, aiosqlite for SQLite). A request waiting on the DB or
+# on bcrypt gives the loop to the other requests, instead of holding a worker thread
+import io
+import os
+import sys
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util.concurrency import await_only, greenlet_spawn
+
+from init import db
+from main import create_app
+from replicas import REPLICA_BIND
+
+
+# Async driver of each database
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+# Largest request body read into memory
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+
+# Same database URL with the async driver, eg: postgresql+psycopg2://... => postgresql+asyncpg://...
+def async_url(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {backend} databases.")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+# Engine settings of create_app with the async drivers
+# The pool is the same size as the WSGI app's (aiosqlite would open a connection per request)
+def async_config():
+    config = {
+        "SQLALCHEMY_DATABASE_URI": async_url(os.environ["DATABASE_URL"]),
+        "SQLALCHEMY_ENGINE_OPTIONS": {"poolclass": AsyncAdaptedQueuePool},
+    }
+    if os.environ.get("DATABASE_REPLICA_URL"):
+        config["SQLALCHEMY_BINDS"] = {REPLICA_BIND: async_url(os.environ["DATABASE_REPLICA_URL"])}
+    return config
+
+
+# Runs a WSGI app in a greenlet per request, the async DB driver and PasswordPool await
+# from inside of the greenlet with await_only
+class GreenletASGI:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            body = await _read_body(receive)
+            if body is None:
+                await _send_response(send, 413, [(b"content-type", b"application/json")], b'{"error":"Request body is too large."}')
+                return
+            await greenlet_spawn(self._run_wsgi, _environ(scope, body), send)
+
+    # Call the Flask app and send its response, chunks of streamed responses are sent as they come
+    def _run_wsgi(self, environ, send):
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start["status"] = int(status.split(" ", 1)[0])
+            response_start["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+        chunks = self.flask_app.wsgi_app(environ, start_response)
+        try:
+            started = False
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if not started:
+                    await_only(send({"type": "http.response.start", **response_start}))
+                    started = True
+                await_only(send({"type": "http.response.body", "body": chunk, "more_body": True}))
+            if not started:
+                await_only(send({"type": "http.response.start", **response_start}))
+            await_only(send({"type": "http.response.body", "body": b""}))
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    # Close the DB connections when the server stops
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await greenlet_spawn(self._dispose_engines)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _dispose_engines(self):
+        with self.flask_app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+# Whole body of the request, None if it's larger than MAX_BODY_SIZE
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_SIZE:
+            return None
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_response(send, status, headers, body):
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+# WSGI environ of an ASGI HTTP request
+def _environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # The body was read whole, its size is known even for chunked requests sent without Content-Length
+    environ["CONTENT_LENGTH"] = str(len(body))
+    environ.pop("HTTP_TRANSFER_ENCODING", None)
+    return environ
+
+
+app = GreenletASGI(create_app(async_config()))
@@ -0,0 +1,255 @@
+# Compare the WSGI app (main.py, threaded server) and the ASGI app (asgi.py, uvicorn) under
+# many concurrent clients. Seed DATABASE_URL first, then run from the src folder:
+#   python -m benchmarks.load_test --prepare --users 200 --groups 10
+#   python -m benchmarks.bench_async --clients 1000 --duration 20
+# Both servers are started on DATABASE_URL one after the other. Their responses to the same
+# requests are compared first, then each client loops over GET routes on its own connection
+# Reports throughput, latency, errors and the peak DB connections and threads held by the server
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+
+from benchmarks.load_test import Client, percentile
+
+
+# Routes compared between the two servers and requested by the clients
+PATHS = (
+    "/workouts/?limit=20",
+    "/workouts/stats?period=month",
+    "/groups/?fields=id,name,date_created",
+    "/groups/{group_id}",
+    "/groups/{group_id}/leaderboard?period=month",
+    "/marathons/",
+    "/marathons/{marathon_id}",
+)
+# Seconds before a request counts as an error
+REQUEST_TIMEOUT = 30
+SERVERS = {
+    "wsgi": [sys.executable, "-m", "flask", "--app", "main", "run", "--port", "{port}", "--with-threads"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--port", "{port}", "--log-level", "warning"],
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the WSGI and ASGI apps under many concurrent clients.")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per server")
+    parser.add_argument("--users", type=int, default=200, help="runners in the seeded dataset, clients log in as them")
+    parser.add_argument("--logins", type=int, default=20, help="runners logged in, clients share their tokens")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--servers", default="wsgi,asgi")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+# Start a server and wait until it answers, returns the process
+def start_server(name, port):
+    command = [part.format(port=port) for part in SERVERS[name]]
+    # .flaskenv turns on debug mode, the servers run without the reloader and debugger
+    env = {**os.environ, "FLASK_DEBUG": "0"}
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{name} server stopped: {process.stderr.read().decode()}")
+        status, _, _ = Client(f"http://127.0.0.1:{port}").request("GET", "/metrics")
+        if status == 200:
+            return process
+        time.sleep(0.2)
+    process.kill()
+    sys.exit(f"{name} server didn't start on port {port}")
+
+
+# Tokens of the first runners and the ids browsed by the clients
+def login(url, args):
+    tokens = []
+    for i in range(args.logins):
+        client = Client(url)
+        client.login(f"runner{i % args.users}@email.com")
+        tokens.append(client.token)
+    _, groups, _ = client.request("GET", "/groups/?fields=id")
+    _, marathons, _ = client.request("GET", "/marathons/?fields=id&limit=100")
+    return tokens, [group["id"] for group in groups], [marathon["id"] for marathon in marathons]
+
+
+# Same requests to both servers, returns the paths whose status or body differ
+def compare_responses(urls, token, group_id, marathon_id):
+    responses = {}
+    for name, url in urls.items():
+        client = Client(url)
+        client.token = token
+        responses[name] = [client.request("GET", path.format(group_id=group_id, marathon_id=marathon_id))[:2] for path in PATHS]
+    first, *others = responses.values()
+    return [path for index, path in enumerate(PATHS) if any(other[index] != first[index] for other in others)]
+
+
+# Minimal HTTP/1.1 keep-alive client on asyncio streams, returns (status, seconds) for each request
+class AsyncClient:
+    def __init__(self, host, port, token):
+        self.host = host
+        self.port = port
+        self.headers = f"Host: {host}:{port}\r\nAuthorization: Bearer {token}\r\n"
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self._get(path), REQUEST_TIMEOUT), time.perf_counter() - start
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            await self.close()
+            return None, time.perf_counter() - start
+
+    async def _get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {path} HTTP/1.1\r\n{self.headers}\r\n".encode())
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close" or status_line.startswith(b"HTTP/1.0"):
+            await self.close()
+        return int(status_line.split()[1])
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def run_client(port, token, paths, deadline, latencies, errors, seed):
+    rng = random.Random(seed)
+    client = AsyncClient("127.0.0.1", port, token)
+    while time.monotonic() < deadline:
+        status, elapsed = await client.get(rng.choice(paths))
+        latencies.append(elapsed)
+        if status != 200:
+            errors.append(status)
+    await client.close()
+
+
+# Peak connections checked out of the DB pool, and threads of the server process
+def sample_server(url, pid, deadline, peaks):
+    parts = urlsplit(url)
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            connection.request("GET", "/metrics")
+            text = connection.getresponse().read().decode()
+            connection.close()
+        except (OSError, http.client.HTTPException):
+            text = ""
+        peaks["db_connections"] = max(peaks["db_connections"], _gauge(text, "db_pool_primary_checkedout"))
+        peaks["threads"] = max(peaks["threads"], _threads(pid))
+        time.sleep(0.25)
+
+
+async def run_load(url, port, pid, tokens, paths, args):
+    latencies, errors = [], []
+    peaks = {"db_connections": 0, "threads": 0}
+    start = time.monotonic()
+    deadline = start + args.duration
+    sampler = asyncio.get_running_loop().run_in_executor(None, sample_server, url, pid, deadline, peaks)
+    await asyncio.gather(*(
+        run_client(port, tokens[i % len(tokens)], paths, deadline, latencies, errors, i)
+        for i in range(args.clients)
+    ))
+    await sampler
+    elapsed = time.monotonic() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "error_rate": len(errors) / max(len(latencies), 1),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else 0,
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else 0,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else 0,
+        "peak_db_connections": peaks["db_connections"],
+        "peak_threads": peaks["threads"],
+    }
+
+
+# Value of a gauge in the text of /metrics
+def _gauge(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    return 0
+
+
+def _threads(pid):
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.environ.get("DATABASE_URL"):
+        sys.exit("Set DATABASE_URL to a database seeded with: python -m benchmarks.load_test --prepare")
+    # Each client holds a socket, on both ends when the server runs here
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    names = args.servers.split(",")
+    ports = {name: args.port + index for index, name in enumerate(names)}
+    urls = {name: f"http://127.0.0.1:{port}" for name, port in ports.items()}
+
+    # Both servers run together to compare their responses
+    processes = {name: start_server(name, ports[name]) for name in names}
+    try:
+        tokens, group_ids, marathon_ids = login(urls[names[0]], args)
+        different = compare_responses(urls, tokens[0], group_ids[0], marathon_ids[0])
+    finally:
+        for process in processes.values():
+            process.terminate()
+            process.wait()
+    if different:
+        sys.exit(f"The servers answered differently to: {', '.join(different)}")
+    print(f"Same responses from {' and '.join(names)} for {len(PATHS)} routes")
+
+    paths = [path.format(group_id=random.choice(group_ids), marathon_id=random.choice(marathon_ids)) for path in PATHS for _ in range(3)]
+    results = {}
+    # Each server gets the whole machine during its load
+    for name in names:
+        process = start_server(name, ports[name])
+        try:
+            results[name] = asyncio.run(run_load(urls[name], ports[name], process.pid, tokens, paths, args))
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f"{args.clients} clients for {args.duration:.0f}s")
+    print(f"{'server':<8}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'db conns':>10}{'threads':>9}")
+    for name, row in results.items():
+        print(
+            f"{name:<8}{row['requests']:>10}{row['error_rate']:>8.1%}{row['rps']:>9.1f}"
+            f"{row['p50_ms']:>8.1f}ms{row['p95_ms']:>8.1f}ms{row['p99_ms']:>8.1f}ms"
+            f"{row['peak_db_connections']:>10.0f}{row['peak_threads']:>9}"
+        )
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"clients": args.clients, "duration": args.duration, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Benchmark of the compiled serializers against marshmallow's schema.dump()
+# Run from the src folder: python -m benchmarks.bench_serializers [rows]
+import sys
+import json
+import timeit
+from datetime import date, timedelta
+
+from models.user import User
+from models.workout import Workout, workouts_schema
+from models.group import Group, groups_schema
+from models.group_log import GroupLog
+from models.marathon import Marathon, marathons_schema
+from models.marathon_log import MarathonLog
+from serializers import fast_dump
+
+
+# Build model objects in memory, no database is needed to serialise them
+def build_rows(rows):
+    users = [User(id=i, name=f"User {i}", email=f"user{i}@email.com", password="x", is_admin=False) for i in range(10)]
+    marathons = [
+        Marathon(id=i, name=f"Marathon {i}", event_date=date(2030, 1, 1) + timedelta(days=i), location="Gold Coast", distance_kms=10)
+        for i in range(rows)
+    ]
+    workouts = [
+        Workout(id=i, title="Outside run", date=date(2024, 1, 1) + timedelta(days=i % 365), distance_kms=i % 42, calories_burnt=200 + i % 500, user=users[i % 10])
+        for i in range(rows)
+    ]
+    groups = []
+    for i in range(rows):
+        group = Group(id=i, name=f"Group {i}", date_created=date(2024, 1, 1), created_by=users[i % 10].id, group_admin=users[i % 10])
+        group.group_logs = [GroupLog(id=i * 3 + j, entry_created=date(2024, 1, 2), user=users[j]) for j in range(3)]
+        group.marathon_logs = [MarathonLog(id=i, entry_created=date(2024, 1, 3), marathon=marathons[i])]
+        groups.append(group)
+    return {"workouts": (workouts_schema, workouts), "marathons": (marathons_schema, marathons), "groups": (groups_schema, groups)}
+
+
+def main(rows=10000, repeat=5):
+    print(f"Serialising {rows} rows, best of {repeat} runs")
+    print(f"{'schema':<12}{'marshmallow':>14}{'compiled':>12}{'speedup':>10}")
+    for name, (schema, objs) in build_rows(rows).items():
+        # Output must be identical, byte for byte
+        if json.dumps(schema.dump(objs)) != json.dumps(fast_dump(schema, objs)):
+            sys.exit(f"Output of the compiled {name} serializer does not match the schema")
+        slow = min(timeit.repeat(lambda: schema.dump(objs), number=1, repeat=repeat))
+        fast = min(timeit.repeat(lambda: fast_dump(schema, objs), number=1, repeat=repeat))
+        print(f"{name:<12}{slow * 1000:>12.1f}ms{fast * 1000:>10.1f}ms{slow / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,107 @@
+# Cold start budget: time from a new Python process to the first response of the app
+# Run from the src folder:
+#   python -m benchmarks.bench_startup --runs 11
+# Each run starts a new interpreter that imports main, calls create_app() and sends one
+# request with the test client. Exits with status 1 when the median is over --budget-ms
+# Uses an in-memory SQLite database unless DATABASE_URL is set (its tables must exist)
+# tests/test_startup.py runs it in the test suite
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time from process start to the first response.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/marathons/", help="route of the first request, sent with a JWT")
+    # Median total was 980-1050ms on a dev machine with every blueprint, about 20% more is accepted
+    parser.add_argument("--budget-ms", type=float, default=1250, help="largest median accepted")
+    parser.add_argument("--importtime", action="store_true", help="also list the slowest imports of the app's modules")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+# Runs in the new interpreter, prints the time of each phase in seconds as JSON
+def child(path):
+    start = time.perf_counter()
+    from main import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+
+    from flask_jwt_extended import create_access_token
+    from init import db
+    with app.app_context():
+        if app.config["SQLALCHEMY_DATABASE_URI"] == "sqlite://":
+            db.create_all()
+        token = create_access_token(identity="1")
+    ready = time.perf_counter()
+    response = app.test_client().get(path, headers={"Authorization": f"Bearer {token}"})
+    responded = time.perf_counter()
+    print(json.dumps({
+        "status": response.status_code,
+        "import": imported - start,
+        "create_app": created - imported,
+        "first_response": responded - ready,
+    }))
+
+
+def run(args, env):
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--child", "--path", args.path]
+    start = time.perf_counter()
+    output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - start
+    return {**json.loads(output.splitlines()[-1]), "total": total}
+
+
+# Cumulative import time of the app's own modules, slowest first
+def app_imports(env):
+    command = [sys.executable, "-X", "importtime", "-c", "from main import create_app; create_app()"]
+    stderr = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stderr
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    local = {os.path.splitext(name)[0] for name in os.listdir(src)} - {"benchmarks"}
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if name.split(".")[0] in local:
+            rows.append((int(cumulative) / 1000, name))
+    return sorted(rows, reverse=True)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        child(args.path)
+        return
+
+    env = {**os.environ, "FLASK_DEBUG": "0"}
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env.setdefault("JWT_SECRET_KEY", "bench-startup-secret-key-of-32-bytes")
+    runs = [run(args, env) for _ in range(args.runs)]
+
+    print(f"{'phase':<16}{'median':>10}{'min':>10}")
+    for phase in ("import", "create_app", "first_response", "total"):
+        values = [result[phase] * 1000 for result in runs]
+        print(f"{phase:<16}{statistics.median(values):>8.1f}ms{min(values):>8.1f}ms")
+    print(f"First response to GET {args.path}: {runs[0]['status']}")
+
+    if args.importtime:
+        print("\nSlowest imports of the app (cumulative):")
+        for milliseconds, name in app_imports(env)[:15]:
+            print(f"{milliseconds:>8.1f}ms  {name}")
+
+    median = statistics.median(result["total"] * 1000 for result in runs)
+    if median > args.budget_ms:
+        sys.exit(f"Cold start took {median:.0f}ms, budget is {args.budget_ms:.0f}ms")
+    print(f"Within budget: {median:.0f}ms of {args.budget_ms:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# Load test of a running instance, with concurrent runners and admins
+# Start the app on a local database seeded with the benchmark dataset, then run from the src folder:
+#   python -m benchmarks.load_test --prepare      (recreates the tables of DATABASE_URL, run it before starting the app)
+#   python -m benchmarks.load_test --url http://localhost:8080 --duration 30 --mix login=2,workouts=6,browse=10,enrol=2
+# Each worker thread runs one scenario in a loop, with a JWT it gets by logging in
+# Reports p50/p95/p99 latency, error rate and throughput per scenario and per request
+import os
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+import http.client
+from datetime import date
+from urllib.parse import urlsplit
+
+from seeding import SEED_PASSWORD
+
+
+DEFAULT_MIX = "login=2,workouts=6,browse=10,enrol=2"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent load test of a running instance.")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="workers per scenario, eg: " + DEFAULT_MIX)
+    parser.add_argument("--users", type=int, default=200, help="runners in the dataset")
+    parser.add_argument("--groups", type=int, default=10, help="groups (and admins) in the dataset")
+    parser.add_argument("--marathons", type=int, default=20)
+    parser.add_argument("--workouts-per-user", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--anchor-date", type=date.fromisoformat, help="date the data is generated around, YYYY-MM-DD, defaults to today")
+    parser.add_argument("--prepare", action="store_true", help="recreate the tables of DATABASE_URL and seed the dataset")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+# HTTP connection of a worker, kept alive between requests
+class Client:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.token = None
+        self.connection = None
+
+    # Send a request, returns (status, decoded JSON or None, seconds)
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        payload = json.dumps(body) if body is not None else None
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            # Connection failures count as errors, the next request reconnects
+            self.connection = None
+            return None, None, time.perf_counter() - start
+        elapsed = time.perf_counter() - start
+        try:
+            return status, json.loads(data) if data else None, elapsed
+        except ValueError:
+            return status, None, elapsed
+
+    def login(self, email):
+        status, body, _ = self.request("POST", "/auth/login", {"email": email, "password": SEED_PASSWORD})
+        if status != 200:
+            raise RuntimeError(f"Login of {email} failed with status {status}")
+        self.token = body["token"]
+        return token_claims(self.token)
+
+
+# Claims of a JWT, read without checking the signature
+def token_claims(token):
+    payload = token.split(".")[1]
+    return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+
+
+# Latencies and errors of one worker, per request name
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    # Time a request and count it as an error if its status isn't one of 'expected'
+    def call(self, client, name, method, path, body=None, expected=(200,)):
+        status, data, elapsed = client.request(method, path, body)
+        self.latencies.setdefault(name, []).append(elapsed)
+        if status not in expected:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        return data if data is not None else {}
+
+
+# Scenarios, each one is (setup, step): setup(client, worker) logs in and returns the
+# worker's state, step(client, recorder, state, rng) runs one iteration of the scenario
+def login_setup(client, worker):
+    return {}
+
+
+# Runners logging in at the same time, eg: when a training session starts
+def login_step(client, recorder, state, rng):
+    email = f"runner{rng.randrange(shared_config['users'])}@email.com"
+    recorder.call(client, "POST /auth/login", "POST", "/auth/login", {"email": email, "password": SEED_PASSWORD})
+
+
+def runner_setup(client, worker):
+    client.login(f"runner{worker % shared_config['users']}@email.com")
+    return {"iteration": 0}
+
+
+# Runners logging workouts and looking at their history and stats
+def workouts_step(client, recorder, state, rng):
+    body = {"title": rng.choice(("Treadmill", "Outside run", "Outside walk")), "distance_kms": rng.randint(1, 42), "calories_burnt": rng.randint(100, 1500)}
+    recorder.call(client, "POST /workouts/", "POST", "/workouts/", body, expected=(201,))
+    state["iteration"] += 1
+    if state["iteration"] % 3 == 0:
+        recorder.call(client, "GET /workouts/", "GET", "/workouts/")
+    if state["iteration"] % 5 == 0:
+        recorder.call(client, "GET /workouts/stats", "GET", "/workouts/stats?period=month")
+
+
+# Runners browsing groups, leaderboards and marathons
+def browse_step(client, recorder, state, rng):
+    group_id = rng.choice(shared_config["group_ids"])
+    marathon_id = rng.choice(shared_config["marathon_ids"])
+    recorder.call(client, "GET /groups/", "GET", "/groups/?fields=id,name,date_created")
+    recorder.call(client, "GET /groups/<id>", "GET", f"/groups/{group_id}")
+    recorder.call(client, "GET /groups/<id>/leaderboard", "GET", f"/groups/{group_id}/leaderboard?period=month")
+    recorder.call(client, "GET /marathons/", "GET", "/marathons/")
+    recorder.call(client, "GET /marathons/<id>", "GET", f"/marathons/{marathon_id}")
+
+
+# Each admin worker uses its own group, and the marathons the group isn't enrolled in
+def admin_setup(client, worker):
+    claims = client.login(f"admin{worker % shared_config['groups']}@email.com")
+    status, group, _ = client.request("GET", f"/groups/{claims['group_id']}?fields=marathon_logs")
+    enrolled = {log["marathon"]["id"] for log in group["marathon_logs"]}
+    free = [marathon_id for marathon_id in shared_config["marathon_ids"] if marathon_id not in enrolled]
+    if not free:
+        raise RuntimeError(f"Group {claims['group_id']} is enrolled in every marathon")
+    return {"marathon_ids": free}
+
+
+# Admins enrolling their group in a marathon and removing it again
+def enrol_step(client, recorder, state, rng):
+    marathon_id = rng.choice(state["marathon_ids"])
+    log = recorder.call(client, "POST /marathons/<id>/signup", "POST", f"/marathons/{marathon_id}/signup", expected=(201,))
+    if log:
+        recorder.call(client, "DELETE /marathons/<id>/logs/<id>", "DELETE", f"/marathons/{marathon_id}/logs/{log['id']}")
+
+
+SCENARIOS = {
+    "login": (login_setup, login_step),
+    "workouts": (runner_setup, workouts_step),
+    "browse": (runner_setup, browse_step),
+    "enrol": (admin_setup, enrol_step),
+}
+# Dataset sizes and ids read by the scenarios, filled before the workers start
+shared_config = {}
+
+
+# Loop a scenario until the deadline, results are added to 'results' at the end
+def run_worker(url, scenario, worker, deadline, results, lock):
+    setup, step = SCENARIOS[scenario]
+    client = Client(url)
+    recorder = Recorder()
+    rng = random.Random(worker)
+    try:
+        state = setup(client, worker)
+    except (RuntimeError, KeyError, TypeError) as e:
+        recorder.errors["setup"] = 1
+        recorder.latencies["setup"] = [0.0]
+        print(f"{scenario} worker {worker} could not start: {e}", file=sys.stderr)
+        state = None
+    while state is not None and time.monotonic() < deadline:
+        step(client, recorder, state, rng)
+    with lock:
+        results.append((scenario, recorder))
+
+
+# Nearest rank percentile of sorted values
+def percentile(values, fraction):
+    return values[max(0, int(round(fraction * len(values))) - 1)]
+
+
+# Merge the recorders into rows of (scenario, request, count, errors, p50, p95, p99, req/s)
+def summarise(results, elapsed):
+    merged = {}
+    for scenario, recorder in results:
+        for name, latencies in recorder.latencies.items():
+            entry = merged.setdefault((scenario, name), [[], 0])
+            entry[0] += latencies
+            entry[1] += recorder.errors.get(name, 0)
+        # Every request of the scenario, used for its total row
+        total = merged.setdefault((scenario, "*"), [[], 0])
+        for name, latencies in recorder.latencies.items():
+            total[0] += latencies
+            total[1] += recorder.errors.get(name, 0)
+
+    rows = []
+    for (scenario, name), (latencies, errors) in sorted(merged.items()):
+        latencies.sort()
+        rows.append({
+            "scenario": scenario,
+            "request": name,
+            "count": len(latencies),
+            "error_rate": errors / len(latencies),
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "rps": len(latencies) / elapsed,
+        })
+    return rows
+
+
+# Recreate the tables of DATABASE_URL and seed the dataset the scenarios log in with
+def prepare(args):
+    from main import create_app
+    from init import db
+    from seeding import seed_dataset
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_dataset(users=args.users, groups=args.groups, marathons=args.marathons, workouts_per_user=args.workouts_per_user, seed=args.seed, anchor_date=args.anchor_date)
+    print(f"Seeded {args.users} runners, {args.groups} groups and {args.marathons} marathons")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.prepare:
+        if not os.environ.get("DATABASE_URL"):
+            sys.exit("Set DATABASE_URL to the database the app will use.")
+        prepare(args)
+        return
+
+    mix = {}
+    for part in args.mix.split(","):
+        scenario, _, workers = part.partition("=")
+        if scenario not in SCENARIOS:
+            sys.exit(f"Unknown scenario {scenario}, choose from: {', '.join(SCENARIOS)}")
+        mix[scenario] = int(workers or 1)
+
+    # Ids browsed by the scenarios
+    client = Client(args.url)
+    client.login("runner0@email.com")
+    _, groups, _ = client.request("GET", "/groups/?fields=id")
+    _, marathons, _ = client.request("GET", "/marathons/?fields=id&limit=100")
+    shared_config.update(
+        users=args.users,
+        groups=args.groups,
+        group_ids=[group["id"] for group in groups],
+        marathon_ids=[marathon["id"] for marathon in marathons],
+    )
+
+    print(f"Running {', '.join(f'{workers} {scenario}' for scenario, workers in mix.items())} workers for {args.duration:.0f}s against {args.url}")
+    results, lock, threads = [], threading.Lock(), []
+    start = time.monotonic()
+    deadline = start + args.duration
+    for scenario, workers in mix.items():
+        for worker in range(workers):
+            thread = threading.Thread(target=run_worker, args=(args.url, scenario, worker, deadline, results, lock))
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    rows = summarise(results, elapsed)
+    print(f"{'scenario':<10}{'request':<36}{'count':>8}{'errors':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'req/s':>9}")
+    for row in rows:
+        print(
+            f"{row['scenario']:<10}{row['request']:<36}{row['count']:>8}{row['error_rate']:>8.1%}"
+            f"{row['p50_ms']:>8.1f}ms{row['p95_ms']:>8.1f}ms{row['p99_ms']:>8.1f}ms{row['rps']:>9.1f}"
+        )
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"url": args.url, "duration": elapsed, "mix": mix, "results": rows}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
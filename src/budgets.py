@@ -0,0 +1,181 @@
+# SQL query budgets, to catch N+1 queries added by a new nested field
+# Routes declare the most statements they may run whatever the row count with @query_budget,
+# when QUERY_BUDGETS is "raise" (tests) or "warn" (development) every request is checked
+# Statements run while serialising (lazy loads) are counted apart, their budget defaults to 0
+# Streamed responses are checked once the stream is closed, with the statements run while sending them
+import os
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request, current_app
+from sqlalchemy import event
+
+
+# Folder of the app's modules, statements are reported with the app frame that ran them
+_APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+# Frames of these files are skipped when looking for the call site of a statement
+# serializers.py too, so lazy loads while dumping are reported with the route that dumps
+_SKIPPED_FILES = ("budgets.py", "metrics.py", "serializers.py")
+# Recorders active in the current context, each thread (or greenlet under asgi.py) has its own
+_recorders = ContextVar("query_recorders", default=())
+
+
+# Raised when a request or a block runs more statements than its budget
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# Declare the query budget of a route, put it right under @bp.route
+# eg: @query_budget(4) for at most 4 statements, none of them while serialising
+def query_budget(queries, serialization=0):
+    def decorator(fn):
+        fn.query_budget = (queries, serialization)
+        return fn
+    return decorator
+
+
+# Statements recorded while a recorder is active, as (statement, call site, while serialising)
+class QueryRecorder:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def serialization_count(self):
+        return sum(1 for _, _, serializing in self.statements if serializing)
+
+    # Numbered list of the statements and where they were run from
+    def report(self):
+        lines = []
+        for index, (statement, call_site, serializing) in enumerate(self.statements, start=1):
+            phase = " (while serialising)" if serializing else ""
+            lines.append(f"{index}. {call_site}{phase}\n    {' '.join(statement.split())}")
+        return "\n".join(lines)
+
+
+# Record the statements run inside of the block, eg: in a test
+# with record_queries() as recorder: client.get("/groups/")
+@contextmanager
+def record_queries():
+    recorder = _start_recording()
+    try:
+        yield recorder
+    finally:
+        _stop_recording(recorder)
+
+
+# Fail with the list of statements if the block runs more than max_queries statements
+# or more than max_serialization statements while serialising
+@contextmanager
+def assert_max_queries(max_queries, max_serialization=0):
+    with record_queries() as recorder:
+        yield recorder
+    _check(recorder, (max_queries, max_serialization), "block")
+
+
+class QueryBudgets:
+    def __init__(self, db, app=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    # Call it after db.init_app, so the app's engines exist
+    # Statements are always recorded for record_queries(), budgets are only enforced
+    # when QUERY_BUDGETS is "raise" or "warn"
+    def init_app(self, app):
+        self.mode = app.config.get("QUERY_BUDGETS")
+        if self.mode not in (None, "raise", "warn"):
+            raise ValueError("QUERY_BUDGETS must be 'raise' or 'warn'.")
+        with app.app_context():
+            for engine in self.db.engines.values():
+                event.listen(engine, "before_cursor_execute", _record_statement)
+        if self.mode:
+            app.before_request(self._start_request)
+            app.after_request(self._end_request)
+            app.teardown_request(self._teardown_request)
+        app.extensions["query_budgets"] = self
+
+    def _start_request(self):
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, "query_budget", None)
+        if budget is not None:
+            g.query_budget = budget
+            g.query_recorder = _start_recording()
+
+    def _end_request(self, response):
+        # Streamed responses run their statements while they're sent, they're checked
+        # in _teardown_request once the stream is closed (see stream_with_context)
+        if response.is_streamed and "query_recorder" in g:
+            g.query_streamed = True
+            return response
+        self._check_request()
+        return response
+
+    # Check the statements of a streamed response, stop the recorder of a request that failed
+    def _teardown_request(self, exc=None):
+        if g.pop("query_streamed", False) and exc is None:
+            self._check_request()
+        else:
+            self._stop_request_recording()
+
+    def _check_request(self):
+        recorder = self._stop_request_recording()
+        if recorder is not None:
+            try:
+                _check(recorder, g.query_budget, request.endpoint)
+            except QueryBudgetExceeded as err:
+                if self.mode == "raise":
+                    raise
+                current_app.logger.warning(str(err))
+
+    # Stop the recorder of the request, returns it if it was still running
+    def _stop_request_recording(self):
+        recorder = g.pop("query_recorder", None)
+        if recorder is not None:
+            _stop_recording(recorder)
+        return recorder
+
+
+# Add a recorder to the active recorders of the context
+def _start_recording():
+    recorder = QueryRecorder()
+    _recorders.set(_recorders.get() + (recorder,))
+    return recorder
+
+
+def _stop_recording(recorder):
+    _recorders.set(tuple(active for active in _recorders.get() if active is not recorder))
+
+
+# Raise QueryBudgetExceeded if the recorder went over the budget
+def _check(recorder, budget, name):
+    max_queries, max_serialization = budget
+    if recorder.count > max_queries or recorder.serialization_count > max_serialization:
+        raise QueryBudgetExceeded(
+            f"{name} ran {recorder.count} statements ({recorder.serialization_count} while serialising), "
+            f"budget is {max_queries} ({max_serialization} while serialising):\n{recorder.report()}"
+        )
+
+
+# Engine event adding the statement to every active recorder of the context
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    recorders = _recorders.get()
+    if recorders:
+        call_site, serializing = _call_site()
+        for recorder in recorders:
+            recorder.statements.append((statement, call_site, serializing))
+
+
+# Innermost app frame of the current stack, and whether a schema is being dumped
+def _call_site():
+    stack = traceback.extract_stack()
+    serializing = any("marshmallow" in frame.filename or frame.filename.endswith("serializers.py") for frame in stack)
+    for frame in reversed(stack):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_APP_ROOT) and os.path.basename(filename) not in _SKIPPED_FILES and "site-packages" not in filename:
+            return f"{os.path.relpath(filename, _APP_ROOT)}:{frame.lineno} in {frame.name}", serializing
+    return "unknown", serializing
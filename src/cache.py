@@ -0,0 +1,295 @@
+# Cache for serialised responses of public read routes
+import time
+import functools
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from flask import request, make_response, current_app, g
+
+
+# In-process cache backend, keeps the most recently used entries for up to 'ttl' seconds
+# Other backends only need the same get, set, clear and stats methods
+class LRUTTLCache:
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Return the value stored for key, None if it's missing or expired
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # Store value for key, dropping the least recently used entry if the cache is full
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Return the value stored for key without counting a hit or miss
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None and entry[1] >= time.monotonic() else None
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+# Generations of cache namespaces, kept in the cache_generations table so a write in one
+# worker reaches the caches of every worker. Each worker keeps its copy of a generation for
+# CACHE_GENERATION_TTL seconds (1 by default), so cache hits don't query the DB: the other
+# workers see an invalidation within that delay
+class GenerationStore:
+    def __init__(self, db, app=None):
+        self.db = db
+        self.local = LRUTTLCache(maxsize=10000, ttl=1)
+        self.reads = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.local = LRUTTLCache(maxsize=10000, ttl=app.config.get("CACHE_GENERATION_TTL", 1))
+
+    # (generation, UTC time of the last invalidation) of a namespace, (0, None) until it's first invalidated
+    def get(self, namespace):
+        value = self.local.peek(namespace)
+        if value is not None:
+            return value
+        # Imported on use, the models import init which imports this module
+        from models.cache_generation import CacheGeneration
+        stmt = self.db.select(CacheGeneration.generation, CacheGeneration.changed_at).filter_by(namespace=namespace)
+        # Always from the primary, the replica can hold an older generation
+        row = self.db.session.execute(stmt, bind_arguments={"bind": self.db.engine}).first()
+        self.reads += 1
+        value = (row.generation, row.changed_at) if row else (0, None)
+        self.local.set(namespace, value)
+        return value
+
+    # Move namespaces to a new generation in one statement, commits the session
+    # Returns the new generation of each namespace
+    def bump(self, *namespaces):
+        from models.cache_generation import CacheGeneration
+        from utils import dialect_insert
+        now = _utcnow()
+        stmt = dialect_insert(CacheGeneration).values(
+            [{"namespace": namespace, "generation": 1, "changed_at": now} for namespace in namespaces]
+        ).on_conflict_do_update(
+            index_elements=["namespace"], set_={"generation": CacheGeneration.generation + 1, "changed_at": now},
+        ).returning(CacheGeneration.namespace, CacheGeneration.generation)
+        generations = dict(self.db.session.execute(stmt).all())
+        self.db.session.commit()
+        for namespace, generation in generations.items():
+            self.local.set(namespace, (generation, now))
+        return generations
+
+    # Whether the namespace was invalidated less than READ_REPLICA_STICKY_SECONDS ago,
+    # the replica may not have the write yet
+    def changed_recently(self, namespace):
+        changed_at = self.get(namespace)[1]
+        seconds = current_app.config.get("READ_REPLICA_STICKY_SECONDS", 5)
+        return changed_at is not None and _utcnow() - changed_at < timedelta(seconds=seconds)
+
+    def stats(self):
+        return {"generation_reads": self.reads}
+
+
+# Headers rebuilt with every cached response instead of stored
+CACHED_HEADERS_SKIPPED = ("Content-Type", "Content-Length")
+
+
+class ResponseCache:
+    def __init__(self, db, app=None):
+        self.db = db
+        self.backend = None
+        self.generations = GenerationStore(db)
+        if app is not None:
+            self.init_app(app)
+
+    # RESPONSE_CACHE_BACKEND can be set to any object with the LRUTTLCache methods
+    def init_app(self, app):
+        self.backend = app.config.get("RESPONSE_CACHE_BACKEND") or LRUTTLCache(
+            maxsize=app.config.get("RESPONSE_CACHE_SIZE", 256),
+            ttl=app.config.get("RESPONSE_CACHE_TTL", 60),
+        )
+        self.generations.init_app(app)
+        app.extensions["response_cache"] = self
+
+    # Decorator to cache the successful responses of a route, per path and query string
+    # Entries are keyed by the namespace's generation, hits don't query the DB
+    def cached(self, namespace):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = (namespace, self.generation(namespace), request.full_path)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    body, status, content_type, headers = entry
+                    response = make_response(body, status, headers)
+                    response.content_type = content_type
+                    response.headers["X-Cache"] = "HIT"
+                    return response
+
+                # Right after a write, fill the cache from the primary (see replicas.py),
+                # a lagging replica would be cached until the TTL
+                if self.generations.changed_recently(namespace):
+                    g.read_primary = True
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code == 200:
+                    # Headers of the route, eg: X-Next-Cursor, are cached with the body
+                    headers = [(name, value) for name, value in response.headers if name not in CACHED_HEADERS_SKIPPED]
+                    self.backend.set(key, (response.get_data(), response.status_code, response.content_type, headers))
+                response.headers["X-Cache"] = "MISS"
+                return response
+            return wrapper
+        return decorator
+
+    # Current generation of a namespace, 0 until it's first invalidated
+    def generation(self, namespace):
+        return self.generations.get(namespace)[0]
+
+    # Drop every cached response of a namespace in every worker, call it after committing a write
+    # Moves the namespace to a new generation, old entries are never read again and age out of the backends
+    def invalidate(self, namespace):
+        self.generations.bump(namespace)
+
+    def stats(self):
+        return {**self.backend.stats(), **self.generations.stats()}
+
+
+# Top members of group leaderboards, keyed by (group_id, period, first day of the period)
+# Boards are updated in place when the totals of a member change, so they aren't reloaded
+# after every workout. A board holds the whole group until it has more than 'size' members,
+# then only the top 'size' ones: a member dropping out of a partial board can't be replaced
+# without the DB, so the board is dropped and reloaded on the next read
+# Each board holds the generation of its group, shared through the DB like the response
+# cache's: a write in one worker bumps it and the other workers reload their boards
+class LeaderboardCache:
+    def __init__(self, db, app=None):
+        self.db = db
+        self.backend = None
+        self.size = None
+        self.generations = GenerationStore(db)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    # LEADERBOARD_SIZE: members kept per board, LEADERBOARD_CACHE_SIZE and _TTL: boards kept
+    def init_app(self, app):
+        self.size = app.config.get("LEADERBOARD_SIZE", 100)
+        self.backend = LRUTTLCache(
+            maxsize=app.config.get("LEADERBOARD_CACHE_SIZE", 1024),
+            ttl=app.config.get("LEADERBOARD_CACHE_TTL", 300),
+        )
+        self.generations.init_app(app)
+        app.extensions["leaderboard_cache"] = self
+
+    # Current generation of a group's boards, 0 until they're first invalidated
+    def generation(self, group_id):
+        return self.generations.get(_group_namespace(group_id))[0]
+
+    # Whether a group's boards were invalidated too recently to be loaded from the replica
+    def changed_recently(self, group_id):
+        return self.generations.changed_recently(_group_namespace(group_id))
+
+    # Invalidate the boards of groups in every worker, call it after committing a write
+    # Returns {group_id: (generation this worker had, new generation)}, for update_member
+    def invalidate(self, group_ids):
+        namespaces = {group_id: _group_namespace(group_id) for group_id in group_ids}
+        previous = {group_id: self.generations.local.peek(namespace) for group_id, namespace in namespaces.items()}
+        generations = self.generations.bump(*namespaces.values())
+        return {
+            group_id: (previous[group_id][0] if previous[group_id] else None, generations[namespace])
+            for group_id, namespace in namespaces.items()
+        }
+
+    # Return the entries of a board of that generation, None if it isn't cached
+    def get(self, key, generation):
+        board = self.backend.get(key)
+        if board is None or board["generation"] != generation:
+            return None
+        with self._lock:
+            return list(board["entries"])
+
+    # Store the entries of a board loaded from the DB, sorted and limited to 'size' entries
+    # Fewer entries than 'size' means every member with workouts is in the board
+    def set(self, key, entries, generation):
+        self.backend.set(key, {"entries": list(entries), "complete": len(entries) < self.size, "generation": generation})
+
+    # Replace the entry of a member with their new totals, None if they have none anymore
+    # The board moves from 'previous' to the new generation, a board of another generation
+    # missed a write of another worker and is dropped
+    def update_member(self, key, user_id, entry, previous, generation):
+        with self._lock:
+            board = self.backend.peek(key)
+            if board is None:
+                return
+            if board["generation"] != previous:
+                self.backend.pop(key)
+                return
+            board["generation"] = generation
+            entries = board["entries"]
+            old = next((item for item in entries if item["user"]["id"] == user_id), None)
+            if old is not None:
+                entries.remove(old)
+                # A member of a partial board moved down, someone outside of it may be ahead now
+                if not board["complete"] and (entry is None or leaderboard_sort_key(entry) > leaderboard_sort_key(old)):
+                    self.backend.pop(key)
+                    return
+            if entry is None:
+                return
+            if board["complete"] or old is not None or leaderboard_sort_key(entry) < leaderboard_sort_key(entries[-1]):
+                entries.append(entry)
+                entries.sort(key=leaderboard_sort_key)
+                if len(entries) > self.size:
+                    entries.pop()
+                    board["complete"] = False
+
+    def drop(self, key):
+        self.backend.pop(key)
+
+    # True when no board is cached, so there is nothing to update
+    def is_empty(self):
+        return self.backend.stats()["size"] == 0
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {**self.backend.stats(), **self.generations.stats()}
+
+
+# Generation namespace of a group's leaderboards
+def _group_namespace(group_id):
+    return f"leaderboard:{group_id}"
+
+
+# Order of leaderboard entries: distance first, then calories, then user id to break ties
+def leaderboard_sort_key(entry):
+    return (-entry["total_distance_kms"], -entry["total_calories_burnt"], entry["user"]["id"])
+
+
+# Current UTC time without a timezone, as stored in DateTime columns
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
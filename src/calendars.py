@@ -0,0 +1,125 @@
+# Upcoming marathons of a group or of a member's groups, soonest first, as JSON or iCalendar
+# A page is one query on marathons joined to marathon_logs (and group_logs for a member),
+# following the event_date index from today and the unique (group_id, marathon_id) and
+# (user_id, group_id) indexes of the logs. Pages continue from a cursor on (event_date, id)
+from datetime import date, datetime, timedelta, timezone
+
+from flask import request, Response
+from sqlalchemy import tuple_
+
+from init import db
+from models.marathon import Marathon
+from models.marathon_log import MarathonLog
+from models.group_log import GroupLog
+from utils import get_page_limit, encode_cursor, decode_cursor
+
+
+# Columns of a calendar event
+CALENDAR_COLUMNS = ("id", "name", "event_date", "location", "distance_kms")
+# Formats of the calendar routes
+CALENDAR_FORMATS = ("json", "ics")
+# Longest line of an iCalendar file in octets, longer lines are folded
+ICAL_LINE_LENGTH = 75
+
+
+# Condition selecting the marathons a group is enrolled in
+def group_marathons(group_id):
+    return Marathon.marathon_logs.any(MarathonLog.group_id == group_id)
+
+
+# Condition selecting the marathons of the groups of a member, each marathon once
+# even when several of their groups are enrolled in it
+def member_marathons(user_id):
+    groups = db.select(GroupLog.group_id).filter_by(user_id=user_id)
+    return Marathon.marathon_logs.any(MarathonLog.group_id.in_(groups))
+
+
+# Read the format, limit and cursor of the request and return one page of upcoming marathons:
+# (rows, next_cursor or None), raises ValueError for invalid parameters
+def upcoming_marathons(condition):
+    limit = get_page_limit()
+    stmt = (
+        db.select(*(getattr(Marathon, column) for column in CALENDAR_COLUMNS))
+        # From today in UTC, so every server lists the same marathons whatever its time zone
+        .where(condition, Marathon.event_date >= datetime.now(timezone.utc).date())
+        .order_by(Marathon.event_date, Marathon.id)
+    )
+    # Continue right after the last event of the previous page
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            last_date, last_id = decode_cursor(cursor, 2)
+            last_date, last_id = date.fromisoformat(last_date), int(last_id)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor.")
+        stmt = stmt.where(tuple_(Marathon.event_date, Marathon.id) > (last_date, last_id))
+
+    # Fetch one extra row to know if there is a next page
+    rows = db.session.execute(stmt.limit(limit + 1)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].event_date.isoformat(), rows[-1].id)
+    return rows, None
+
+
+# Fetch the '?format=' query parameter, raises ValueError if it isn't json or ics
+def get_calendar_format():
+    calendar_format = request.args.get("format", "json")
+    if calendar_format not in CALENDAR_FORMATS:
+        raise ValueError(f"Format must be one of: {', '.join(CALENDAR_FORMATS)}.")
+    return calendar_format
+
+
+# Calendar events of the rows, eg: [{"id": 1, "name": "Marathon A", "event_date": "2026-12-12", ...}]
+def calendar_events(rows):
+    return [{**row._asdict(), "event_date": row.event_date.isoformat()} for row in rows]
+
+
+# iCalendar response of the rows, one all day event per marathon
+# The next page cursor is sent in the 'X-Next-Cursor' header like in the JSON response
+def ical_response(rows, title, next_cursor=None):
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Marathon API//Calendar//EN",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_ical_text(title)}",
+    ]
+    for row in rows:
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:marathon-{row.id}@{request.host}",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{row.event_date:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{row.event_date + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{_ical_text(row.name)}",
+            f"LOCATION:{_ical_text(row.location)}",
+            f"DESCRIPTION:{row.distance_kms} kms",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    body = "".join(_fold(line) + "\r\n" for line in lines)
+    return Response(body, mimetype="text/calendar", headers=headers)
+
+
+# Escape the characters with a meaning in iCalendar text values
+def _ical_text(value):
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+# Split a line longer than ICAL_LINE_LENGTH octets, continuation lines start with a space
+def _fold(line):
+    encoded = line.encode("utf-8")
+    if len(encoded) <= ICAL_LINE_LENGTH:
+        return line
+    parts = []
+    while encoded:
+        size = ICAL_LINE_LENGTH if not parts else ICAL_LINE_LENGTH - 1
+        # Don't cut a UTF-8 character in two
+        while size < len(encoded) and (encoded[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(encoded[:size].decode("utf-8"))
+        encoded = encoded[size:]
+    return "\r\n ".join(parts)
@@ -1,12 +1,19 @@
-from datetime import timedelta
 
 from flask import Blueprint, request
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from psycopg2 import errorcodes
 
-from init import db, bcrypt
+from init import db, password_pool, response_cache
+from hashing import PoolSaturatedError
 from models.user import User, UserSchema, user_schema
+from models.group import Group
+from models.group_log import GroupLog
+from utils import user_claims, bump_token_version, issue_token
+from loaders import loader_options
+from leaderboards import refresh_member, remove_member
+from budgets import query_budget
 
 
 # Authorisation blueprint
@@ -16,6 +23,7 @@ auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 # GET method => /auth/register
 # Route for user to register in app
 @auth_bp.route("/register", methods=["POST"])
+@query_budget(5, serialization=4)
 def register_user():
     try:    
         # Get the data from the body of the request, including password
@@ -26,11 +34,11 @@ def register_user():
             name = body_data.get("name"),
             email = body_data.get("email").lower()
         )
-        # If user provides password, hash it
+        # If user provides password, hash it in the bcrypt pool
         password = body_data.get("password")
         
         if password:
-            user.password = bcrypt.generate_password_hash(password).decode("utf-8")
+            user.password = password_pool.generate_password_hash(password)
         # Add and commit to DB
         db.session.add(user)
         db.session.commit()
@@ -42,6 +50,9 @@ def register_user():
             return{"error": f"The column {err.orig.diag.column_name} is required"}, 400
         if err.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
             return {"error": "Email address must be unique"}, 400
+    # Let the app return 503 when the bcrypt pool is full
+    except PoolSaturatedError:
+        raise
     except Exception as e:
         return {"error": f"An unexpected error has occurred {e}"}
 
@@ -49,6 +60,7 @@ def register_user():
 # POST method = auth/login
 # Route for user to login in
 @auth_bp.route("/login", methods = ["POST"])
+@query_budget(3)
 def login_user():
     # Get data from request body
     body_data = request.get_json()
@@ -61,11 +73,17 @@ def login_user():
     stmt = db.select(User).filter_by(email=body_data["email"])
     user = db.session.scalar(stmt)
     
-    # If user exist and password is correct
-    if user and bcrypt.check_password_hash(user.password, body_data.get("password")):
-        # Create token and return it to user
-        token = create_access_token(identity=str(user.id), expires_delta=timedelta(days=1))
-        return{"email": user.email, "token": token}
+    # If user exist and password is correct, checked in the bcrypt pool
+    if user and password_pool.check_password_hash(user.password, body_data.get("password")):
+        # Read the admin claims before a rehash commit expires the user
+        user_id, email, claims = user.id, user.email, user_claims(user)
+        # Rehash the password if it was stored with an outdated bcrypt cost
+        if password_pool.needs_rehash(user.password):
+            user.password = password_pool.generate_password_hash(body_data["password"])
+            db.session.commit()
+        # Create token with the admin claims and return it to user
+        token = issue_token(user_id, claims)
+        return{"email": email, "token": token}
     # else return error msg
     else:
         return {"error": "Invalid credentials"}, 400
@@ -74,6 +92,7 @@ def login_user():
 # PUT, PATCH method => /auth/users/<user_id>
 # Route for users to update their info
 @auth_bp.route("/users/<int:user_id>", methods = ["PUT", "PATCH"])
+@query_budget(10)
 @jwt_required()
 def update_user(user_id):
     try:    
@@ -91,10 +110,16 @@ def update_user(user_id):
             if body_data.get("email") is not None:  
                 user.email = body_data["email"].lower()
             if password is not None:
-                user.password = bcrypt.generate_password_hash(password).decode("utf-8") 
+                user.password = password_pool.generate_password_hash(password)
                 
             # Commit to the DB
             db.session.commit()
+            # Leaderboards show the user's name
+            if body_data.get("name") is not None:
+                refresh_member(get_jwt_identity())
+            # Reload the user with everything user_schema dumps, so groups aren't loaded one by one
+            stmt = db.select(User).options(*loader_options(User, user_schema)).filter_by(id=get_jwt_identity())
+            user = db.session.scalar(stmt)
             # Return an acknowledgement msg
             return user_schema.dump(user)
         else:
@@ -104,6 +129,12 @@ def update_user(user_id):
     except IntegrityError as err:
         if err.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
             return {"error": "Email address must be unique"}, 400
+    # Let the app return 503 when the bcrypt pool is full
+    except PoolSaturatedError:
+        raise
+    # Let the app return 409 when the user was changed by another request
+    except StaleDataError:
+        raise
     # Catches general errors and display info
     except Exception as e:
         return {"error": f"An unexpected error has occurred {e}"}
@@ -112,6 +143,7 @@ def update_user(user_id):
 # DELETE method => /auth/users/<user_id>
 # Route for deleting users, both admin and the actual user can perform this function
 @auth_bp.route("/users/<int:user_id>", methods=["DELETE"])
+@query_budget(12)
 @jwt_required()
 def delete_user(user_id):
     try:
@@ -135,12 +167,23 @@ def delete_user(user_id):
         # Check if the current user is either the user themselves or an admin user
         print(f"Current User ID: {current_user.id}, Is Admin: {current_user.is_admin}")
         if current_user.id == user_id or current_user.is_admin:
-            # Delete the user
+            # Groups whose leaderboards show the user, and the group of an admin deleted with them
+            stmt = db.select(GroupLog.group_id).filter_by(user_id=user_id).union(db.select(Group.id).filter_by(created_by=user_id))
+            group_ids = db.session.scalars(stmt).all()
+            # Expire the user's tokens and delete the user
+            bump_token_version(user_id)
             db.session.delete(user_to_delete)
             db.session.commit()
+            # Deleting an admin deletes their group and its marathon logs
+            response_cache.invalidate("marathons")
+            # The user is removed from the leaderboards of every group they were part of
+            remove_member(user_id, group_ids)
             return {"message": f"{user_to_delete.name} with ID number {user_id} has been successfully deleted."}, 200
         else:
             # Return not authorised msg
             return {"error": "Whoops! You don't have permission to delete this user."}, 403
+    # Let the app return 409 when the user was changed by another request
+    except StaleDataError:
+        raise
     except Exception as e:
         return {"error": "An unexpected error occurred.", "details": str(e)}, 500
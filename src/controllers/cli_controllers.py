@@ -1,5 +1,6 @@
 from datetime import date
 
+import click
 from flask import Blueprint
 
 from init import db, bcrypt
@@ -9,6 +10,10 @@ from models.group import Group
 from models.marathon import Marathon
 from models.marathon_log import MarathonLog
 from models.group_log import GroupLog 
+# Not used by the commands, imported so 'flask db create' creates its table
+from models.cache_generation import CacheGeneration
+from rollups import rebuild_rollups
+from seeding import seed_dataset, SEED_PASSWORD
 
 
 # Create db_commands blueprint
@@ -23,8 +28,30 @@ def create_tables():
 
 # Command to seed the tables
 # Commit the users to be able to create a group
+# With any of the options, seeds a generated dataset of that size instead, eg:
+# flask db seed --users 100000 --groups 500 --workouts-per-user 20 --marathons 1000 --seed 1 --anchor-date 2025-01-01
 @db_commands.cli.command("seed")
-def seed_tables():
+@click.option("--users", type=click.IntRange(min=0), help="Runners to generate.")
+@click.option("--groups", type=click.IntRange(min=0), help="Groups to generate, each one with its admin.")
+@click.option("--workouts-per-user", type=click.IntRange(min=0), help="Workouts logged by each runner.")
+@click.option("--marathons", type=click.IntRange(min=0), help="Marathons to generate.")
+@click.option("--seed", type=int, help="Random seed, the same seed and anchor date give the same data.")
+@click.option("--anchor-date", type=click.DateTime(formats=["%Y-%m-%d"]), help="Date the data is generated around, YYYY-MM-DD, defaults to today.")
+def seed_tables(users, groups, workouts_per_user, marathons, seed, anchor_date):
+    options = {
+        "users": users, "groups": groups, "workouts_per_user": workouts_per_user, "marathons": marathons, "seed": seed,
+        "anchor_date": anchor_date.date() if anchor_date else None,
+    }
+    options = {name: value for name, value in options.items() if value is not None}
+    if options:
+        options.setdefault("anchor_date", date.today())
+        ids = seed_dataset(**options)
+        print(
+            f"Tables seeded with {len(ids['runners'])} runners, {len(ids['groups'])} groups "
+            f"and {len(ids['marathons'])} marathons around {options['anchor_date']}! Every user's password is {SEED_PASSWORD}"
+        )
+        return
+
     # Add users to users table
     users = [
         User(
@@ -137,11 +164,22 @@ def seed_tables():
     # Add created logs to DB
     db.session.add_all(marathon_logs)
 
+    # Build the workout rollups of the seeded workouts
+    rebuild_rollups()
+
     # Commit all changes
     db.session.commit()
     print("Tables seeded!")
 
 
+# Command to recreate the workout rollups from the workouts table
+@db_commands.cli.command("rebuild-rollups")
+def rebuild_workout_rollups():
+    rebuild_rollups()
+    db.session.commit()
+    print("Workout rollups rebuilt!")
+
+
 # Command to drop the tables
 @db_commands.cli.command("drop")
 def drop_tables():
@@ -5,11 +5,17 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy.exc import IntegrityError
 from psycopg2 import errorcodes
 
-from init import db
-from models.group import Group, group_schema, groups_schema
+from init import db, response_cache
+from models.group import Group, GroupSchema, group_schema
 from models.group_log import GroupLog
 from controllers.group_log_controller import group_signup_bp
-from utils import auth_as_admin_decorator, admin_group_check_decorator
+from utils import auth_as_admin_decorator, admin_group_check_decorator, sparse_schema, bump_token_version, issue_token, get_page_limit, PERIODS
+from loaders import loader_options
+from serializers import fast_dump
+from etags import group_fingerprint, make_etag, not_modified, etag_headers
+from leaderboards import leaderboard_key, get_leaderboard, drop_group
+from budgets import query_budget
+from calendars import group_marathons, upcoming_marathons, get_calendar_format, calendar_events, ical_response
 
 
 # Group BP
@@ -19,43 +25,116 @@ group_bp = Blueprint("groups", __name__, url_prefix="/groups")
 group_bp.register_blueprint(group_signup_bp)
 
 
-# GET method => /groups
+# GET method => /groups?fields=&exclude=
 # Route for members to see all groups, JWT required
 @group_bp.route("/")
+@query_budget(4)
 @jwt_required()
 def get_all_groups():
-    # Create and execute stmt, order by asc order
-    stmt = db.select(Group).order_by(Group.name.asc())
+    # Schema limited to the requested fields
+    try:
+        groups_schema = sparse_schema(GroupSchema, many=True)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Create and execute stmt, order by asc order, only load what groups_schema dumps
+    stmt = db.select(Group).options(*loader_options(Group, groups_schema)).order_by(Group.name.asc())
     groups = list(db.session.scalars(stmt))
     
     if groups:
-        # Serialize data using groups_schema
-        return groups_schema.dump(groups), 200
+        # Serialize data using the compiled groups_schema
+        return fast_dump(groups_schema, groups), 200
     # else error msg
     else:
         return {"Error": "No groups created yet."}, 400
 
 
-# GET method => /groups/<group_id>
+# GET method => /groups/<group_id>?fields=&exclude=
 # Route for members to see a specific group
 @group_bp.route("/<int:group_id>")
+@query_budget(4)
 @jwt_required()
 def get_a_group(group_id):
-    # Use stmt and filter_by to select a specific group
-    stmt = db.select(Group).filter_by(id=group_id)
+    # Schema limited to the requested fields
+    try:
+        schema = sparse_schema(GroupSchema)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Answer 304 if the client already has this version of the group
+    fingerprint = group_fingerprint(group_id)
+    if not fingerprint:
+        return {"error": f"Group with {group_id} not found."}, 404
+    etag = make_etag(fingerprint)
+    if not_modified(etag):
+        return "", 304, etag_headers(etag)
+
+    # Use stmt and filter_by to select a specific group, only load what the schema dumps
+    stmt = db.select(Group).options(*loader_options(Group, schema)).filter_by(id=group_id)
     group = db.session.scalar(stmt)
     
     # If group exists, return it, else return error msg
     if group:
-        return group_schema.dump(group), 200
+        return schema.dump(group), 200, etag_headers(etag)
     else:
         return {"error": f"Group with {group_id} not found."}, 404
 
 
+# GET method => /groups/<group_id>/leaderboard?period=week|month|year&limit=
+# Route for members to see the top members of a group for the current period, JWT required
+# Ranked by total distance, then total calories, members without workouts in the period are left out
+@group_bp.route("/<int:group_id>/leaderboard")
+@query_budget(3)
+@jwt_required()
+def get_group_leaderboard(group_id):
+    period = request.args.get("period", "week")
+    if period not in PERIODS:
+        return {"error": f"Period must be one of: {', '.join(PERIODS)}."}, 400
+    try:
+        limit = get_page_limit()
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    entries = get_leaderboard(group_id, period)
+    if entries is None:
+        return {"error": f"Group with {group_id} not found."}, 404
+
+    return {
+        "group_id": group_id,
+        "period": period,
+        "period_start": leaderboard_key(group_id, period)[2].isoformat(),
+        "leaderboard": [{"rank": rank, **entry} for rank, entry in enumerate(entries[:limit], start=1)],
+    }, 200
+
+
+# GET method => /groups/<group_id>/calendar?format=json|ics&limit=&cursor=
+# Route for members to see the upcoming marathons a group is enrolled in, soonest first, JWT required
+# Next page cursor is sent in the 'X-Next-Cursor' header when more marathons exist
+@group_bp.route("/<int:group_id>/calendar")
+@query_budget(2)
+@jwt_required()
+def get_group_calendar(group_id):
+    try:
+        calendar_format = get_calendar_format()
+        rows, next_cursor = upcoming_marathons(group_marathons(group_id))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Only check the group when it has no upcoming marathons
+    if not rows and db.session.scalar(db.select(Group.id).filter_by(id=group_id)) is None:
+        return {"error": f"Group with {group_id} not found."}, 404
+
+    if calendar_format == "ics":
+        return ical_response(rows, f"Group {group_id} marathons", next_cursor)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return {"group_id": group_id, "marathons": calendar_events(rows)}, 200, headers
+
+
 # POST method => /groups/register
 # Route to create group (only admin allowed, one group per admin)
 # @admin_group_check decorator ensure admin hasn't created a group yet
 @group_bp.route("/register", methods=["POST"])
+@query_budget(9, serialization=4)
 @jwt_required()
 @auth_as_admin_decorator
 @admin_group_check_decorator
@@ -74,11 +153,14 @@ def create_a_group():
             created_by=user_id  
         )
         # Add the new group to DB, and return acknowledgment msg
+        # The admin's token claims no longer hold their group, expire them
         db.session.add(group)
+        token_version = bump_token_version(user_id)
         db.session.commit()
 
-        # Return the created group
-        return group_schema.dump(group), 201
+        # Return the created group, with a token holding the new group for the admin's next requests
+        token = issue_token(user_id, {"is_admin": True, "group_id": group.id, "token_version": token_version})
+        return {**group_schema.dump(group), "token": token}, 201
     # Returns personalised msgs for data violation and general errors
     except IntegrityError as err:
         if err.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
@@ -90,6 +172,7 @@ def create_a_group():
 # PUT, PATCH methods => /groups/<group_id>
 # Route for admins to update their group
 @group_bp.route("/<int:group_id>", methods=["PUT", "PATCH"])
+@query_budget(8)
 @jwt_required()
 @auth_as_admin_decorator
 def update_group(group_id):
@@ -117,12 +200,16 @@ def update_group(group_id):
     
     # Commit changes to the DB and return the updated group
     db.session.commit()
+    # Reload the group with everything group_schema dumps, so members aren't loaded one by one
+    stmt = db.select(Group).options(*loader_options(Group, group_schema)).filter_by(id=group_id)
+    group = db.session.scalar(stmt)
     return group_schema.dump(group), 200
 
 
 # DELETE method => /groups/<group_id>
 # Route for admin to delete their group
 @group_bp.route("/<int:group_id>", methods=["DELETE"])
+@query_budget(12)
 @jwt_required()
 @auth_as_admin_decorator
 def delete_group(group_id):
@@ -143,7 +230,14 @@ def delete_group(group_id):
         return {"error": "You are not authorised to delete this group."}, 403  
 
     # If the group exists, delete it and return acknowledgment msg
+    # The admin's token claims still hold the deleted group, expire them
     db.session.delete(group)
+    token_version = bump_token_version(group.created_by)
     db.session.commit()
+    # Deleting the group deletes its marathon logs too
+    response_cache.invalidate("marathons")
+    drop_group(group_id)
     
-    return {"message": f"Group {group.id} has been deleted successfully!"}, 200
+    # Token without the deleted group for the admin's next requests
+    token = issue_token(user_id, {"is_admin": True, "group_id": None, "token_version": token_version})
+    return {"message": f"Group {group.id} has been deleted successfully!", "token": token}, 200
@@ -1,3 +1,5 @@
+from datetime import date
+
 from flask import Blueprint
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
@@ -5,6 +7,9 @@ from init import db
 from models.user import User
 from models.group import Group
 from models.group_log import GroupLog  
+from utils import insert_or_ignore
+from leaderboards import refresh_member, remove_member
+from budgets import query_budget
 
 
 # Create a blueprint for group enrollment
@@ -15,6 +20,7 @@ group_signup_bp = Blueprint("join", __name__, url_prefix="/<int:group_id>")
 # Route for regular users to join a specific group
 # Admin are only allowed to be part of their created group
 @group_signup_bp.route("/join", methods=["POST"])  
+@query_budget(5)
 @jwt_required()
 def join_group(group_id):
 
@@ -30,27 +36,30 @@ def join_group(group_id):
         if group is None:
             return {"error": "Group not found, ensure group exists first."}, 404
 
-    # Error msg if user is part of the group already
-    existing_entry = GroupLog.query.filter_by(user_id=user.id, group_id=group.id).first()
-    if existing_entry:
-        return {"error": "You are already a member of this group."}, 400
-    
     # Prevent admins from joining any group
     if user.is_admin:
         return {"error": "Admins are only allowed to be part of their created group."}, 403
 
-    # Create a new entry and add to the junction table
-    new_entry = GroupLog(user_id=user.id, group_id=group.id)
-    db.session.add(new_entry)
+    # Add the entry to the junction table in one statement
+    # The unique (user_id, group_id) constraint skips the insert if user is part of the group already
+    stmt = insert_or_ignore(GroupLog, ["user_id", "group_id"], user_id=user.id, group_id=group.id, entry_created=date.today())
+    result = db.session.execute(stmt)
+    if result.rowcount == 0:
+        return {"error": "You are already a member of this group."}, 400
+    # Build the acknowledgment msg before commit expires user and group
+    message = f"{user.name} is officially part of the group named {group.name}."
     db.session.commit()
+    # Add the new member to the group's cached leaderboards
+    refresh_member(user_id, [group_id])
 
     # return acknowledgment msg
-    return {"message": f"{user.name} is officially part of the group named {group.name}."}, 201
+    return {"message": message}, 201
     
 
 # DELETE method => /groups/<group_id>/unsubscribe
 # Route for regular users to leave a specific group
 @group_signup_bp.route("/unsubscribe", methods=["DELETE"]) 
+@query_budget(5)
 @jwt_required()
 def leave_group(group_id):
 
@@ -77,7 +86,11 @@ def leave_group(group_id):
         return {"error": "Whoops! You can not leave your own group."}, 403
 
     # Remove the entry and return acknowledgment msg
+    # Build the acknowledgment msg before commit expires group
+    message = f"You have successfully left the group named {group.name}."
     db.session.delete(entry)
     db.session.commit()
+    # Remove the member from the group's leaderboards
+    remove_member(user_id, [group_id])
 
-    return {"message": f"You have successfully left the group named {group.name}."}, 200
+    return {"message": message}, 200
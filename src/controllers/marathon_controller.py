@@ -2,49 +2,177 @@ from datetime import date, datetime
 
 from flask import Blueprint, request
 from flask_jwt_extended import jwt_required
+from sqlalchemy import tuple_
 from sqlalchemy.exc import IntegrityError, DataError
 from psycopg2 import errorcodes
 
-from init import db
-from models.marathon import Marathon, marathon_schema, marathons_schema
+from init import db, response_cache
+from models.marathon import Marathon, MarathonSchema, marathon_schema
 from models.user import User
-from utils import auth_as_admin_decorator
+from utils import auth_as_admin_decorator, sparse_schema, get_page_limit, encode_cursor, decode_cursor
 from controllers.marathon_log_controller import marathon_signup_bp
+from loaders import loader_options
+from serializers import fast_dump
+from etags import marathon_fingerprint, make_etag, not_modified, etag_headers
+from budgets import query_budget
 
 # Create Marathon bp
 marathon_bp = Blueprint("marathons", __name__,url_prefix="/marathons")
 # Register marathon_signup bp
 marathon_bp.register_blueprint(marathon_signup_bp)
 
+# Columns marathons can be sorted by with '?sort='
+MARATHON_SORTS = {
+    "name": Marathon.name,
+    "event_date": Marathon.event_date,
+    "distance_kms": Marathon.distance_kms,
+}
 
-# GET method => /marathons
-# Route for users and admins to see all marathons 
+
+# GET method => /marathons?limit=&cursor=&fields=&exclude=&from=&to=&upcoming=&location=&min_distance=&max_distance=&sort=
+# Route for users and admins to see the marathons, or the ones matching the filters, one page at a time
+# Next page cursor is sent in the 'X-Next-Cursor' header when more marathons exist
+# Responses are cached until a marathon or marathon log changes
 @marathon_bp.route("/")
+@query_budget(3)
+@response_cache.cached("marathons")
 def get_all_marathons():
-    # Fetch marathons from DB
-    stmt = db.select(Marathon).order_by(Marathon.name.asc())
-    marathons = list(db.session.scalars(stmt))
+    # Page size, schema limited to the requested fields, and the filters and order of the query
+    try:
+        limit = get_page_limit()
+        marathons_schema = sparse_schema(MarathonSchema, many=True)
+        filters = marathon_filters()
+        sort, descending = marathon_sort()
+        after = marathon_cursor(sort, descending)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Fetch marathons from DB, only load what marathons_schema dumps, plus the sort keys of the cursor
+    column = MARATHON_SORTS[sort]
+    stmt = (
+        db.select(Marathon)
+        .options(*loader_options(Marathon, marathons_schema, Marathon.id, column))
+        .where(*filters)
+        .order_by(*((column.desc(), Marathon.id.desc()) if descending else (column.asc(), Marathon.id.asc())))
+    )
+    # Continue right after the last marathon of the previous page
+    if after is not None:
+        stmt = stmt.where(after)
+    # Fetch one extra row to know if there is a next page
+    marathons = list(db.session.scalars(stmt.limit(limit + 1)))
     
     if marathons:
-        # Serialise data using marathons_schema
-        return marathons_schema.dump(marathons), 200
+        headers = {}
+        if len(marathons) > limit:
+            marathons = marathons[:limit]
+            last = marathons[-1]
+            value = getattr(last, sort)
+            headers["X-Next-Cursor"] = encode_cursor(sort, value.isoformat() if isinstance(value, date) else value, last.id)
+        # Serialise data using the compiled marathons_schema
+        return fast_dump(marathons_schema, marathons), 200, headers
     # Else returns error msg
+    elif filters:
+        return {"Error": "No marathons match the search."}, 400
     else:
         return {"Error": "No marathons created yet."}, 400
 
 
-# GET method => /marathons/<marathon_id>
+# Conditions of the search query parameters, raises ValueError for invalid values
+# from/to: event_date range (inclusive), upcoming=true: events from today on
+# location: case insensitive substring, min_distance/max_distance: distance_kms range
+def marathon_filters():
+    filters = []
+    try:
+        date_from = date.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        date_to = date.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        raise ValueError("Invalid date format. Use YYYY-MM-DD.")
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("The from date must be before the to date.")
+    if request.args.get("upcoming", "").lower() in ("true", "1"):
+        date_from = max(date_from or date.today(), date.today())
+    if date_from:
+        filters.append(Marathon.event_date >= date_from)
+    if date_to:
+        filters.append(Marathon.event_date <= date_to)
+
+    location = request.args.get("location", "").strip()
+    if location:
+        # Escape the LIKE wildcards typed by the user, so they match literally
+        pattern = location.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        filters.append(Marathon.location.ilike(f"%{pattern}%", escape="\\"))
+
+    try:
+        min_distance = int(request.args["min_distance"]) if request.args.get("min_distance") else None
+        max_distance = int(request.args["max_distance"]) if request.args.get("max_distance") else None
+    except ValueError:
+        raise ValueError("Distances must be whole numbers of kms.")
+    if min_distance is not None:
+        filters.append(Marathon.distance_kms >= min_distance)
+    if max_distance is not None:
+        filters.append(Marathon.distance_kms <= max_distance)
+    return filters
+
+
+# Column and direction of the '?sort=' query parameter, eg: sort=-event_date for the latest first
+# Ties are ordered by id in the same direction so the order, and the pages, are stable
+def marathon_sort():
+    sort = request.args.get("sort", "name")
+    if sort.lstrip("-") not in MARATHON_SORTS:
+        raise ValueError(f"Sort must be one of: {', '.join(MARATHON_SORTS)}, with a leading '-' for descending order.")
+    return sort.lstrip("-"), sort.startswith("-")
+
+
+# Condition of the rows after the '?cursor=' of the previous page, None on the first page
+# The cursor holds the sort it was made for, it can't be used with another sort
+def marathon_cursor(sort, descending):
+    cursor = request.args.get("cursor")
+    if not cursor:
+        return None
+    try:
+        cursor_sort, value, last_id = decode_cursor(cursor, 3)
+        if cursor_sort != sort:
+            raise ValueError
+        if sort == "event_date":
+            value = date.fromisoformat(value)
+        elif sort == "distance_kms":
+            value = int(value)
+        elif not isinstance(value, str):
+            raise ValueError
+        last_id = int(last_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    keys = tuple_(MARATHON_SORTS[sort], Marathon.id)
+    return keys < (value, last_id) if descending else keys > (value, last_id)
+
+
+# GET method => /marathons/<marathon_id>?fields=&exclude=
 # Route for users and admins to see a specific marathon
 @marathon_bp.route("/<int:marathon_id>")
+@query_budget(3)
 @jwt_required()
 def get_a_marathon(marathon_id):
-    # filter_by to select a specific workout
-    stmt = db.select(Marathon).filter_by(id=marathon_id)
+    # Schema limited to the requested fields
+    try:
+        schema = sparse_schema(MarathonSchema)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Answer 304 if the client already has this version of the marathon
+    fingerprint = marathon_fingerprint(marathon_id)
+    if not fingerprint:
+        return {"error": f"Marathon with {marathon_id} not found."}, 404
+    etag = make_etag(fingerprint)
+    if not_modified(etag):
+        return "", 304, etag_headers(etag)
+
+    # filter_by to select a specific marathon, only load what the schema dumps
+    stmt = db.select(Marathon).options(*loader_options(Marathon, schema)).filter_by(id=marathon_id)
     marathon = db.session.scalar(stmt)
     
     # If marathon returns it, Else returns error msg
     if marathon:
-        return marathon_schema.dump(marathon)
+        return schema.dump(marathon), 200, etag_headers(etag)
     else:
         return {"error": f"Marathon with {marathon_id} not found."}, 404
 
@@ -52,6 +180,7 @@ def get_a_marathon(marathon_id):
 # POST method => /marathons/register
 # Route for admins to create marathons, more than one allowed per admin.
 @marathon_bp.route("/register", methods=["POST"])
+@query_budget(5, serialization=2)
 @jwt_required()
 @auth_as_admin_decorator
 def register_marathon():
@@ -78,6 +207,7 @@ def register_marathon():
         # Add and commit to the DB
         db.session.add(marathon)
         db.session.commit()
+        response_cache.invalidate("marathons")
         # Return acknowledgment message
         return marathon_schema.dump(marathon), 201
     # Return personalised msgs for data violations and invalid data
@@ -94,6 +224,7 @@ def register_marathon():
 # Route for admins to update marathons events, 
 # All admins are allowed to update info on marathon events.
 @marathon_bp.route("/<int:marathon_id>", methods=["PUT", "PATCH"])
+@query_budget(6, serialization=2)
 @jwt_required()
 @auth_as_admin_decorator
 def update_marathon(marathon_id):
@@ -123,6 +254,7 @@ def update_marathon(marathon_id):
     # Commit changes to DB and handle potential errors
     try:
         db.session.commit()
+        response_cache.invalidate("marathons")
         return marathon_schema.dump(marathon), 200
     except DataError:
         return {"error": "Invalid input for integer value, only numbers allowed."}, 400
@@ -134,6 +266,7 @@ def update_marathon(marathon_id):
 # Route for admin to delete marathon event
 # All admins are allowed to delete the marathons events
 @marathon_bp.route("/<int:marathon_id>", methods=["DELETE"])
+@query_budget(5)
 @jwt_required()
 @auth_as_admin_decorator
 def delete_marathon(marathon_id):
@@ -145,6 +278,7 @@ def delete_marathon(marathon_id):
     if marathon:    
         db.session.delete(marathon)
         db.session.commit()
+        response_cache.invalidate("marathons")
         return {"message": f"{marathon.name} event has been deleted successfully!"}, 200
     else:
         return {"error": f"Marathon with ID {marathon_id} has been not found."}, 404
@@ -1,15 +1,15 @@
 from datetime import date
 
 from flask import Blueprint
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy.exc import SQLAlchemyError
+from flask_jwt_extended import jwt_required
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from psycopg2 import errorcodes
 
-from init import db
+from init import db, response_cache
 from models.marathon_log import MarathonLog, marathon_log_schema
-from models.group import Group
-from models.marathon import Marathon
-from models.group_log import GroupLog
-from utils import auth_as_admin_decorator
+from utils import auth_as_admin_decorator, get_admin_claims, insert_or_ignore
+from loaders import loader_options
+from budgets import query_budget
 
 
 # Create marathon sign up blueprint
@@ -19,45 +19,46 @@ marathon_signup_bp = Blueprint("signup", __name__,url_prefix="/<int:marathon_id>
 # Route for admin to enrol their group in marathon event 
 # marathons/<marathon_id>/signup
 @marathon_signup_bp.route("/signup", methods=["POST"])
+@query_budget(5)
 @jwt_required()
 @auth_as_admin_decorator
 def marathon_registration(marathon_id):
     try:
-        # Get the admin user ID from the JWT token
-        admin_id = get_jwt_identity()
-
-        # Fetch the group associated with the admin (owner of the group)
-        stmt = db.select(Group).filter_by(created_by=admin_id)
-        group = db.session.scalar(stmt)
+        # Get the group owned by the admin from the JWT claims
+        is_admin, group_id = get_admin_claims()
         
         # If no group exists, instruct the admin to create a group first
-        if not group:
+        if group_id is None:
             return {"error": "You don't have a group to enroll, please create a group first."}, 404
 
-        # Check if the specified marathon exists
-        marathon = Marathon.query.get(marathon_id)
-        if not marathon:
-            return {"error": "The requested marathon doesn't exist, please choose an available event."}, 404
-        
-        # Check if the group is already signed up for this marathon
-        existing_log = MarathonLog.query.filter_by(group_id=group.id, marathon_id=marathon_id).first()
-        if existing_log:
-            return {"error": "This group is already enrolled in this marathon."}, 400
-
-        # Create a new log entry for the marathon
-        log_entry = MarathonLog(
+        # Create the log entry in one statement, the unique (group_id, marathon_id)
+        # constraint skips the insert if the group is already signed up for this marathon
+        stmt = insert_or_ignore(
+            MarathonLog,
+            ["group_id", "marathon_id"],
             entry_created=date.today(),
-            group_id=group.id,
+            group_id=group_id,
             marathon_id=marathon_id
         )
-
-        # Add the log entry to the database session
-        db.session.add(log_entry)
+        log_id = db.session.scalar(stmt.returning(MarathonLog.id))
         db.session.commit()
+        if log_id is None:
+            return {"error": "This group is already enrolled in this marathon."}, 400
+        response_cache.invalidate("marathons")
+
+        # Reload the entry with everything marathon_log_schema dumps, so members aren't loaded one by one
+        stmt = db.select(MarathonLog).options(*loader_options(MarathonLog, marathon_log_schema)).filter_by(id=log_id)
+        log_entry = db.session.scalar(stmt)
 
         # Return the marathon log entry
-        return {marathon_log_schema.dump(log_entry), 201}
+        return marathon_log_schema.dump(log_entry), 201
 
+    # The marathon_id foreign key fails if the marathon doesn't exist
+    except IntegrityError as err:
+        db.session.rollback()
+        if err.orig.pgcode == errorcodes.FOREIGN_KEY_VIOLATION:
+            return {"error": "The requested marathon doesn't exist, please choose an available event."}, 404
+        return {"error": "A database error has occurred. Please try again."}, 500
     # Handle DB and other possible errors
     except SQLAlchemyError:
         return {"error": "A database error has occurred. Please try again."}, 500
@@ -68,11 +69,12 @@ def marathon_registration(marathon_id):
 # Route for admin to remove their group from marathon event
 # /<marathon_id>/logs/<log_id>
 @marathon_signup_bp.route("/logs/<int:log_id>", methods=["DELETE"])
+@query_budget(4)
 @jwt_required()
 @auth_as_admin_decorator
 def delete_log(marathon_id, log_id):
-    # Get the admin user ID from the JWT token
-    admin_id = get_jwt_identity()
+    # Get the group owned by the admin from the JWT claims
+    is_admin, group_id = get_admin_claims()
 
     # Fetch the log entry
     log = MarathonLog.query.filter_by(id=log_id, marathon_id=marathon_id).first()
@@ -81,20 +83,14 @@ def delete_log(marathon_id, log_id):
     if not log:
         return {"message": f"Log with id {log_id} in marathon {marathon_id} was not found."}, 404
 
-    # Fetch the group associated with the log
-    group = Group.query.get(log.group_id)
-
-    # If no group found, return error msg
-    if not group:
-        return {"message": "Group associated with this log entry was not found."}, 404
-
-    # Check if the current user is the owner of the group
-    if int(group.created_by) != int(admin_id):
+    # Check if the current user is the owner of the group associated with the log
+    if log.group_id != group_id:
         return {"message": "You are not authorised to remove this group from the marathon event."}, 403
 
     # Delete the log entry
     db.session.delete(log)
     db.session.commit()
+    response_cache.invalidate("marathons")
 
     # Return acknowledgment message
     return {"message": "Your group has been successfully removed from this event."}, 200
@@ -0,0 +1,28 @@
+from flask import Blueprint
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from calendars import member_marathons, upcoming_marathons, get_calendar_format, calendar_events, ical_response
+from budgets import query_budget
+
+
+# Create blueprint for the routes about the current user
+me_bp = Blueprint("me", __name__, url_prefix="/me")
+
+
+# GET method => /me/calendar?format=json|ics&limit=&cursor=
+# Route for users to see the upcoming marathons of all their groups, soonest first, JWT required
+# Each marathon is listed once, next page cursor is sent in the 'X-Next-Cursor' header
+@me_bp.route("/calendar")
+@query_budget(1)
+@jwt_required()
+def get_my_calendar():
+    try:
+        calendar_format = get_calendar_format()
+        rows, next_cursor = upcoming_marathons(member_marathons(get_jwt_identity()))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    if calendar_format == "ics":
+        return ical_response(rows, "My marathons", next_cursor)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return {"marathons": calendar_events(rows)}, 200, headers
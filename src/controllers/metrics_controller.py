@@ -0,0 +1,16 @@
+from flask import Blueprint, Response
+
+from init import metrics
+from budgets import query_budget
+
+
+# Create metrics blueprint
+metrics_bp = Blueprint("metrics", __name__)
+
+
+# Method => GET, Route: /metrics
+# Route for Prometheus to scrape the request, SQL, bcrypt pool and cache metrics
+@metrics_bp.route("/metrics")
+@query_budget(0)
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -1,50 +1,262 @@
+import io
+import csv
+import json
 from datetime import date
 
-from flask import Blueprint, request
+from flask import Blueprint, request, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import tuple_, func
 from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.orm.exc import StaleDataError
+from marshmallow.exceptions import ValidationError
 from psycopg2 import errorcodes
 
 from init import db
-from models.workout import Workout, workout_schema, workouts_schema
+from models.workout import Workout, WorkoutSchema, workout_schema
+from models.workout_rollup import WorkoutRollup
+from utils import get_page_limit, encode_cursor, decode_cursor, sparse_schema, PERIODS, period_start_expression, period_start, period_end
+from rollups import add_workouts, refresh_rollups
+from leaderboards import refresh_member
+from loaders import loader_options
+from serializers import fast_dump
+from etags import workouts_fingerprint, make_etag, not_modified, etag_headers
+from budgets import query_budget
 
 
 # Create workout blueprint
 workout_bp = Blueprint("workouts", __name__,url_prefix="/workouts")
 
+# Number of workouts validated and inserted at once by the bulk import route
+BULK_CHUNK_SIZE = 1000
+# Number of rows fetched at once from the DB cursor by the export route
+EXPORT_CHUNK_SIZE = 1000
+# Columns written by the export route
+EXPORT_COLUMNS = ("id", "title", "date", "distance_kms", "calories_burnt")
 
-# Method => GET, Route: /workouts/
-# Route for users to see all their workout sessions, JWT required
+
+# Method => GET, Route: /workouts/?limit=&cursor=&fields=&exclude=
+# Route for users to see their workout sessions one page at a time, JWT required
+# Next page cursor is sent in the 'X-Next-Cursor' header when more workouts exist
 @workout_bp.route("/")
+@query_budget(2)
 @jwt_required()
 def get_all_workouts():
     # Get the current user's identity from the JWT token
     current_user = get_jwt_identity()
 
-    # Create and execute statement, filter by user's ID, order by desc date
-    stmt = db.select(Workout).filter_by(user_id=current_user).order_by(Workout.date.desc())
-    workouts = list(db.session.scalars(stmt))
-    
+    # Fetch page size and the schema limited to the requested fields
+    try:
+        limit = get_page_limit()
+        workouts_schema = sparse_schema(WorkoutSchema, many=True)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Fetch the optional cursor returned by the previous page
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            last_date, last_id = decode_cursor(cursor, 2)
+            last_date, last_id = date.fromisoformat(last_date), int(last_id)
+        except (ValueError, TypeError):
+            return {"error": "Invalid cursor."}, 400
+
+    # Answer 304 if the client already has this version of the page
+    etag = make_etag((current_user, *workouts_fingerprint(current_user)))
+    if not_modified(etag):
+        return "", 304, etag_headers(etag)
+
+    # Create statement, filter by user's ID, order by desc date and id to keep pages stable
+    # Only load what workouts_schema dumps, plus the date needed for the next cursor
+    stmt = (
+        db.select(Workout)
+        .options(*loader_options(Workout, workouts_schema, Workout.date))
+        .filter_by(user_id=current_user)
+        .order_by(Workout.date.desc(), Workout.id.desc())
+    )
+    # Continue right after the last row of the previous page
+    if cursor:
+        stmt = stmt.where(tuple_(Workout.date, Workout.id) < (last_date, last_id))
+    # Fetch one extra row to know if there is a next page
+    workouts = list(db.session.scalars(stmt.limit(limit + 1)))
+
     if workouts:
-        # Serialize data using workouts_schema
-        return workouts_schema.dump(workouts), 200
+        headers = etag_headers(etag)
+        if len(workouts) > limit:
+            workouts = workouts[:limit]
+            last = workouts[-1]
+            headers["X-Next-Cursor"] = encode_cursor(last.date.isoformat(), last.id)
+        # Serialize data using the compiled workouts_schema
+        return fast_dump(workouts_schema, workouts), 200, headers
     else:
         # Else return error msg
         return {"Error": "No workout logs to display for this user."}, 400
 
 
-# Method => GET, Route: /workouts/<workout_id>
+# Method => GET, Route: /workouts/export?format=ndjson|csv
+# Route for users to download every workout session they logged, JWT required
+# Rows are streamed from a server side cursor, so memory stays flat for any number of workouts
+# The query runs while the response is sent, it's counted in the budget and metrics when the stream closes
+@workout_bp.route("/export")
+@query_budget(1)
+@jwt_required()
+def export_workouts():
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        return {"error": "Format must be ndjson or csv."}, 400
+
+    # Only select the exported columns, yield_per fetches them in chunks
+    stmt = (
+        db.select(*(getattr(Workout, column) for column in EXPORT_COLUMNS))
+        .filter_by(user_id=get_jwt_identity())
+        .order_by(Workout.date.desc(), Workout.id.desc())
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+
+    def generate():
+        result = db.session.execute(stmt)
+        if export_format == "csv":
+            yield ",".join(EXPORT_COLUMNS) + "\r\n"
+        for partition in result.partitions():
+            buffer = io.StringIO()
+            if export_format == "csv":
+                writer = csv.writer(buffer)
+                writer.writerows((row.id, row.title, row.date, row.distance_kms, row.calories_burnt) for row in partition)
+            else:
+                for row in partition:
+                    buffer.write(json.dumps({
+                        "id": row.id,
+                        "title": row.title,
+                        "date": row.date.isoformat() if row.date else None,
+                        "distance_kms": row.distance_kms,
+                        "calories_burnt": row.calories_burnt,
+                    }))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f"attachment; filename=workouts.{export_format}"}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
+# Method => GET, Route: /workouts/stats?period=week|month|year&from=YYYY-MM-DD&to=YYYY-MM-DD
+# Route for users to see totals, averages and best sessions per period, JWT required
+# from and to are optional and inclusive, when they match the bounds of periods the stats
+# are read from the workout_rollups table, else they are computed with a GROUP BY on workouts
+@workout_bp.route("/stats")
+@query_budget(1)
+@jwt_required()
+def get_workout_stats():
+    period = request.args.get("period", "week")
+    if period not in PERIODS:
+        return {"error": f"Period must be one of: {', '.join(PERIODS)}."}, 400
+    try:
+        date_from = date.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        date_to = date.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        return {"error": "Invalid date format. Use YYYY-MM-DD."}, 400
+    if date_from and date_to and date_from > date_to:
+        return {"error": "The from date must be before the to date."}, 400
+
+    # Whole periods are read from the rollups, one row per period
+    if (date_from is None or date_from == period_start(period, date_from)) and (
+        date_to is None or date_to == period_end(period, date_to)
+    ):
+        buckets = _rollup_stats(get_jwt_identity(), period, date_from, date_to)
+    else:
+        buckets = _workout_stats(get_jwt_identity(), period, date_from, date_to)
+    return {
+        "period": period,
+        "from": date_from.isoformat() if date_from else None,
+        "to": date_to.isoformat() if date_to else None,
+        "stats": buckets,
+    }, 200
+
+
+# Stats per period computed from the workout_rollups table
+def _rollup_stats(user_id, period, date_from, date_to):
+    stmt = (
+        db.select(WorkoutRollup)
+        .filter_by(user_id=user_id, period=period)
+        .order_by(WorkoutRollup.period_start)
+    )
+    if date_from:
+        stmt = stmt.where(WorkoutRollup.period_start >= date_from)
+    if date_to:
+        stmt = stmt.where(WorkoutRollup.period_start <= date_to)
+
+    # Calories are optional, so they are averaged over the workouts that have them like AVG() does
+    return [
+        {
+            "period_start": rollup.period_start.isoformat(),
+            "count": rollup.count,
+            "total_distance_kms": rollup.total_distance_kms,
+            "total_calories_burnt": rollup.total_calories_burnt if rollup.calories_count else None,
+            "avg_distance_kms": round(rollup.total_distance_kms / rollup.count, 2),
+            "avg_calories_burnt": round(rollup.total_calories_burnt / rollup.calories_count, 2) if rollup.calories_count else None,
+            "max_distance_kms": rollup.max_distance_kms,
+            "max_calories_burnt": rollup.max_calories_burnt,
+        }
+        for rollup in db.session.scalars(stmt)
+    ]
+
+
+# Stats per period computed by the DB in a single GROUP BY query on workouts
+def _workout_stats(user_id, period, date_from, date_to):
+    period_start = period_start_expression(period, Workout.date).label("period_start")
+    stmt = (
+        db.select(
+            period_start,
+            func.count(Workout.id).label("count"),
+            func.sum(Workout.distance_kms).label("total_distance_kms"),
+            func.sum(Workout.calories_burnt).label("total_calories_burnt"),
+            func.avg(Workout.distance_kms).label("avg_distance_kms"),
+            func.avg(Workout.calories_burnt).label("avg_calories_burnt"),
+            func.max(Workout.distance_kms).label("max_distance_kms"),
+            func.max(Workout.calories_burnt).label("max_calories_burnt"),
+        )
+        .filter_by(user_id=user_id)
+        .group_by(period_start)
+        .order_by(period_start)
+    )
+    if date_from:
+        stmt = stmt.where(Workout.date >= date_from)
+    if date_to:
+        stmt = stmt.where(Workout.date <= date_to)
+
+    return [
+        {
+            "period_start": str(row.period_start),
+            "count": row.count,
+            "total_distance_kms": row.total_distance_kms,
+            "total_calories_burnt": row.total_calories_burnt,
+            "avg_distance_kms": round(float(row.avg_distance_kms), 2) if row.avg_distance_kms is not None else None,
+            "avg_calories_burnt": round(float(row.avg_calories_burnt), 2) if row.avg_calories_burnt is not None else None,
+            "max_distance_kms": row.max_distance_kms,
+            "max_calories_burnt": row.max_calories_burnt,
+        }
+        for row in db.session.execute(stmt)
+    ]
+
+
+# Method => GET, Route: /workouts/<workout_id>?fields=&exclude=
 # Route for users to see a specific workout session, JWT required
 @workout_bp.route("/<int:workout_id>")
+@query_budget(1)
 @jwt_required()
 def get_a_workout(workout_id):
-    # Use stmt and filter_by to select a specific workout
-    stmt = db.select(Workout).filter_by(id=workout_id)
+    # Schema limited to the requested fields
+    try:
+        schema = sparse_schema(WorkoutSchema)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    # Use stmt and filter_by to select a specific workout, only load what the schema dumps
+    stmt = db.select(Workout).options(*loader_options(Workout, schema)).filter_by(id=workout_id)
     workout = db.session.scalar(stmt)
     
     # If workout returns workout, Else returns error message
     if workout:
-        return workout_schema.dump(workout), 200
+        return schema.dump(workout), 200
     else:
         return {"error": f"Workout with {workout_id} not found."}, 404
 
@@ -52,6 +264,7 @@ def get_a_workout(workout_id):
 # Method => POST, Route: /workouts/
 # Route for users to create log their workout session
 @workout_bp.route("/", methods=["POST"])
+@query_budget(7, serialization=2)
 @jwt_required()
 def register_workout():
     try:
@@ -67,9 +280,13 @@ def register_workout():
             user_id=get_jwt_identity() 
         )
         
-        # Add and commit to the DB
+        # Add to the DB, flush to validate the row before updating the rollups
         db.session.add(workout)
+        db.session.flush()
+        add_workouts([(workout.user_id, workout.date, workout.distance_kms, workout.calories_burnt)])
+        # Commit the workout and rollups together, then update the member's leaderboards
         db.session.commit()
+        refresh_member(get_jwt_identity())
         # Return acknowledgment message
         return workout_schema.dump(workout), 201
     # Return not null violation personalised message   
@@ -82,9 +299,155 @@ def register_workout():
         return {"error": f"An unexpected error had occurred, {e}"}
 
 
+# Method => POST, Route: /workouts/bulk
+# Route for users to import many workout sessions at once, JWT required
+# Body is a JSON array of workouts, or one workout per line with Content-Type: application/x-ndjson
+# 'date' (YYYY-MM-DD) is optional and defaults to today, invalid rows are skipped and reported
+@workout_bp.route("/bulk", methods=["POST"])
+@jwt_required()
+def bulk_register_workouts():
+    user_id = int(get_jwt_identity())
+    bulk_schema = WorkoutSchema(many=True)
+    inserted = 0
+    errors = []
+
+    try:
+        # Validate and insert one chunk at a time, each chunk is a single executemany
+        for start, chunk in _read_bulk_chunks():
+            try:
+                loaded = bulk_schema.load(chunk)
+                chunk_errors = {}
+            except ValidationError as err:
+                loaded, chunk_errors = err.valid_data, err.messages
+
+            rows, row_numbers = [], []
+            for index, body_data in enumerate(loaded):
+                row_error = chunk_errors.get(index) or _bulk_row(body_data, user_id, rows)
+                if row_error:
+                    errors.append({"row": start + index, "error": row_error})
+                else:
+                    row_numbers.append(start + index)
+            rows = _insert_bulk_rows(rows, row_numbers, errors)
+            if rows:
+                add_workouts((row["user_id"], row["date"], row["distance_kms"], row["calories_burnt"]) for row in rows)
+                inserted += len(rows)
+    except ValueError as e:
+        db.session.rollback()
+        return {"error": str(e)}, 400
+    except (IntegrityError, DataError):
+        db.session.rollback()
+        return {"error": "The workouts could not be saved, none were imported."}, 400
+
+    # Commit every chunk at once
+    db.session.commit()
+    if inserted:
+        refresh_member(user_id)
+    return {"inserted": inserted, "errors": errors}, 201 if inserted else 400
+
+
+# Read the body of a bulk request in chunks of (index of first row, rows)
+# NDJSON bodies are read line by line, so the whole body is never held in memory
+def _read_bulk_chunks():
+    if request.mimetype == "application/x-ndjson":
+        lines = (line for line in request.stream if line.strip())
+        rows = (_parse_ndjson_line(line) for line in lines)
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            raise ValueError("Body must be a JSON array of workouts.")
+
+    chunk, start = [], 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == BULK_CHUNK_SIZE:
+            yield start, chunk
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield start, chunk
+
+
+# Parse one NDJSON line, invalid JSON becomes a row the schema rejects
+def _parse_ndjson_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+# Check the columns the schema doesn't validate and add the row to rows
+# Returns the error of the row, or None if it's valid
+def _bulk_row(body_data, user_id, rows):
+    try:
+        workout_date = date.fromisoformat(body_data["date"]) if body_data.get("date") else date.today()
+    except (TypeError, ValueError):
+        return {"date": ["Invalid date format. Use YYYY-MM-DD."]}
+    if body_data.get("distance_kms") is None:
+        return {"distance_kms": ["The column distance_kms is required"]}
+    distance_kms = _whole_number(body_data["distance_kms"])
+    if distance_kms is None:
+        return {"distance_kms": ["Must be a whole number, eg: 5 not 5.9."]}
+    calories_burnt = None
+    if body_data.get("calories_burnt") is not None:
+        calories_burnt = _whole_number(body_data["calories_burnt"])
+        if calories_burnt is None:
+            return {"calories_burnt": ["Must be a whole number, eg: 235 not 235.5."]}
+
+    rows.append({
+        "title": body_data["title"],
+        "date": workout_date,
+        "distance_kms": distance_kms,
+        "calories_burnt": calories_burnt,
+        "user_id": user_id,
+        # Core inserts don't set the version column
+        "version": 1,
+    })
+    return None
+
+
+# Integer value of a JSON number or string, None if it isn't a whole number
+# 5, 5.0 and "5" are accepted, 5.9, "5.9" and true are rejected instead of truncated
+def _whole_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Insert the valid rows of a chunk with one executemany, in a savepoint so the rows the DB
+# rejects don't abort the transaction. If it fails the rows are inserted one at a time
+# to find the rejected ones, which are added to errors. Returns the inserted rows
+def _insert_bulk_rows(rows, row_numbers, errors):
+    if not rows:
+        return rows
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.insert(Workout), rows)
+        return rows
+    except (IntegrityError, DataError):
+        pass
+
+    inserted = []
+    for row, row_number in zip(rows, row_numbers):
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(Workout), [row])
+            inserted.append(row)
+        except IntegrityError as err:
+            errors.append({"row": row_number, "error": {"error": f"Rejected by the database: {err.orig}"}})
+        except DataError:
+            errors.append({"row": row_number, "error": {"error": "Invalid input for integer value, only numbers allowed."}})
+    return inserted
+
+
 # Method => PATCH or PUT, Route: /workouts/<workout_id>
 # Route for users to update their workout session, JWT required
 @workout_bp.route("/<int:workout_id>", methods=["PUT", "PATCH"])
+@query_budget(10, serialization=2)
 @jwt_required()
 def update_workout(workout_id):
     try:
@@ -107,8 +470,11 @@ def update_workout(workout_id):
             workout.distance_kms = body_data.get("distance_kms") or workout.distance_kms
             workout.calories_burnt = body_data.get("calories_burnt") or workout.calories_burnt
             
-            # Commit changes to DB and return updated workout
+            # Flush the changes, recompute the rollups and commit them together
+            db.session.flush()
+            refresh_rollups(workout.user_id, workout.date)
             db.session.commit()
+            refresh_member(current_user_id)
             return workout_schema.dump(workout)
         else:
             return {"error": f"Workout with id {workout_id} has not been found."}, 404
@@ -116,12 +482,16 @@ def update_workout(workout_id):
     # Return personalized error messages
     except DataError:
         return {"error": "Invalid input for integer value, only numbers allowed."}, 400 
+    # Let the app return 409 when the workout was changed by another request
+    except StaleDataError:
+        raise
     except Exception as e:
         return {"error": f"An unexpected error has occurred: {e}"}
 
 
 # Route for users to delete their workout session, JWT required
 @workout_bp.route("/<int:workout_id>", methods=["DELETE"])
+@query_budget(8)
 @jwt_required()
 def delete_workout(workout_id):
     # Fetch the workout from DB with stmt
@@ -137,9 +507,12 @@ def delete_workout(workout_id):
         if int(workout.user_id) != int(current_user_id):
             return {"error": "You do not have permission to delete this workout."}, 403    
     
-        # If the user is the owner, delete the workout
+        # If the user is the owner, delete the workout and recompute the rollups it was part of
         db.session.delete(workout)
+        db.session.flush()
+        refresh_rollups(workout.user_id, workout.date)
         db.session.commit()
+        refresh_member(current_user_id)
         return {"message": f"Workout {workout_id} has been deleted successfully!"}, 200
     else:
         return {"error": f"Workout {workout_id} has not been found."}, 404
@@ -0,0 +1,72 @@
+# ETags for conditional GET requests, built from the row versions of everything a response shows
+# Each fingerprint is a single aggregate query, so a 304 skips loading and serialising the objects
+# Log tables are only inserted and deleted, new ids are always bigger than old ones,
+# so (count, sum of ids) changes whenever a log is added or removed
+import hashlib
+
+from flask import request
+from sqlalchemy import func
+from werkzeug.http import quote_etag
+
+from init import db
+from models.user import User
+from models.group import Group
+from models.group_log import GroupLog
+from models.marathon import Marathon
+from models.marathon_log import MarathonLog
+from models.workout import Workout
+
+
+# Fingerprint of a group, its admin, members and marathon logs, None if the group doesn't exist
+def group_fingerprint(group_id):
+    member_logs = db.select(GroupLog).filter_by(group_id=Group.id)
+    enrolments = db.select(MarathonLog).filter_by(group_id=Group.id)
+    stmt = db.select(
+        Group.version,
+        db.select(User.version).filter_by(id=Group.created_by).scalar_subquery(),
+        member_logs.with_only_columns(func.count(GroupLog.id)).scalar_subquery(),
+        member_logs.with_only_columns(func.sum(GroupLog.id)).scalar_subquery(),
+        member_logs.join(GroupLog.user).with_only_columns(func.sum(User.version)).scalar_subquery(),
+        enrolments.with_only_columns(func.count(MarathonLog.id)).scalar_subquery(),
+        enrolments.with_only_columns(func.sum(MarathonLog.id)).scalar_subquery(),
+        enrolments.join(MarathonLog.marathon).with_only_columns(func.sum(Marathon.version)).scalar_subquery(),
+    ).filter_by(id=group_id)
+    return db.session.execute(stmt).first()
+
+
+# Fingerprint of a marathon and its marathon logs, None if the marathon doesn't exist
+def marathon_fingerprint(marathon_id):
+    enrolments = db.select(MarathonLog).filter_by(marathon_id=Marathon.id)
+    stmt = db.select(
+        Marathon.version,
+        enrolments.with_only_columns(func.count(MarathonLog.id)).scalar_subquery(),
+        enrolments.with_only_columns(func.sum(MarathonLog.id)).scalar_subquery(),
+    ).filter_by(id=marathon_id)
+    return db.session.execute(stmt).first()
+
+
+# Fingerprint of every workout of a user and of the user (their name is shown in each workout)
+def workouts_fingerprint(user_id):
+    stmt = db.select(
+        func.count(Workout.id),
+        func.sum(Workout.id),
+        func.sum(Workout.version),
+        db.select(User.version).filter_by(id=user_id).scalar_subquery(),
+    ).filter_by(user_id=user_id)
+    return db.session.execute(stmt).first()
+
+
+# Build the ETag from a fingerprint, the path and query string (fields, cursor) change the body too
+def make_etag(fingerprint):
+    raw = f"{request.full_path}|{tuple(fingerprint)}".encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()
+
+
+# Check if the client already has the response with this ETag
+def not_modified(etag):
+    return request.if_none_match.contains(etag)
+
+
+# Response headers sending the ETag to the client
+def etag_headers(etag):
+    return {"ETag": quote_etag(etag)}
@@ -0,0 +1,135 @@
+# Bounded worker pool to run bcrypt hashing and checks outside of the request thread
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import bcrypt as bcrypt_lib
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+
+from metrics import timed
+
+
+# Pick the highest bcrypt cost whose hash takes less than target_ms on this machine
+# Each extra round doubles the time, so stop as soon as the next one would be too slow
+def calibrate_rounds(target_ms, min_rounds=10, max_rounds=16):
+    rounds = min_rounds
+    for candidate in range(min_rounds, max_rounds + 1):
+        start = time.perf_counter()
+        bcrypt_lib.hashpw(b"calibration", bcrypt_lib.gensalt(candidate))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > target_ms and candidate > min_rounds:
+            break
+        rounds = candidate
+        if elapsed_ms * 2 > target_ms:
+            break
+    return rounds
+
+
+# Read the cost a bcrypt hash was created with, eg: 12 for "$2b$12$..."
+def hash_rounds(pw_hash):
+    try:
+        return int(pw_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# Raised when the pool and its queue are full, returned to the client as 503
+class PoolSaturatedError(Exception):
+    def __init__(self):
+        super().__init__("The server is busy, please try again shortly.")
+
+
+# Runs the methods of the Flask-Bcrypt object in a pool of threads or processes
+class PasswordPool:
+    def __init__(self, bcrypt, app=None):
+        self.bcrypt = bcrypt
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        if app is not None:
+            self.init_app(app)
+
+    # Read the pool settings from the app config
+    # BCRYPT_POOL_TYPE: "thread" or "process", BCRYPT_POOL_WORKERS: number of workers
+    # BCRYPT_POOL_QUEUE_SIZE: calls allowed to wait for a worker before returning 503
+    def init_app(self, app):
+        self.pool_type = app.config.get("BCRYPT_POOL_TYPE", "thread")
+        self.workers = app.config.get("BCRYPT_POOL_WORKERS") or os.cpu_count() or 1
+        self.queue_size = app.config.get("BCRYPT_POOL_QUEUE_SIZE", self.workers * 4)
+        self.timeout = app.config.get("BCRYPT_POOL_TIMEOUT", 10)
+        self.rounds = app.config.get("BCRYPT_LOG_ROUNDS", 12)
+        if self.pool_type not in ("thread", "process"):
+            raise ValueError("BCRYPT_POOL_TYPE must be 'thread' or 'process'.")
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        app.extensions["password_pool"] = self
+
+    # Hash a password, returns the hash as a str
+    def generate_password_hash(self, password):
+        return self._run(self.bcrypt.generate_password_hash, password).decode("utf-8")
+
+    # Check a password against its hash
+    def check_password_hash(self, pw_hash, password):
+        return self._run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    # Check if a hash should be recreated with the current cost after a successful login
+    # Hashes one round above the cost are kept, so workers calibrated one round apart
+    # don't keep rehashing the same password back and forth
+    def needs_rehash(self, pw_hash):
+        rounds = hash_rounds(pw_hash)
+        return rounds is None or rounds < self.rounds or rounds > self.rounds + 1
+
+    # Number of calls running or waiting for a worker
+    def stats(self):
+        return {
+            "type": self.pool_type,
+            "workers": self.workers,
+            "max_queue_size": self.queue_size,
+            "in_flight": self._in_flight,
+            "queue_depth": max(0, self._in_flight - self.workers),
+        }
+
+    # Run fn in the pool, fail fast if every worker and queue slot is taken
+    # The slot is freed once the call finished or was cancelled, not when the request stops
+    # waiting: a call still running after the timeout keeps its worker busy
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturatedError()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            with timed("bcrypt"):
+                # Under asgi.py, wait without blocking the event loop
+                if in_greenlet():
+                    return await_only(asyncio.wait_for(asyncio.wrap_future(future), self.timeout))
+                return future.result(timeout=self.timeout)
+        except (TimeoutError, asyncio.TimeoutError):
+            # Drop the call if it's still waiting for a worker
+            future.cancel()
+            raise PoolSaturatedError()
+
+    # Free the slot of a call, called with its future once it's done or cancelled
+    def _release(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    # The executor is created on first use, so forked WSGI workers each get their own
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.pool_type == "process":
+                        # Imported here, multiprocessing is only needed by process pools
+                        from concurrent.futures import ProcessPoolExecutor
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
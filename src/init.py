@@ -4,9 +4,28 @@ from flask_marshmallow import Marshmallow
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 
+from hashing import PasswordPool
+from cache import ResponseCache, LeaderboardCache
+from metrics import Metrics
+from budgets import QueryBudgets
+from replicas import ReadReplica, RoutingSession
+
 # Create objects for the classes imported
-db = SQLAlchemy()
+# db.session sends the reads of GET routes to the replica when there is one
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 ma = Marshmallow()
 bcrypt = Bcrypt()
 jwt = JWTManager()
+# Request and SQL metrics served at /metrics
+metrics = Metrics(db)
+# SQL query budgets of the routes, enforced in development and tests
+query_budgets = QueryBudgets(db)
+# Routing of GET routes to the read replica
+read_replica = ReadReplica(db)
+# Pool to run bcrypt outside of the request threads
+password_pool = PasswordPool(bcrypt)
+# Cache for the responses of public read routes
+response_cache = ResponseCache(db)
 
+# Cache for the top members of group leaderboards
+leaderboard_cache = LeaderboardCache(db)
@@ -0,0 +1,113 @@
+# Group leaderboards of the current week, month or year, ranked by distance then calories
+# Totals come from the workout_rollups table, so a board costs one row per member
+# Boards are cached in leaderboard_cache and updated with the new totals of a member
+# after they log, update or delete a workout, join or leave a group, the other workers
+# reload them once they see the new generation of the group
+from datetime import date
+
+from flask import g
+from sqlalchemy import tuple_
+
+from init import db, leaderboard_cache
+from models.user import User
+from models.group import Group
+from models.group_log import GroupLog
+from models.workout_rollup import WorkoutRollup
+from utils import PERIODS, period_start
+
+
+# Cache key of the board of a group for the current period
+def leaderboard_key(group_id, period):
+    return (group_id, period, period_start(period, date.today()))
+
+
+# Return the sorted entries of a group's board, from the cache or the DB
+# Returns None if the group doesn't exist
+def get_leaderboard(group_id, period):
+    key = leaderboard_key(group_id, period)
+    generation = leaderboard_cache.generation(group_id)
+    entries = leaderboard_cache.get(key, generation)
+    if entries is None:
+        # Right after a write, load the board from the primary (see replicas.py),
+        # a lagging replica would be cached until the TTL
+        if leaderboard_cache.changed_recently(group_id):
+            g.read_primary = True
+        # Cached boards belong to existing groups, only check the group when loading a board
+        if db.session.scalar(db.select(Group.id).filter_by(id=group_id)) is None:
+            return None
+        entries = _load_leaderboard(*key)
+        leaderboard_cache.set(key, entries, generation)
+    return entries
+
+
+# Update the boards of a member's groups with their current totals
+# group_ids defaults to every group of the member, call it after the commit
+# Invalidates the boards of the other workers, this one updates its boards in place
+def refresh_member(user_id, group_ids=None):
+    user_id = int(user_id)
+    if group_ids is None:
+        group_ids = db.session.scalars(db.select(GroupLog.group_id).filter_by(user_id=user_id)).all()
+    if not group_ids:
+        return
+    generations = leaderboard_cache.invalidate(group_ids)
+    if leaderboard_cache.is_empty():
+        return
+
+    # Totals of the member for the current week, month and year, in one query
+    starts = [(period, period_start(period, date.today())) for period in PERIODS]
+    stmt = (
+        db.select(WorkoutRollup, User.name)
+        .join(WorkoutRollup.user)
+        .where(WorkoutRollup.user_id == user_id)
+        .where(tuple_(WorkoutRollup.period, WorkoutRollup.period_start).in_(starts))
+    )
+    entries = {rollup.period: _entry(user_id, name, rollup) for rollup, name in db.session.execute(stmt)}
+    for group_id in group_ids:
+        for period in PERIODS:
+            leaderboard_cache.update_member(leaderboard_key(group_id, period), user_id, entries.get(period), *generations[group_id])
+
+
+# Remove a member from the boards of groups after they leave them or are deleted
+def remove_member(user_id, group_ids):
+    if not group_ids:
+        return
+    generations = leaderboard_cache.invalidate(group_ids)
+    for group_id in group_ids:
+        for period in PERIODS:
+            leaderboard_cache.update_member(leaderboard_key(group_id, period), int(user_id), None, *generations[group_id])
+
+
+# Drop the boards of a deleted group
+def drop_group(group_id):
+    leaderboard_cache.invalidate([group_id])
+    for period in PERIODS:
+        leaderboard_cache.drop(leaderboard_key(group_id, period))
+
+
+# Top members of a group for one period, members without workouts in the period are left out
+# Uses the group_id index of group_logs and the unique index of workout_rollups
+def _load_leaderboard(group_id, period, start):
+    stmt = (
+        db.select(WorkoutRollup, User.name)
+        .join(GroupLog, GroupLog.user_id == WorkoutRollup.user_id)
+        .join(WorkoutRollup.user)
+        .where(GroupLog.group_id == group_id)
+        .where(WorkoutRollup.period == period, WorkoutRollup.period_start == start)
+        .order_by(
+            WorkoutRollup.total_distance_kms.desc(),
+            WorkoutRollup.total_calories_burnt.desc(),
+            WorkoutRollup.user_id,
+        )
+        .limit(leaderboard_cache.size)
+    )
+    return [_entry(rollup.user_id, name, rollup) for rollup, name in db.session.execute(stmt)]
+
+
+# Entry of a member in a board
+def _entry(user_id, name, rollup):
+    return {
+        "user": {"id": user_id, "name": name},
+        "total_distance_kms": rollup.total_distance_kms,
+        "total_calories_burnt": rollup.total_calories_burnt,
+        "count": rollup.count,
+    }
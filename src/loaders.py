@@ -0,0 +1,76 @@
+# Loader options to eager load the relationships each schema serialises
+from sqlalchemy.orm import subqueryload, joinedload, load_only
+
+from models.user import User, UserSchema
+from models.workout import Workout, WorkoutSchema
+from models.group import Group, GroupSchema
+from models.group_log import GroupLog, GroupLogSchema
+from models.marathon import Marathon, MarathonSchema
+from models.marathon_log import MarathonLog, MarathonLogSchema
+
+
+# Loader profiles, pair each schema with the options needed to dump its nested fields
+# Keys inside a profile are the schema's nested fields, so unused fields can be skipped
+# subqueryload is used for lists, one extra query per relationship whatever the row count
+# (selectinload would split the parents' ids in IN lists of 500, one query each)
+# joinedload is used for single objects (loaded in the same query)
+LOADER_PROFILES = {
+    GroupSchema: {
+        "group_admin": [joinedload(Group.group_admin)],
+        "group_logs": [subqueryload(Group.group_logs).joinedload(GroupLog.user)],
+        "marathon_logs": [subqueryload(Group.marathon_logs).joinedload(MarathonLog.marathon)],
+    },
+    MarathonSchema: {
+        "marathon_logs": [subqueryload(Marathon.marathon_logs)],
+    },
+    UserSchema: {
+        "workouts": [subqueryload(User.workouts)],
+        "group_logs": [
+            subqueryload(User.group_logs).joinedload(GroupLog.group).options(
+                joinedload(Group.group_admin),
+                subqueryload(Group.marathon_logs).joinedload(MarathonLog.marathon),
+            )
+        ],
+        "group_created": [subqueryload(User.group_created)],
+    },
+    GroupLogSchema: {
+        "user": [joinedload(GroupLog.user)],
+        "group": [
+            joinedload(GroupLog.group).options(
+                joinedload(Group.group_admin),
+                subqueryload(Group.marathon_logs).joinedload(MarathonLog.marathon),
+            )
+        ],
+    },
+    WorkoutSchema: {
+        "user": [joinedload(Workout.user)],
+    },
+    MarathonLogSchema: {
+        "group": [
+            joinedload(MarathonLog.group).options(
+                joinedload(Group.group_admin),
+                subqueryload(Group.group_logs).joinedload(GroupLog.user),
+            )
+        ],
+        "marathon": [joinedload(MarathonLog.marathon)],
+    },
+}
+
+
+# Return the loader options for the fields a schema object will dump
+# Relationships and columns left out of the schema (eg: by '?fields=') are not loaded
+# 'required' columns are always loaded, eg: the sort keys used to build a cursor
+# Use it as db.select(Model).options(*loader_options(Model, schema))
+def loader_options(model, schema, *required):
+    mapper = model.__mapper__
+    columns = [getattr(model, name) for name in schema.dump_fields if name in mapper.column_attrs]
+    # load_only needs at least one column, eg: '?fields=marathon_logs' only dumps a relationship
+    if not columns and not required:
+        columns = [getattr(model, column.key) for column in mapper.primary_key]
+    options = [load_only(*columns, *required)]
+
+    profile = LOADER_PROFILES.get(type(schema), {})
+    for field_name, field_options in profile.items():
+        if field_name in schema.dump_fields:
+            options.extend(field_options)
+    return options
@@ -1,33 +1,80 @@
 # Os for fetching env variables
 import os
+# To bind each engine to its pool stats
+import functools
 
 # To create the API
 from flask import Flask
+# Raised when a versioned row was changed by another request since it was loaded
+from sqlalchemy.orm.exc import StaleDataError
 # To handle Validation errors
 from marshmallow.exceptions import ValidationError
 
 # Import objects from init.py
-from init import db, ma, bcrypt, jwt
+from init import db, ma, bcrypt, jwt, password_pool, response_cache, leaderboard_cache, metrics, query_budgets, read_replica
+from hashing import PoolSaturatedError, calibrate_rounds
+from replicas import REPLICA_BIND, pool_stats
 # Import blueprints to register them in the app
 from controllers.cli_controllers import db_commands
 from controllers.auth_controller import auth_bp
 from controllers.workout_controller import workout_bp
 from controllers.group_controller import group_bp
 from controllers.marathon_controller import marathon_bp
+from controllers.me_controller import me_bp
+from controllers.metrics_controller import metrics_bp
 
 
 # Define the app inside of an application factory function
-def  create_app():
+# config overrides the settings read from the environment, eg: the async engine URLs of asgi.py
+def  create_app(config=None):
     app = Flask(__name__)
     app.json.sort_keys = False
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    # Optional read replica for the GET routes, users read from the primary for a few seconds after writing
+    if os.environ.get("DATABASE_REPLICA_URL"):
+        app.config["SQLALCHEMY_BINDS"] = {REPLICA_BIND: os.environ["DATABASE_REPLICA_URL"]}
+    app.config["READ_REPLICA_STICKY_SECONDS"] = int(os.environ.get("READ_REPLICA_STICKY_SECONDS", 5))
     app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY")
+    # Bcrypt worker pool, "thread" or "process", workers default to the number of CPUs
+    app.config["BCRYPT_POOL_TYPE"] = os.environ.get("BCRYPT_POOL_TYPE", "thread")
+    app.config["BCRYPT_POOL_WORKERS"] = int(os.environ.get("BCRYPT_POOL_WORKERS", 0)) or None
+    app.config["BCRYPT_POOL_QUEUE_SIZE"] = int(os.environ.get("BCRYPT_POOL_QUEUE_SIZE", 16))
+    # Response cache size and seconds before cached responses expire
+    app.config["RESPONSE_CACHE_SIZE"] = int(os.environ.get("RESPONSE_CACHE_SIZE", 256))
+    app.config["RESPONSE_CACHE_TTL"] = int(os.environ.get("RESPONSE_CACHE_TTL", 60))
+    # Seconds each worker trusts its copy of the cache generations before reading them again
+    app.config["CACHE_GENERATION_TTL"] = float(os.environ.get("CACHE_GENERATION_TTL", 1))
+    # Seconds before cached group leaderboards are reloaded from the DB
+    app.config["LEADERBOARD_CACHE_TTL"] = int(os.environ.get("LEADERBOARD_CACHE_TTL", 300))
+    # Check the SQL query budgets of the routes, "raise" in tests or "warn" in development
+    app.config["QUERY_BUDGETS"] = os.environ.get("QUERY_BUDGETS") or None
+    # Bcrypt cost, fixed with BCRYPT_LOG_ROUNDS or calibrated to hash within BCRYPT_TARGET_MS
+    if os.environ.get("BCRYPT_LOG_ROUNDS"):
+        app.config["BCRYPT_LOG_ROUNDS"] = int(os.environ["BCRYPT_LOG_ROUNDS"])
+    elif os.environ.get("BCRYPT_TARGET_MS"):
+        app.config["BCRYPT_LOG_ROUNDS"] = calibrate_rounds(float(os.environ["BCRYPT_TARGET_MS"]))
+        app.logger.info("Bcrypt cost calibrated to %s rounds", app.config["BCRYPT_LOG_ROUNDS"])
+    app.config.update(config or {})
 
     # Initialise app with extensions
     db.init_app(app)
     ma.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
+    password_pool.init_app(app)
+    response_cache.init_app(app)
+    leaderboard_cache.init_app(app)
+    metrics.init_app(app)
+    metrics.register_gauges("bcrypt_pool", password_pool.stats)
+    metrics.register_gauges("response_cache", response_cache.stats)
+    metrics.register_gauges("leaderboard_cache", leaderboard_cache.stats)
+    query_budgets.init_app(app)
+    read_replica.init_app(app)
+    metrics.register_gauges("read_replica", read_replica.stats)
+    # Connection pool of each engine, eg: db_pool_primary_checkedout
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            metrics.register_gauges(f"db_pool_{bind_key or 'primary'}", functools.partial(pool_stats, engine))
     
 
     # Global decorators to handle errors
@@ -35,6 +82,17 @@ def  create_app():
     def validation_error(err):
         return {"error": err.messages}, 400
     
+    # Bcrypt pool is full, ask the client to retry instead of queueing the request
+    @app.errorhandler(PoolSaturatedError)
+    def pool_saturated(err):
+        return {"error": str(err)}, 503, {"Retry-After": "1"}
+
+    # The row changed (or was deleted) since the request loaded it, the client should reload it and retry
+    @app.errorhandler(StaleDataError)
+    def stale_data(err):
+        db.session.rollback()
+        return {"error": "The resource was changed by another request, please reload it and try again."}, 409
+
     @app.errorhandler(400)
     def handle_bad_request(err):
         return{"error": "Bad request. Please check your input."}, 400
@@ -62,6 +120,8 @@ def  create_app():
     app.register_blueprint(workout_bp)
     app.register_blueprint(group_bp)
     app.register_blueprint(marathon_bp)
+    app.register_blueprint(me_bp)
+    app.register_blueprint(metrics_bp)
 
 
     return app
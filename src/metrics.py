@@ -0,0 +1,172 @@
+# Request instrumentation, exposed in the Prometheus text format at /metrics
+# Metrics are kept in memory by each process, Prometheus sums the processes it scrapes
+import time
+import threading
+from contextlib import contextmanager
+
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# Prometheus histogram with a fixed set of labels
+class Histogram:
+    def __init__(self, name, description, labelnames, buckets):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label values: [count of each bucket, sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    # Lines of the text format, bucket counts are cumulative
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                base = _labels(self.labelnames, labels)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{{{base}{',' if base else ''}le=\"{bound}\"}} {cumulative}")
+                lines.append(f"{self.name}_bucket{{{base}{',' if base else ''}le=\"+Inf\"}} {count}")
+                lines.append(f"{self.name}_sum{{{base}}} {total}")
+                lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+# Records the requests of an app, the SQL statements of its engines
+# and the time spent in phases like serialisation or bcrypt (see timed())
+class Metrics:
+    def __init__(self, db, app=None):
+        self.db = db
+        self._gauges = []
+        endpoint = ("blueprint", "endpoint")
+        self.request_latency = Histogram(
+            "http_request_duration_seconds", "Time to build the response.",
+            ("blueprint", "endpoint", "method", "status"), LATENCY_BUCKETS,
+        )
+        self.response_size = Histogram("http_response_size_bytes", "Size of the response body.", endpoint, SIZE_BUCKETS)
+        self.query_count = Histogram("db_queries_per_request", "SQL statements executed by a request.", endpoint, QUERY_BUCKETS)
+        self.query_time = Histogram("db_query_duration_seconds", "Time spent in SQL statements by a request.", endpoint, LATENCY_BUCKETS)
+        self.phase_time = Histogram(
+            "phase_duration_seconds", "Time spent in a phase of a request, eg: serialization or bcrypt.",
+            ("blueprint", "endpoint", "phase"), LATENCY_BUCKETS,
+        )
+        if app is not None:
+            self.init_app(app)
+
+    # Call it after db.init_app, so the app's engines exist
+    def init_app(self, app):
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        app.teardown_request(self._teardown_request)
+        with app.app_context():
+            for engine in self.db.engines.values():
+                event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+                event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        app.extensions["metrics"] = self
+
+    # Report the numbers of a stats() method as gauges named '<prefix>_<key>', eg: bcrypt_pool_in_flight
+    def register_gauges(self, prefix, stats):
+        self._gauges.append((prefix, stats))
+
+    # Record the time of a phase of the current request
+    def observe_phase(self, phase, seconds):
+        if has_request_context() and "metrics" in g:
+            g.metrics["phases"][phase] = g.metrics["phases"].get(phase, 0) + seconds
+
+    # Every metric in the Prometheus text format
+    def render(self):
+        lines = []
+        for histogram in (self.request_latency, self.response_size, self.query_count, self.query_time, self.phase_time):
+            lines += histogram.render()
+        for prefix, stats in self._gauges:
+            for key, value in stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines += [f"# TYPE {prefix}_{key} gauge", f"{prefix}_{key} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def _start_request(self):
+        g.metrics = {"start": time.perf_counter(), "queries": 0, "query_time": 0.0, "phases": {}, "open_phases": set()}
+
+    def _end_request(self, response):
+        if "metrics" not in g:
+            return response
+        # Streamed responses run their statements while they're sent, they're observed
+        # in _teardown_request once the stream is closed (see stream_with_context)
+        if response.is_streamed:
+            g.metrics["status"] = response.status_code
+            return response
+        self._observe(g.pop("metrics"), response.status_code, response.calculate_content_length() or 0)
+        return response
+
+    def _teardown_request(self, exc=None):
+        stats = g.pop("metrics", None)
+        if stats is not None and "status" in stats:
+            # Streamed responses have no length
+            self._observe(stats, stats["status"], None)
+
+    def _observe(self, stats, status, size):
+        endpoint = (request.blueprint or "", request.endpoint or "")
+        self.request_latency.observe((*endpoint, request.method, str(status)), time.perf_counter() - stats["start"])
+        if size is not None:
+            self.response_size.observe(endpoint, size)
+        self.query_count.observe(endpoint, stats["queries"])
+        self.query_time.observe(endpoint, stats["query_time"])
+        for phase, seconds in stats["phases"].items():
+            self.phase_time.observe((*endpoint, phase), seconds)
+
+
+# Time the block as a phase of the current request, does nothing outside of an instrumented app
+# Blocks nested in a block of the same phase aren't timed again, eg: a schema dumping its nested schemas
+# Eg: with timed("serialization"): ...
+@contextmanager
+def timed(phase):
+    metrics = current_app.extensions.get("metrics") if has_request_context() and "metrics" in g else None
+    if metrics is None or phase in g.metrics["open_phases"]:
+        yield
+        return
+    g.metrics["open_phases"].add(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.metrics["open_phases"].discard(phase)
+        metrics.observe_phase(phase, time.perf_counter() - start)
+
+
+# Engine events counting the statements and their time in the current request
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context() and "metrics" in g:
+        g.metrics["queries"] += 1
+        g.metrics["query_time"] += elapsed
+
+
+# Label pairs of a series, values escaped as the text format requires
+def _labels(names, values):
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+    return ",".join(f"{name}=\"{value}\"" for name, value in zip(names, escaped))
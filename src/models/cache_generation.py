@@ -0,0 +1,14 @@
+from init import db
+
+
+class CacheGeneration(db.Model):
+    # Name of the table
+    __tablename__ = "cache_generations"
+
+    # Attributes
+    # Generation of a response cache namespace, eg: "marathons", increased by every write to it
+    # Kept in the DB so invalidating in one worker reaches the caches of every worker
+    namespace = db.Column(db.String(50), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    # UTC time of the last invalidation, the replica may lag behind it for a few seconds
+    changed_at = db.Column(db.DateTime)
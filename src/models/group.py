@@ -2,7 +2,8 @@ from datetime import date
 from marshmallow import fields
 from marshmallow.validate import Length, And, Regexp
 
-from init import db, ma
+from init import db
+from serializers import Schema
 
 
 class Group(db.Model):
@@ -14,6 +15,8 @@ class Group(db.Model):
     name = db.Column(db.String(30), nullable=False)
     date_created = db.Column(db.Date, default=date.today)
     created_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, unique=True)
+    # Row version, increased by SQLAlchemy on every update, used to build ETags
+    version = db.Column(db.Integer, nullable=False)
 
     # Define bidirectional relationships with group_admin creator, groups_logs and marathons_logs
     # Cascade to delete logs if group is deleted
@@ -21,11 +24,13 @@ class Group(db.Model):
     group_logs = db.relationship("GroupLog", back_populates= "group", cascade="all, delete")
     marathon_logs = db.relationship("MarathonLog", back_populates= "group", cascade="all, delete")
 
+    __mapper_args__ = {"version_id_col": version}
+
 
 # Define 'group' schema and class 'Meta' fields to serialize/ deserialize data
 # Unpack complex data with fields.Nested method, fields.List used for a list of logs
 # Exclude 'group' from log and group schemas to avoid redundant data
-class GroupSchema(ma.Schema):
+class GroupSchema(Schema):
     group_admin = fields.Nested("UserSchema", only=["name"]) 
     group_logs = fields.List(fields.Nested("GroupLogSchema", exclude=["group"]))
     marathon_logs = fields.List(fields.Nested("MarathonLogSchema", exclude=["group"]))
@@ -1,6 +1,7 @@
 from datetime import date
 
-from init import db, ma
+from init import db
+from serializers import Schema
 from marshmallow import fields
 
 
@@ -11,18 +12,24 @@ class GroupLog(db.Model):
     entry_created = db.Column(db.Date, default=date.today) 
     
     # Foreign keys to reference both 'users' and 'groups' tables
+    # group_id is indexed, user_id is covered by the unique constraint below
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
-    group_id = db.Column(db.Integer, db.ForeignKey("groups.id"), nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey("groups.id"), nullable=False, index=True)
 
     # Define bidirectional relationships with 'users' and 'groups' tables
     user = db.relationship("User", back_populates="group_logs")
     group = db.relationship("Group", back_populates="group_logs")
 
+    # A user can only join a group once
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "group_id", name="uq_group_logs_user_id_group_id"),
+    )
+
 
 # Define 'group_log' schema and class 'Meta' fields to serialize/ deserialize data
 # Unpack complex data with fields.Nested method
 # Exclude group_logs from user and group schema to avoid redundant data info
-class GroupLogSchema(ma.Schema):
+class GroupLogSchema(Schema):
     user = fields.Nested("UserSchema", only=["id", "name", "email"])
     group = fields.Nested("GroupSchema", exclude=["group_logs"])
     class Meta:
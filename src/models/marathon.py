@@ -1,7 +1,9 @@
 from marshmallow import fields
 from marshmallow.validate import Length, And, Regexp
+from sqlalchemy import event, DDL
 
-from init import db, ma
+from init import db
+from serializers import Schema
 
 
 class Marathon(db.Model):
@@ -11,18 +13,37 @@ class Marathon(db.Model):
     # Attributes
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), nullable=False)
-    event_date = db.Column(db.Date, nullable=False)
+    event_date = db.Column(db.Date, nullable=False, index=True)
     location = db.Column(db.String(50), nullable=False)
     distance_kms = db.Column(db.Integer, nullable=False)
+    # Row version, increased by SQLAlchemy on every update, used to build ETags
+    version = db.Column(db.Integer, nullable=False)
     
     # Define bidirectional relationships with 'marathon_logs' table
     # Cascade to delete marathon logs and group if marathon is deleted
     marathon_logs = db.relationship("MarathonLog", back_populates="marathon", cascade="all, delete")
 
+    # Trigram index for the '?location=' substring search (ILIKE '%...%') on Postgres
+    # Other databases get a plain index on location
+    __table_args__ = (
+        db.Index(
+            "ix_marathons_location_trgm", "location",
+            postgresql_using="gin", postgresql_ops={"location": "gin_trgm_ops"},
+        ),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+
+# The trigram operator class comes from the pg_trgm extension, create it with the table
+event.listen(
+    Marathon.__table__, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
 # Define 'marathon' schema and class 'Meta' fields to serialize/ deserialize data
 # Unpack complex data with fields.Nested method, fields.List to unpack a list of logs
 # Exclude marathon from log schema to avoid redundant data info
-class MarathonSchema(ma.Schema):
+class MarathonSchema(Schema):
     marathon_logs = fields.List(fields.Nested("MarathonLogSchema", only=["id", "entry_created"]))
     
     # Validation for 'name'. Name containing two names is allowed eg: 'Coder academy'
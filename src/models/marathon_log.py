@@ -1,6 +1,7 @@
 from datetime import date
 
-from init import db, ma
+from init import db
+from serializers import Schema
 from marshmallow import fields
 
 
@@ -13,19 +14,25 @@ class MarathonLog(db.Model):
     entry_created = db.Column(db.Date, default=date.today) 
     
     # Foreign keys to reference both 'groups' and 'marathons' tables
+    # marathon_id is indexed, group_id is covered by the unique constraint below
     group_id = db.Column(db.Integer, db.ForeignKey("groups.id"), nullable=False)
-    marathon_id = db.Column(db.Integer, db.ForeignKey("marathons.id"), nullable=False)
+    marathon_id = db.Column(db.Integer, db.ForeignKey("marathons.id"), nullable=False, index=True)
 
     # Define bidirectional relationships with 'groups' and 'marathons' tables
     group = db.relationship("Group", back_populates="marathon_logs")
     marathon = db.relationship("Marathon", back_populates="marathon_logs")
 
+    # A group can only enrol in a marathon once
+    __table_args__ = (
+        db.UniqueConstraint("group_id", "marathon_id", name="uq_marathon_logs_group_id_marathon_id"),
+    )
+
 
 # Define 'log' schema and class 'Meta' fields to serialize/ deserialize data
 # Unpack complex data with fields.Nested method
 # Only include attribute 'name' from 'groups' table
 # Exclude logs from marathon schema to avoid redundant data info
-class MarathonLogSchema(ma.Schema):
+class MarathonLogSchema(Schema):
     group = fields.Nested("GroupSchema", exclude=["marathon_logs"])
     marathon = fields.Nested("MarathonSchema", exclude=["marathon_logs"])
     class Meta:
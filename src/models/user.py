@@ -1,4 +1,7 @@
-from init import db, ma
+from init import db
+from serializers import Schema
+# Imported here so User's mapper can be configured without main importing every model
+from models.workout_rollup import WorkoutRollup
 
 from marshmallow import fields
 from marshmallow.validate import Length, And, Regexp
@@ -14,19 +17,26 @@ class User(db.Model):
     email = db.Column(db.String(50), nullable=False, unique=True)
     password = db.Column(db.String, nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
+    # Increased when is_admin or the owned group changes, to expire the claims of issued tokens
+    token_version = db.Column(db.Integer, nullable=False, default=0)
+    # Row version, increased by SQLAlchemy on every update, used to build ETags
+    version = db.Column(db.Integer, nullable=False)
     
 
     # Define bidirectional relationships with workouts, group_logs and groups tables.
-    # Cascade to delete workouts and group if user is deleted
+    # Cascade to delete workouts, workout rollups and group if user is deleted
     workouts = db.relationship("Workout", back_populates = "user", cascade="all, delete")
     group_logs = db.relationship("GroupLog", back_populates="user", cascade="all, delete")
     group_created = db.relationship("Group", back_populates = "group_admin", cascade="all, delete")
+    workout_rollups = db.relationship(WorkoutRollup, back_populates="user", cascade="all, delete")
+
+    __mapper_args__ = {"version_id_col": version}
 
 
 # Define 'user' schema and class 'Meta' fields to serialize/ deserialize data
 # Unpack complex data with fields.Nested method, fields.List to unpack a list of objects
 # Exclude 'user' from workouts and group_logs schemas to avoid redundant data
-class UserSchema(ma.Schema):
+class UserSchema(Schema):
     workouts = fields.List(fields.Nested("WorkoutSchema", exclude=["user"]))
     group_logs = fields.List(fields.Nested("GroupLogSchema", exclude=["user"]))
     group_created = fields.Nested("GroupSchema", only=["id", "name"])
@@ -3,7 +3,8 @@ from datetime import date
 from marshmallow import fields
 from marshmallow.validate import OneOf
 
-from init import db, ma
+from init import db
+from serializers import Schema
 
 
 # Specific entries allowed for workout title attribute
@@ -19,6 +20,8 @@ class Workout(db.Model):
     date =db.Column(db.Date, default=date.today)
     distance_kms = db.Column(db.Integer, nullable=False)
     calories_burnt = db.Column(db.Integer)
+    # Row version, increased by SQLAlchemy on every update, used to build ETags
+    version = db.Column(db.Integer, nullable=False)
 
     # Define FK to reference 'users' table
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
@@ -26,11 +29,21 @@ class Workout(db.Model):
     # Define bidirectional relationships with 'users' table
     user = db.relationship("User", back_populates = "workouts")
 
+    # Composite index for a user's workouts in (date, id) order, scanned backwards for desc pages
+    # Included columns let the stats and ETag aggregates run as index only scans on Postgres
+    __table_args__ = (
+        db.Index(
+            "ix_workouts_user_id_date_id", "user_id", "date", "id",
+            postgresql_include=["distance_kms", "calories_burnt", "version"],
+        ),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
 
 # Define 'workout' schema and class 'Meta' fields to serialize/ deserialize data
 # Unpack complex data with fields.Nested method
 # Only include attribute 'name' from 'users' table to avoid redundant data
-class WorkoutSchema(ma.Schema):
+class WorkoutSchema(Schema):
     user = fields.Nested("UserSchema", only=["id", "name"])
 
     # Title validation using a constant
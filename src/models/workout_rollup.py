@@ -0,0 +1,31 @@
+from init import db
+
+
+class WorkoutRollup(db.Model):
+    # Name of the table
+    __tablename__ = "workout_rollups"
+
+    # Attributes
+    # Totals of a user's workouts for one period (week, month or year) starting at period_start
+    # Kept up to date by the workout routes, rebuilt with 'flask db rebuild-rollups'
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(5), nullable=False)
+    period_start = db.Column(db.Date, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    total_distance_kms = db.Column(db.Integer, nullable=False)
+    total_calories_burnt = db.Column(db.Integer, nullable=False)
+    # Number of workouts with calories_burnt, to average calories like the DB does
+    calories_count = db.Column(db.Integer, nullable=False)
+    max_distance_kms = db.Column(db.Integer)
+    max_calories_burnt = db.Column(db.Integer)
+
+    # Define FK to reference 'users' table
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+
+    # Define bidirectional relationships with 'users' table
+    user = db.relationship("User", back_populates="workout_rollups")
+
+    # One row per user, period and start date, in the order the stats route reads them
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "period", "period_start", name="uq_workout_rollups_user_id_period_period_start"),
+    )
@@ -0,0 +1,132 @@
+# Read replica routing, set DATABASE_REPLICA_URL to send the GET routes of the workouts,
+# groups, marathons and me blueprints to a replica, everything else uses the primary
+# Flushes always go to the primary, and a user who just wrote reads from the primary
+# for READ_REPLICA_STICKY_SECONDS so they see their own changes despite replication lag
+# Cache misses right after an invalidation read from the primary (g.read_primary, set by
+# cache.py and leaderboards.py), so a lagging replica is never cached
+import threading
+
+from flask import g, request, current_app, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from itsdangerous import TimestampSigner, BadSignature
+
+
+# Bind key of the replica engine in SQLALCHEMY_BINDS
+REPLICA_BIND = "replica"
+# Blueprints whose GET routes read from the replica
+REPLICA_BLUEPRINTS = ("workouts", "groups", "marathons", "me")
+# Methods that never write
+READ_METHODS = ("GET", "HEAD")
+# Cookie and header of the signed token of a user's last write, eg: "12.ZxY3kA.3ZlFv..."
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+
+# db.session class, sends the statements of replica requests to the replica engine
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _use_replica():
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReadReplica:
+    def __init__(self, db, app=None):
+        self.db = db
+        self.replica_requests = 0
+        self.primary_requests = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    # The replica engine comes from SQLALCHEMY_BINDS["replica"], without it every request uses the primary
+    def init_app(self, app):
+        self.enabled = REPLICA_BIND in app.config.get("SQLALCHEMY_BINDS", {})
+        self.blueprints = set(app.config.get("READ_REPLICA_BLUEPRINTS", REPLICA_BLUEPRINTS))
+        self.sticky_seconds = app.config.get("READ_REPLICA_STICKY_SECONDS", 5)
+        # Signs the user id in the last write tokens, so they can't be forged for other users
+        self.signer = TimestampSigner(app.config.get("JWT_SECRET_KEY") or "", salt="read-replica-last-write")
+        if self.enabled:
+            app.after_request(self._end_request)
+        app.extensions["read_replica"] = self
+
+    # Whether the current request may read from the replica, decided on its first statement
+    # so the JWT of the route has been verified
+    def wants_replica(self):
+        if not self.enabled or request.method not in READ_METHODS:
+            return False
+        if not self.blueprints.intersection(request.blueprints):
+            return False
+        # Cache fills that can't use a lagging replica
+        if g.get("read_primary"):
+            return False
+        user_id = _current_user_id()
+        use_replica = user_id is None or not self._wrote_recently(user_id)
+        with self._lock:
+            if use_replica:
+                self.replica_requests += 1
+            else:
+                self.primary_requests += 1
+        return use_replica
+
+    def stats(self):
+        return {
+            "enabled": int(self.enabled),
+            "replica_requests": self.replica_requests,
+            "sticky_primary_requests": self.primary_requests,
+        }
+
+    # Whether the client sent a last write token of the user from the last sticky seconds
+    # The client carries it, so any worker can tell without a DB lookup
+    def _wrote_recently(self, user_id):
+        token = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+        if not token:
+            return False
+        try:
+            return self.signer.unsign(token, max_age=self.sticky_seconds) == str(user_id).encode()
+        except BadSignature:
+            return False
+
+    # Reads of the user stay on the primary for a while after a successful write
+    # The token is sent as a cookie for browsers, and as a header for API clients to send back
+    def _end_request(self, response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            user_id = _current_user_id()
+            if user_id is not None:
+                token = self.signer.sign(str(user_id)).decode()
+                response.headers[LAST_WRITE_HEADER] = token
+                response.set_cookie(LAST_WRITE_COOKIE, token, max_age=self.sticky_seconds, httponly=True, samesite="Lax")
+        return response
+
+
+# Connection pool numbers of an engine, eg: {"size": 5, "checkedout": 2, ...}
+# Pools without a fixed size (SQLite) only report what they have
+def pool_stats(engine):
+    stats = {}
+    for key in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(engine.pool, key, None)
+        if method is not None:
+            stats[key] = method()
+    return stats
+
+
+# Whether db.session should use the replica, cached for the request
+def _use_replica():
+    if not has_request_context():
+        return False
+    if "use_replica" not in g:
+        g.use_replica = current_app.extensions["read_replica"].wants_replica()
+    return g.use_replica
+
+
+# Id of the user of the request's JWT, None if there is no verified JWT
+def _current_user_id():
+    try:
+        user_id = get_jwt_identity()
+    except RuntimeError:
+        return None
+    return int(user_id) if user_id is not None else None
+
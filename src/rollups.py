@@ -0,0 +1,125 @@
+# Per user totals of workouts for each period, kept up to date in the transaction writing the workouts
+# Adding workouts only increments the rollups, one upsert for every period they fall in
+# Updating or deleting a workout can lower a maximum, so the periods it falls in are recomputed
+# from the workouts of that user, which is bounded by the size of a year
+from sqlalchemy import func, case, tuple_, union_all, and_, or_
+
+from init import db
+from models.workout import Workout
+from models.workout_rollup import WorkoutRollup
+from utils import PERIODS, period_start, period_end, period_start_expression, dialect_insert
+
+
+# Columns of the unique constraint of workout_rollups
+ROLLUP_KEY = ["user_id", "period", "period_start"]
+# Columns filled by an INSERT ... SELECT of _aggregate_select
+ROLLUP_COLUMNS = [
+    "user_id", "period", "period_start", "count", "total_distance_kms",
+    "total_calories_burnt", "calories_count", "max_distance_kms", "max_calories_burnt",
+]
+
+
+# Add workouts to their rollups, workouts are (user_id, date, distance_kms, calories_burnt)
+# Call it after the workouts are flushed and before the commit
+def add_workouts(workouts):
+    totals = {}
+    for user_id, workout_date, distance_kms, calories_burnt in workouts:
+        for period in PERIODS:
+            key = (int(user_id), period, period_start(period, workout_date))
+            rollup = totals.get(key)
+            if rollup is None:
+                rollup = totals[key] = dict(
+                    zip(ROLLUP_KEY, key), count=0, total_distance_kms=0, total_calories_burnt=0,
+                    calories_count=0, max_distance_kms=None, max_calories_burnt=None,
+                )
+            rollup["count"] += 1
+            rollup["total_distance_kms"] += distance_kms
+            rollup["max_distance_kms"] = _max(rollup["max_distance_kms"], distance_kms)
+            if calories_burnt is not None:
+                rollup["total_calories_burnt"] += calories_burnt
+                rollup["calories_count"] += 1
+                rollup["max_calories_burnt"] = _max(rollup["max_calories_burnt"], calories_burnt)
+    if not totals:
+        return
+
+    # Add the totals to the existing rollups, or create them
+    stmt = dialect_insert(WorkoutRollup)
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(index_elements=ROLLUP_KEY, set_={
+        "count": WorkoutRollup.count + new["count"],
+        "total_distance_kms": WorkoutRollup.total_distance_kms + new["total_distance_kms"],
+        "total_calories_burnt": WorkoutRollup.total_calories_burnt + new["total_calories_burnt"],
+        "calories_count": WorkoutRollup.calories_count + new["calories_count"],
+        "max_distance_kms": _greatest(WorkoutRollup.max_distance_kms, new["max_distance_kms"]),
+        "max_calories_burnt": _greatest(WorkoutRollup.max_calories_burnt, new["max_calories_burnt"]),
+    })
+    db.session.execute(stmt, list(totals.values()))
+
+
+# Recompute the rollups of the periods a date falls in for a user
+# Call it after an update or delete of a workout is flushed and before the commit
+# The rollups are locked first: a concurrent write of the user's workouts in these periods
+# commits before the totals are computed, or waits for this transaction. The totals are
+# then upserted, so two requests recomputing the same period never insert it twice
+def refresh_rollups(user_id, workout_date):
+    keys = [(user_id, period, period_start(period, workout_date)) for period in PERIODS]
+    key_columns = tuple_(WorkoutRollup.user_id, WorkoutRollup.period, WorkoutRollup.period_start)
+    db.session.execute(db.select(WorkoutRollup.id).where(key_columns.in_(keys)).with_for_update())
+
+    periods = [(period, start, period_end(period, start)) for _, period, start in keys]
+    selects = [
+        _aggregate_select(period, Workout.user_id == user_id, Workout.date.between(start, end))
+        for period, start, end in periods
+    ]
+    stmt = dialect_insert(WorkoutRollup).from_select(ROLLUP_COLUMNS, union_all(*selects))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=ROLLUP_KEY, set_={column: stmt.excluded[column] for column in ROLLUP_COLUMNS if column not in ROLLUP_KEY},
+    )
+    db.session.execute(stmt)
+
+    # Periods left without workouts
+    db.session.execute(db.delete(WorkoutRollup).where(WorkoutRollup.user_id == user_id, or_(*(
+        and_(
+            WorkoutRollup.period == period,
+            WorkoutRollup.period_start == start,
+            ~db.select(Workout.id).where(Workout.user_id == user_id, Workout.date.between(start, end)).exists(),
+        )
+        for period, start, end in periods
+    ))))
+
+
+# Recreate every rollup from the workouts table, used by 'flask db rebuild-rollups'
+def rebuild_rollups():
+    db.session.execute(db.delete(WorkoutRollup))
+    selects = [_aggregate_select(period) for period in PERIODS]
+    db.session.execute(db.insert(WorkoutRollup).from_select(ROLLUP_COLUMNS, union_all(*selects)))
+
+
+# SELECT of the rollups of one period, grouped by user and first day of the period
+def _aggregate_select(period, *filters):
+    start = period_start_expression(period, Workout.date)
+    return (
+        db.select(
+            Workout.user_id,
+            db.literal(period),
+            start,
+            func.count(Workout.id),
+            func.sum(Workout.distance_kms),
+            func.coalesce(func.sum(Workout.calories_burnt), 0),
+            func.count(Workout.calories_burnt),
+            func.max(Workout.distance_kms),
+            func.max(Workout.calories_burnt),
+        )
+        .where(*filters)
+        .group_by(Workout.user_id, start)
+    )
+
+
+# Bigger of two values, ignoring None
+def _max(current, value):
+    return value if current is None or value > current else current
+
+
+# SQL version of _max, used to merge the maximums of an upsert
+def _greatest(current, value):
+    return case((current.is_(None) | (value > current), value), else_=current)
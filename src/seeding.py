@@ -0,0 +1,146 @@
+# Synthetic dataset for 'flask db seed --users N ...', benchmarks and load tests
+# The same seed and anchor date always give the same rows. Rows are generated one batch at a time and written
+# with COPY on PostgreSQL (bulk inserts on other databases), ORM objects are never created
+import io
+import csv
+import random
+from datetime import date, timedelta
+from string import ascii_lowercase
+
+from init import db, bcrypt
+from models.user import User
+from models.workout import Workout
+from models.group import Group
+from models.group_log import GroupLog
+from models.marathon import Marathon
+from models.marathon_log import MarathonLog
+from rollups import rebuild_rollups
+
+
+# Rows sent to the DB at once
+BATCH_SIZE = 10000
+# Password of every generated user
+SEED_PASSWORD = "Brazil1."
+# Hashes of SEED_PASSWORD shared by the generated users, bcrypt is too slow to hash one per user
+HASH_POOL_SIZE = 8
+WORKOUT_TITLES = ("Treadmill", "Outside run", "Outside walk", "Marathon run")
+LOCATIONS = ("Gold Coast", "Melbourne City", "Sydney Harbour", "Brisbane River", "Perth Foreshore")
+
+
+# Create the dataset, returns the ids of what was created:
+# {"admins": [...], "runners": [...], "groups": [...], "marathons": [...]}
+# Each group has an admin, runners join 'memberships' groups and log 'workouts_per_user' workouts
+# over the year before 'anchor_date', groups enrol in up to 'enrolments' marathons around it
+# anchor_date defaults to today, so the data has upcoming marathons and workouts in the current periods
+def seed_dataset(users=100, groups=10, marathons=20, workouts_per_user=50, memberships=1, enrolments=3, seed=0, anchor_date=None):
+    rng = random.Random(seed)
+    today = anchor_date or date.today()
+    hashes = [bcrypt.generate_password_hash(SEED_PASSWORD).decode("utf-8") for _ in range(HASH_POOL_SIZE)]
+
+    admin_ids = _insert(User, (
+        {"name": f"Admin {name_suffix(i)}", "email": f"admin{i}@email.com", "password": hashes[i % HASH_POOL_SIZE], "is_admin": True, "version": 1}
+        for i in range(groups)
+    ))
+    runner_ids = _insert(User, (
+        {"name": f"Runner {name_suffix(i)}", "email": f"runner{i}@email.com", "password": hashes[i % HASH_POOL_SIZE], "is_admin": False, "version": 1}
+        for i in range(users)
+    ))
+    group_ids = _insert(Group, (
+        {"name": f"Group {name_suffix(i)}", "date_created": today, "created_by": admin_id, "version": 1}
+        for i, admin_id in enumerate(admin_ids)
+    ))
+    marathon_ids = _insert(Marathon, (
+        {
+            "name": f"Marathon {name_suffix(i)}",
+            "event_date": today + timedelta(days=rng.randint(-180, 365)),
+            "location": rng.choice(LOCATIONS),
+            "distance_kms": rng.choice((5, 10, 21, 42)),
+            "version": 1,
+        }
+        for i in range(marathons)
+    ))
+
+    _write(GroupLog, (
+        {"user_id": user_id, "group_id": group_id, "entry_created": today}
+        for user_id, group_id in _members(rng, admin_ids, runner_ids, group_ids, memberships)
+    ))
+    _write(MarathonLog, (
+        {"group_id": group_id, "marathon_id": marathon_id, "entry_created": today}
+        for group_id in group_ids
+        for marathon_id in rng.sample(marathon_ids, min(enrolments, len(marathon_ids)))
+    ))
+    _write(Workout, (
+        {
+            "title": rng.choice(WORKOUT_TITLES),
+            "date": today - timedelta(days=rng.randint(0, 364)),
+            "distance_kms": rng.randint(1, 42),
+            "calories_burnt": rng.randint(100, 1500),
+            "user_id": runner_id,
+            "version": 1,
+        }
+        for runner_id in runner_ids
+        for _ in range(workouts_per_user)
+    ))
+
+    rebuild_rollups()
+    db.session.commit()
+    return {"admins": admin_ids, "runners": runner_ids, "groups": group_ids, "marathons": marathon_ids}
+
+
+# (user_id, group_id) of the group members, admins are members of their own group
+def _members(rng, admin_ids, runner_ids, group_ids, memberships):
+    yield from zip(admin_ids, group_ids)
+    for runner_id in runner_ids:
+        for group_id in rng.sample(group_ids, min(memberships, len(group_ids))):
+            yield runner_id, group_id
+
+
+# Insert rows in batches, returns their ids in the same order
+def _insert(model, rows):
+    ids = []
+    stmt = db.insert(model).returning(model.id, sort_by_parameter_order=True)
+    for batch in _batches(rows):
+        ids += db.session.scalars(stmt, batch).all()
+    return ids
+
+
+# Write rows in batches when their ids aren't needed, with COPY on PostgreSQL
+def _write(model, rows):
+    copy = db.session.get_bind().dialect.name == "postgresql"
+    for batch in _batches(rows):
+        if copy:
+            _copy(model.__table__.name, batch)
+        else:
+            db.session.execute(db.insert(model), batch)
+
+
+# COPY a batch of rows into a table, inside of the session's transaction
+def _copy(table, batch):
+    columns = list(batch[0])
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([row[column] for column in columns] for row in batch)
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+# Group rows in lists of BATCH_SIZE rows
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Letters only name suffix, the name validators don't allow digits: 0 => "A", 26 => "Aa"
+def name_suffix(number):
+    suffix = ""
+    while True:
+        suffix = ascii_lowercase[number % 26] + suffix
+        number = number // 26 - 1
+        if number < 0:
+            return suffix.capitalize()
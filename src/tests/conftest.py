@@ -0,0 +1,62 @@
+# Test fixtures: an app on an in-memory SQLite database with the query budgets raising
+# Run from the src folder: python -m pytest tests
+import os
+import sys
+from datetime import timedelta
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_app
+from init import db
+from models.user import User
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite://",
+        "JWT_SECRET_KEY": "tests-secret-key-tests-secret-key-tests",
+        "BCRYPT_LOG_ROUNDS": 4,
+        "QUERY_BUDGETS": "raise",
+        "TESTING": True,
+    })
+    with app.app_context():
+        # Only the primary, db keeps the bind keys of apps created by other tests
+        db.create_all(bind_key=None)
+        yield app
+        db.session.remove()
+        db.drop_all(bind_key=None)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Insert rows without the ORM, returns their ids in the same order
+def insert_rows(model, rows):
+    if hasattr(model, "version"):
+        rows = [{"version": 1, **row} for row in rows]
+    ids = db.session.scalars(db.insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+    db.session.commit()
+    return ids
+
+
+# Authorisation header of a user, with the claims login_user would add
+def auth_headers(user_id, is_admin=False, group_id=None):
+    claims = {"is_admin": is_admin, "group_id": group_id, "token_version": 0}
+    token = create_access_token(identity=str(user_id), additional_claims=claims, expires_delta=timedelta(hours=1))
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def runner_id(app):
+    return insert_rows(User, [{"name": "Runner", "email": "runner@email.com", "password": "x", "is_admin": False}])[0]
+
+
+@pytest.fixture
+def headers(runner_id):
+    return auth_headers(runner_id)
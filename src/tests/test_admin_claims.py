@@ -0,0 +1,65 @@
+from datetime import date
+
+from init import db
+from models.user import User
+from models.marathon import Marathon
+from models.marathon_log import MarathonLog
+from budgets import record_queries
+from utils import bump_token_version
+from conftest import insert_rows, auth_headers
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_new_group_token_enrols_without_reading_the_admin(client):
+    admin_id = insert_rows(User, [{"name": "Admin", "email": "admin@email.com", "password": "x", "is_admin": True}])[0]
+    marathon_id = insert_rows(Marathon, [{"name": "Marathon", "event_date": date(2030, 1, 1), "location": "Gold Coast", "distance_kms": 10}])[0]
+
+    response = client.post("/groups/register", json={"name": "Group"}, headers=auth_headers(admin_id, is_admin=True))
+    assert response.status_code == 201
+    group_id = response.get_json()["id"]
+
+    with record_queries() as recorder:
+        response = client.post(f"/marathons/{marathon_id}/signup", headers=bearer(response.get_json()["token"]))
+    assert response.status_code == 201
+    assert db.session.scalar(db.select(MarathonLog.group_id)) == group_id
+    # Token version, insert, cache generation, then the entry with its group, marathon and members
+    assert recorder.count == 5
+    # The claims were trusted, the admin and their group weren't read
+    assert [call_site.split(" in ")[1] for _, call_site, _ in recorder.statements if call_site.startswith("utils.py")] == ["current_token_version"]
+
+
+def test_deleted_group_token_can_create_a_group(client):
+    admin_id = insert_rows(User, [{"name": "Admin", "email": "admin@email.com", "password": "x", "is_admin": True}])[0]
+    response = client.post("/groups/register", json={"name": "Group"}, headers=auth_headers(admin_id, is_admin=True))
+    response = client.delete(f"/groups/{response.get_json()['id']}", headers=bearer(response.get_json()["token"]))
+    assert response.status_code == 200
+
+    response = client.post("/groups/register", json={"name": "Group Again"}, headers=bearer(response.get_json()["token"]))
+    assert response.status_code == 201
+
+
+# Another worker demotes the admin, the next request on this one is refused
+def test_demoted_admin_is_refused_at_once(client):
+    admin_id = insert_rows(User, [{"name": "Admin", "email": "admin@email.com", "password": "x", "is_admin": True}])[0]
+    headers = auth_headers(admin_id, is_admin=True)
+    body = {"name": "Marathon", "event_date": "2030-01-01", "location": "Gold Coast", "distance_kms": 10}
+    assert client.post("/marathons/register", json=body, headers=headers).status_code == 201
+
+    db.session.execute(db.update(User).filter_by(id=admin_id).values(is_admin=False))
+    bump_token_version(admin_id)
+    db.session.commit()
+
+    response = client.post("/marathons/register", json={**body, "name": "Marathon B"}, headers=headers)
+    assert response.status_code == 403
+
+
+def test_deleted_admin_is_refused(client):
+    admin_id = insert_rows(User, [{"name": "Admin", "email": "admin@email.com", "password": "x", "is_admin": True}])[0]
+    headers = auth_headers(admin_id, is_admin=True)
+    assert client.delete(f"/auth/users/{admin_id}", headers=headers).status_code == 200
+
+    body = {"name": "Marathon", "event_date": "2030-01-01", "location": "Gold Coast", "distance_kms": 10}
+    assert client.post("/marathons/register", json=body, headers=headers).status_code == 403
@@ -0,0 +1,151 @@
+import sys
+import json
+import asyncio
+import importlib
+from datetime import date
+
+import pytest
+
+from main import create_app
+from init import db
+from models.user import User
+from models.workout import Workout
+from conftest import insert_rows, auth_headers
+
+
+# Headers both servers must send alike, Date and Server differ
+COMPARED_HEADERS = ("content-type", "etag", "x-next-cursor", "content-disposition")
+
+
+# asgi.py and main.py apps on one SQLite file, asgi.py reads DATABASE_URL when it's imported
+# The ASGI app runs on one event loop, the aiosqlite connections are bound to it
+@pytest.fixture
+def servers(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'marathon.db'}")
+    monkeypatch.setenv("JWT_SECRET_KEY", "tests-secret-key-tests-secret-key-tests")
+    monkeypatch.setenv("BCRYPT_LOG_ROUNDS", "4")
+    monkeypatch.setenv("QUERY_BUDGETS", "raise")
+    monkeypatch.delenv("DATABASE_REPLICA_URL", raising=False)
+    sys.modules.pop("asgi", None)
+    asgi = importlib.import_module("asgi")
+    wsgi_app = create_app({"TESTING": True})
+    with wsgi_app.app_context():
+        db.create_all(bind_key=None)
+    loop = asyncio.new_event_loop()
+    yield asgi.app, wsgi_app, loop
+    loop.run_until_complete(lifespan_shutdown(asgi.app))
+    loop.close()
+    sys.modules.pop("asgi", None)
+
+
+async def lifespan_shutdown(asgi_app):
+    messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        pass
+
+    await asgi_app({"type": "lifespan"}, receive, send)
+
+
+# Status, compared headers and body of an ASGI request
+# The body is sent in two chunks without Content-Length, like a chunked upload
+def asgi_request(servers, method, path, headers=None, json_body=None):
+    asgi_app, _, loop = servers
+    path, _, query = path.partition("?")
+    body = json.dumps(json_body).encode("utf-8") if json_body is not None else b""
+    raw_headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()]
+    if json_body is not None:
+        raw_headers.append((b"content-type", b"application/json"))
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": query.encode("latin-1"),
+        "headers": raw_headers, "http_version": "1.1", "scheme": "http", "root_path": "",
+        "server": ("localhost", 80), "client": ("127.0.0.1", 50000),
+    }
+    chunks = iter([{"type": "http.request", "body": body[:1], "more_body": True}, {"type": "http.request", "body": body[1:]}])
+    messages = []
+
+    async def receive():
+        return next(chunks)
+
+    async def send(message):
+        messages.append(message)
+
+    loop.run_until_complete(asgi_app(scope, receive, send))
+    start, *bodies = messages
+    response_headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in start["headers"]}
+    assert not bodies[-1].get("more_body")
+    return start["status"], compared(response_headers), b"".join(message["body"] for message in bodies)
+
+
+def wsgi_request(servers, method, path, headers=None, json_body=None):
+    response = servers[1].test_client().open(path, method=method, headers=headers, json=json_body)
+    return response.status_code, compared({name.lower(): value for name, value in response.headers.items()}), response.get_data()
+
+
+def compared(headers):
+    return {name: headers[name] for name in COMPARED_HEADERS if name in headers}
+
+
+@pytest.fixture
+def runner(servers):
+    with servers[1].app_context():
+        runner_id = insert_rows(User, [{"name": "Runner", "email": "runner@email.com", "password": "x", "is_admin": False}])[0]
+        insert_rows(Workout, [
+            {"title": "Treadmill", "date": date(2030, 1, day), "distance_kms": day, "calories_burnt": 100 * day if day % 2 else None, "user_id": runner_id}
+            for day in range(1, 6)
+        ])
+        return auth_headers(runner_id)
+
+
+# Same status, headers and body from both servers
+def test_responses_match(servers, runner):
+    requests = [
+        ("GET", "/workouts/?limit=2", runner),
+        ("GET", "/workouts/?limit=2&fields=id,date", runner),
+        ("GET", "/workouts/1", runner),
+        ("GET", "/workouts/999", runner),
+        ("GET", "/workouts/stats?period=month", runner),
+        ("GET", "/workouts/stats?period=week&from=2030-01-02&to=2030-01-04", runner),
+        ("GET", "/workouts/export?format=ndjson", runner),
+        ("GET", "/workouts/export?format=csv", runner),
+        ("GET", "/workouts/", None),
+        ("GET", "/workouts/?limit=0", runner),
+        ("GET", "/not-a-route", None),
+    ]
+    for method, path, headers in requests:
+        asgi_response = asgi_request(servers, method, path, headers)
+        assert asgi_response == wsgi_request(servers, method, path, headers), path
+        assert asgi_response[2]
+
+
+# A cursor and an ETag of one server work with the other
+def test_cursor_and_etag_between_servers(servers, runner):
+    _, headers, _ = asgi_request(servers, "GET", "/workouts/?limit=2", runner)
+    path = f"/workouts/?limit=2&cursor={headers['x-next-cursor']}"
+    status, headers, body = wsgi_request(servers, "GET", path, runner)
+    assert [workout["date"] for workout in json.loads(body)] == ["2030-01-03", "2030-01-02"]
+    assert asgi_request(servers, "GET", path, {**runner, "If-None-Match": headers["etag"]})[0] == 304
+
+
+# Writes and bcrypt run on the ASGI server too, the body is read across chunks
+def test_writes(servers, runner):
+    status, _, body = asgi_request(servers, "POST", "/workouts/", runner, {"title": "Treadmill", "distance_kms": 8})
+    assert status == 201
+    workout_id = json.loads(body)["id"]
+    assert wsgi_request(servers, "GET", f"/workouts/{workout_id}", runner)[0] == 200
+
+    credentials = {"name": "New", "email": "new@email.com", "password": "Password123!"}
+    assert asgi_request(servers, "POST", "/auth/register", json_body=credentials)[0] == 201
+    login = {"email": "new@email.com", "password": "Password123!"}
+    assert asgi_request(servers, "POST", "/auth/login", json_body=login)[0] == 200
+    assert wsgi_request(servers, "POST", "/auth/login", json_body=login)[0] == 200
+    assert asgi_request(servers, "POST", "/auth/login", json_body={**login, "password": "wrong"})[0] == 400
+
+
+def test_body_too_large(servers, monkeypatch):
+    monkeypatch.setattr(sys.modules["asgi"], "MAX_BODY_SIZE", 10)
+    status, headers, body = asgi_request(servers, "POST", "/auth/login", json_body={"email": "runner@email.com", "password": "password"})
+    assert (status, headers, json.loads(body)) == (413, {"content-type": "application/json"}, {"error": "Request body is too large."})
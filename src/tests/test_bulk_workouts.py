@@ -0,0 +1,55 @@
+from sqlalchemy import text
+
+from init import db
+from models.workout import Workout
+from models.workout_rollup import WorkoutRollup
+
+
+def workout(distance_kms=5, **fields):
+    return {"title": "Treadmill", "date": "2030-01-01", "distance_kms": distance_kms, **fields}
+
+
+def test_whole_numbers_only(client, headers):
+    body = [
+        workout(5),
+        workout(5.0),
+        workout("5"),
+        workout(5.9),
+        workout("5.9"),
+        workout(True),
+        workout(5, calories_burnt=235.5),
+        workout(5, calories_burnt="many"),
+    ]
+    response = client.post("/workouts/bulk", json=body, headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()["inserted"] == 3
+    assert [error["row"] for error in response.get_json()["errors"]] == [3, 4, 5, 6, 7]
+    assert response.get_json()["errors"][0]["error"] == {"distance_kms": ["Must be a whole number, eg: 5 not 5.9."]}
+    assert response.get_json()["errors"][3]["error"] == {"calories_burnt": ["Must be a whole number, eg: 235 not 235.5."]}
+    assert db.session.scalars(db.select(Workout.distance_kms)).all() == [5, 5, 5]
+
+
+# A row the DB rejects is reported, the other rows of its chunk are still saved
+def test_rows_rejected_by_the_database(client, headers):
+    db.session.execute(text(
+        "CREATE TRIGGER reject_long_workouts BEFORE INSERT ON workouts WHEN NEW.distance_kms > 100 "
+        "BEGIN SELECT RAISE(ABORT, 'too far'); END"
+    ))
+    db.session.commit()
+
+    body = [workout(5), workout(500), workout(10), workout(200)]
+    response = client.post("/workouts/bulk", json=body, headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()["inserted"] == 2
+    assert [error["row"] for error in response.get_json()["errors"]] == [1, 3]
+    assert "too far" in response.get_json()["errors"][0]["error"]["error"]
+    assert sorted(db.session.scalars(db.select(Workout.distance_kms))) == [5, 10]
+    # The rollups only count the saved workouts
+    week = db.session.scalar(db.select(WorkoutRollup).filter_by(period="week"))
+    assert (week.count, week.total_distance_kms) == (2, 15)
+
+
+def test_every_row_rejected(client, headers):
+    response = client.post("/workouts/bulk", json=[workout(5.5)], headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()["inserted"] == 0
@@ -0,0 +1,116 @@
+from datetime import date, datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+import calendars
+from models.user import User
+from models.group import Group
+from models.group_log import GroupLog
+from models.marathon import Marathon
+from models.marathon_log import MarathonLog
+from conftest import insert_rows
+
+
+TODAY = datetime.now(timezone.utc).date()
+
+
+def add_marathons(days, name="Marathon", location="Gold Coast"):
+    return insert_rows(Marathon, [
+        {"name": name, "event_date": TODAY + timedelta(days=day), "location": location, "distance_kms": 42} for day in days
+    ])
+
+
+# Group created by a new admin, with the runner as a member, enrolled in the marathons
+def add_group(runner_id, marathons):
+    admin_id = insert_rows(User, [{"name": "Admin", "email": f"admin{uuid4().hex}@email.com", "password": "x", "is_admin": True}])[0]
+    group_id = insert_rows(Group, [{"name": "Group", "date_created": TODAY, "created_by": admin_id}])[0]
+    insert_rows(GroupLog, [{"user_id": runner_id, "group_id": group_id, "entry_created": TODAY}])
+    if marathons:
+        insert_rows(MarathonLog, [{"group_id": group_id, "marathon_id": marathon, "entry_created": TODAY} for marathon in marathons])
+    return group_id
+
+
+# Ids of every page, following the X-Next-Cursor header
+def all_pages(client, path, headers):
+    ids, cursor = [], None
+    while True:
+        response = client.get(path + (f"&cursor={cursor}" if cursor else ""), headers=headers)
+        assert response.status_code == 200
+        ids += [marathon["id"] for marathon in response.get_json()["marathons"]]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids
+
+
+# Soonest first, ties by id, past marathons left out
+def test_group_calendar_pages(client, runner_id, headers):
+    days = [-1, 3, 0, 3, 10, 3]
+    marathons = add_marathons(days)
+    group_id = add_group(runner_id, marathons)
+    expected = [marathon for day, marathon in sorted(zip(days, marathons)) if day >= 0]
+    assert all_pages(client, f"/groups/{group_id}/calendar?limit=2", headers) == expected
+
+
+# A marathon several of the member's groups are enrolled in is listed once
+def test_member_calendar_lists_each_marathon_once(client, runner_id, headers):
+    shared, first, second = add_marathons([5, 1, 9])
+    add_group(runner_id, [shared, first])
+    add_group(runner_id, [shared, second])
+    assert all_pages(client, "/me/calendar?limit=1", headers) == [first, shared, second]
+
+
+def test_unknown_group(client, runner_id, headers):
+    assert client.get("/groups/999/calendar", headers=headers).status_code == 404
+    group_id = add_group(runner_id, [])
+    response = client.get(f"/groups/{group_id}/calendar", headers=headers)
+    assert response.get_json() == {"group_id": group_id, "marathons": []}
+
+
+@pytest.mark.parametrize("query, error", [
+    ("format=xml", "Format must be one of: json, ics."),
+    ("cursor=not-a-cursor", "Invalid cursor."),
+    ("limit=0", None),
+])
+def test_invalid_parameters(client, headers, query, error):
+    response = client.get(f"/me/calendar?{query}", headers=headers)
+    assert response.status_code == 400
+    if error:
+        assert response.get_json() == {"error": error}
+
+
+# Lines over 75 octets are folded, without cutting a UTF-8 character, and text is escaped
+def test_ics_folding_and_escaping(client, runner_id, headers):
+    name = "Marathon; of the Gold Coast, with a very long name that goes on éééééééé and on"
+    marathon_id = add_marathons([2], name=name, location="Gold Coast\\Queensland")[0]
+    group_id = add_group(runner_id, [marathon_id])
+    response = client.get(f"/groups/{group_id}/calendar?format=ics", headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == "text/calendar"
+
+    body = response.get_data()
+    assert body.endswith(b"\r\n")
+    lines = body.split(b"\r\n")[:-1]
+    assert all(len(line) <= 75 for line in lines)
+    assert any(line.startswith(b" ") for line in lines)
+    # Unfolded, the text is back with its special characters escaped
+    unfolded = body.decode("utf-8").replace("\r\n ", "").split("\r\n")
+    assert "SUMMARY:Marathon\\; of the Gold Coast\\, with a very long name that goes on éééééééé and on" in unfolded
+    assert "LOCATION:Gold Coast\\\\Queensland" in unfolded
+    assert f"DTSTART;VALUE=DATE:{TODAY + timedelta(days=2):%Y%m%d}" in unfolded
+
+
+# Upcoming from today in UTC, whatever the time zone of the server
+def test_upcoming_from_the_utc_date(client, runner_id, headers, monkeypatch):
+    class UTCDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2030, 1, 2, 0, 30, tzinfo=timezone.utc).astimezone(tz)
+
+    monkeypatch.setattr(calendars, "datetime", UTCDatetime)
+    marathons = insert_rows(Marathon, [
+        {"name": "Marathon", "event_date": date(2030, 1, day), "location": "Gold Coast", "distance_kms": 42} for day in (1, 2)
+    ])
+    add_group(runner_id, marathons)
+    response = client.get("/me/calendar", headers=headers)
+    assert [marathon["event_date"] for marathon in response.get_json()["marathons"]] == ["2030-01-02"]
@@ -0,0 +1,87 @@
+import functools
+from datetime import date
+
+import pytest
+
+from main import create_app
+from init import db, leaderboard_cache
+from models.user import User
+from models.group import Group
+from models.group_log import GroupLog
+from budgets import record_queries
+from conftest import insert_rows, auth_headers
+
+
+def workout(distance_kms):
+    return {"title": "Treadmill", "date": date.today().isoformat(), "distance_kms": distance_kms}
+
+
+def board(client, group_id, headers):
+    response = client.get(f"/groups/{group_id}/leaderboard", headers=headers)
+    assert response.status_code == 200
+    return [(entry["user"]["name"], entry["total_distance_kms"]) for entry in response.get_json()["leaderboard"]]
+
+
+@pytest.fixture
+def group(runner_id):
+    group_id = insert_rows(Group, [{"name": "Group", "date_created": date(2030, 1, 1), "created_by": runner_id}])[0]
+    insert_rows(GroupLog, [{"user_id": runner_id, "group_id": group_id, "entry_created": date(2030, 1, 1)}])
+    return group_id
+
+
+# The worker handling the write updates its cached board, the next read runs no query
+def test_board_updated_in_place(client, headers, group):
+    assert board(client, group, headers) == []
+    assert client.post("/workouts/", json=workout(5), headers=headers).status_code == 201
+
+    with record_queries() as recorder:
+        assert board(client, group, headers) == [("Runner", 5)]
+    assert recorder.count == 0
+
+
+# Two apps on one database, like two worker processes. The leaderboard cache is a module
+# global, so each app swaps in the boards and generation copies of its worker on every request
+@pytest.fixture
+def workers(tmp_path):
+    apps = []
+    for _ in range(2):
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'marathon.db'}",
+            "JWT_SECRET_KEY": "tests-secret-key-tests-secret-key-tests",
+            "QUERY_BUDGETS": "raise",
+            "TESTING": True,
+        })
+        caches = (leaderboard_cache.backend, leaderboard_cache.generations.local)
+        app.before_request(functools.partial(use_caches, caches))
+        apps.append((app, caches))
+    with apps[0][0].app_context():
+        db.create_all(bind_key=None)
+    return apps
+
+
+def use_caches(caches):
+    leaderboard_cache.backend, leaderboard_cache.generations.local = caches
+
+
+def test_write_reaches_other_workers(workers):
+    (app_a, caches_a), (app_b, caches_b) = workers
+    with app_a.app_context():
+        runner_id = insert_rows(User, [{"name": "Runner", "email": "runner@email.com", "password": "x", "is_admin": False}])[0]
+        group_id = insert_rows(Group, [{"name": "Group", "date_created": date(2030, 1, 1), "created_by": runner_id}])[0]
+        insert_rows(GroupLog, [{"user_id": runner_id, "group_id": group_id, "entry_created": date(2030, 1, 1)}])
+        headers = auth_headers(runner_id)
+    client_a, client_b = app_a.test_client(), app_b.test_client()
+
+    assert board(client_a, group_id, headers) == []
+    assert client_b.post("/workouts/", json=workout(5), headers=headers).status_code == 201
+    assert board(client_b, group_id, headers) == [("Runner", 5)]
+
+    # Worker A trusts its copy of the generation for CACHE_GENERATION_TTL, then reloads the board
+    assert board(client_a, group_id, headers) == []
+    caches_a[1].clear()
+    assert board(client_a, group_id, headers) == [("Runner", 5)]
+
+    # Leaving the group reaches worker B too
+    assert client_a.delete(f"/groups/{group_id}/unsubscribe", headers=headers).status_code == 200
+    caches_b[1].clear()
+    assert board(client_b, group_id, headers) == []
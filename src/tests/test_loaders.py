@@ -0,0 +1,51 @@
+from datetime import date
+
+import pytest
+
+from init import db
+from models.user import User
+from models.group import Group, GroupSchema
+from models.group_log import GroupLog
+from models.marathon import Marathon, MarathonSchema
+from models.marathon_log import MarathonLog
+from loaders import loader_options
+from budgets import assert_max_queries
+from conftest import insert_rows
+
+
+# More parents than selectinload puts in one IN list
+ROWS = 600
+
+
+# ROWS groups with an admin, a member and a marathon each
+@pytest.fixture
+def dataset(app):
+    today = date.today()
+    admins = insert_rows(User, [{"name": "Admin", "email": f"admin{i}@email.com", "password": "x", "is_admin": True} for i in range(ROWS)])
+    members = insert_rows(User, [{"name": "Member", "email": f"member{i}@email.com", "password": "x", "is_admin": False} for i in range(ROWS)])
+    groups = insert_rows(Group, [{"name": "Group", "date_created": today, "created_by": admin} for admin in admins])
+    marathons = insert_rows(Marathon, [{"name": "Marathon", "event_date": today, "location": "Gold Coast", "distance_kms": 10} for _ in range(ROWS)])
+    insert_rows(GroupLog, [{"user_id": member, "group_id": group, "entry_created": today} for member, group in zip(members, groups)])
+    insert_rows(MarathonLog, [{"group_id": group, "marathon_id": marathon, "entry_created": today} for group, marathon in zip(groups, marathons)])
+
+
+@pytest.mark.parametrize("model, schema_class, max_queries", [
+    # groups with their admin, then group_logs with users, then marathon_logs with marathons
+    (Group, GroupSchema, 3),
+    # marathons, then marathon_logs
+    (Marathon, MarathonSchema, 2),
+])
+def test_statement_count_does_not_depend_on_row_count(dataset, model, schema_class, max_queries):
+    schema = schema_class(many=True)
+    with assert_max_queries(max_queries):
+        rows = db.session.scalars(db.select(model).options(*loader_options(model, schema)).order_by(model.id)).all()
+        dumped = schema.dump(rows)
+    assert len(dumped) == ROWS
+    assert all(row["marathon_logs"] for row in dumped)
+
+
+def test_sparse_fields_skip_unused_relationships(dataset):
+    schema = GroupSchema(many=True, only=("id", "name"))
+    with assert_max_queries(1):
+        rows = db.session.scalars(db.select(Group).options(*loader_options(Group, schema))).all()
+        schema.dump(rows)
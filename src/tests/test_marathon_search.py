@@ -0,0 +1,124 @@
+from datetime import date, timedelta
+
+import pytest
+
+from models.marathon import Marathon
+from utils import encode_cursor
+from conftest import insert_rows
+
+
+TODAY = date.today()
+# Names, dates and distances repeat so the order of ties (by id) is tested too
+LOCATIONS = ("Gold Coast", "Sunshine Coast", "Melbourne City", "100% Trail Park")
+MARATHONS = [
+    {
+        "name": f"Marathon {'ABCDE'[i % 5]}",
+        "event_date": TODAY + timedelta(days=(i % 9 - 4) * 10),
+        "location": LOCATIONS[i % 4],
+        "distance_kms": (5, 10, 21, 42)[i % 3],
+    }
+    for i in range(30)
+]
+
+FILTERS = {
+    "none": ({}, lambda m: True),
+    "from and to": (
+        {"from": (TODAY - timedelta(days=20)).isoformat(), "to": (TODAY + timedelta(days=20)).isoformat()},
+        lambda m: TODAY - timedelta(days=20) <= m["event_date"] <= TODAY + timedelta(days=20),
+    ),
+    "upcoming": ({"upcoming": "true"}, lambda m: m["event_date"] >= TODAY),
+    "upcoming after from": (
+        {"upcoming": "1", "from": (TODAY + timedelta(days=15)).isoformat()},
+        lambda m: m["event_date"] >= TODAY + timedelta(days=15),
+    ),
+    "location": ({"location": "COAST"}, lambda m: "coast" in m["location"].lower()),
+    "location wildcard": ({"location": "100%"}, lambda m: "100%" in m["location"]),
+    "distance range": ({"min_distance": "10", "max_distance": "21"}, lambda m: 10 <= m["distance_kms"] <= 21),
+    "combined": (
+        {"upcoming": "true", "location": "gold", "max_distance": "10"},
+        lambda m: m["event_date"] >= TODAY and "gold" in m["location"].lower() and m["distance_kms"] <= 10,
+    ),
+    "no match": ({"location": "Perth"}, lambda m: False),
+}
+SORTS = ("name", "-name", "event_date", "-event_date", "distance_kms", "-distance_kms")
+
+
+@pytest.fixture
+def marathons(app):
+    ids = insert_rows(Marathon, MARATHONS)
+    return [{"id": marathon_id, **row} for marathon_id, row in zip(ids, MARATHONS)]
+
+
+# Follow the cursors from the first page, returns the ids of every page
+def fetch_pages(client, params):
+    pages = []
+    cursor = None
+    while True:
+        response = client.get("/marathons/", query_string={**params, **({"cursor": cursor} if cursor else {})})
+        if response.status_code == 400:
+            return pages, response
+        assert response.status_code == 200
+        pages.append([marathon["id"] for marathon in response.get_json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages, response
+
+
+@pytest.mark.parametrize("sort", SORTS)
+@pytest.mark.parametrize("filter_name", FILTERS)
+def test_filters_and_sorts(client, marathons, filter_name, sort):
+    params, matches = FILTERS[filter_name]
+    key = sort.lstrip("-")
+    expected = sorted((m for m in marathons if matches(m)), key=lambda m: (m[key], m["id"]), reverse=sort.startswith("-"))
+
+    pages, response = fetch_pages(client, {**params, "sort": sort, "limit": 4})
+    if not expected:
+        assert response.status_code == 400
+        assert response.get_json() == {"Error": "No marathons match the search."}
+        return
+    assert [marathon_id for page in pages for marathon_id in page] == [m["id"] for m in expected]
+    assert all(len(page) == 4 for page in pages[:-1])
+
+
+def test_default_sort_and_limit(client, marathons):
+    response = client.get("/marathons/")
+    expected = sorted(marathons, key=lambda m: (m["name"], m["id"]))[:20]
+    assert [marathon["id"] for marathon in response.get_json()] == [m["id"] for m in expected]
+    assert response.headers.get("X-Next-Cursor")
+
+
+def test_cached_page_keeps_next_cursor(client, marathons):
+    first = client.get("/marathons/?limit=5")
+    second = client.get("/marathons/?limit=5")
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+    assert second.get_json() == first.get_json()
+
+
+def test_sparse_fields_still_paginate(client, marathons):
+    pages, _ = fetch_pages(client, {"fields": "id,name", "sort": "-event_date", "limit": 7})
+    assert sum(len(page) for page in pages) == len(marathons)
+
+
+@pytest.mark.parametrize("params, error", [
+    ({"from": "2024-13-01"}, "Invalid date format. Use YYYY-MM-DD."),
+    ({"from": "2025-02-01", "to": "2025-01-01"}, "The from date must be before the to date."),
+    ({"min_distance": "5.9"}, "Distances must be whole numbers of kms."),
+    ({"sort": "location"}, "Sort must be one of: name, event_date, distance_kms, with a leading '-' for descending order."),
+    ({"limit": "0"}, "Limit must be between 1 and 100."),
+    ({"cursor": "not-a-cursor"}, "Invalid cursor."),
+    # A cursor of another sort
+    ({"sort": "event_date", "cursor": encode_cursor("name", "Marathon A", 1)}, "Invalid cursor."),
+    ({"sort": "distance_kms", "cursor": encode_cursor("distance_kms", "ten", 1)}, "Invalid cursor."),
+])
+def test_invalid_parameters(client, marathons, params, error):
+    response = client.get("/marathons/", query_string=params)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+
+
+def test_no_marathons(client):
+    response = client.get("/marathons/")
+    assert response.status_code == 400
+    assert response.get_json() == {"Error": "No marathons created yet."}
@@ -0,0 +1,70 @@
+from datetime import date
+
+from sqlalchemy.dialects import postgresql
+
+from init import db
+from models.user import User
+from models.group import Group
+from models.group_log import GroupLog
+from models.marathon import Marathon
+from models.marathon_log import MarathonLog
+from utils import insert_or_ignore
+from conftest import insert_rows, auth_headers
+
+
+def add_admin_group():
+    admin_id = insert_rows(User, [{"name": "Admin", "email": "admin@email.com", "password": "x", "is_admin": True}])[0]
+    group_id = insert_rows(Group, [{"name": "Group", "date_created": date(2030, 1, 1), "created_by": admin_id}])[0]
+    return group_id, auth_headers(admin_id, is_admin=True, group_id=group_id)
+
+
+def count(model, **filters):
+    return db.session.scalar(db.select(db.func.count()).select_from(model).filter_by(**filters))
+
+
+# Joining again is refused by the unique constraint, without a duplicate row
+def test_join_twice(client, runner_id, headers):
+    group_id, _ = add_admin_group()
+    response = client.post(f"/groups/{group_id}/join", headers=headers)
+    assert response.status_code == 201
+    assert response.get_json() == {"message": "Runner is officially part of the group named Group."}
+
+    response = client.post(f"/groups/{group_id}/join", headers=headers)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "You are already a member of this group."}
+    assert count(GroupLog, user_id=runner_id, group_id=group_id) == 1
+
+
+def test_join_refused(client, headers):
+    group_id, admin_headers = add_admin_group()
+    assert client.post("/groups/999/join", headers=headers).status_code == 404
+    assert client.post(f"/groups/{group_id}/join", headers=admin_headers).status_code == 403
+    assert count(GroupLog) == 0
+
+
+# Enrolling again is refused by the unique constraint, without a duplicate row
+def test_enrol_twice(client):
+    group_id, admin_headers = add_admin_group()
+    marathon_id = insert_rows(Marathon, [{"name": "Marathon", "event_date": date(2030, 6, 1), "location": "Gold Coast", "distance_kms": 42}])[0]
+    response = client.post(f"/marathons/{marathon_id}/signup", headers=admin_headers)
+    assert response.status_code == 201
+    body = response.get_json()
+    assert (body["group"]["id"], body["marathon"]["id"]) == (group_id, marathon_id)
+
+    response = client.post(f"/marathons/{marathon_id}/signup", headers=admin_headers)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "This group is already enrolled in this marathon."}
+    assert count(MarathonLog, group_id=group_id, marathon_id=marathon_id) == 1
+
+
+# The statement skips the conflicting row itself, so two requests racing insert one row
+def test_insert_or_ignore(runner_id):
+    group_id, _ = add_admin_group()
+    values = {"user_id": runner_id, "group_id": group_id, "entry_created": date(2030, 1, 1)}
+    assert db.session.execute(insert_or_ignore(GroupLog, ["user_id", "group_id"], **values)).rowcount == 1
+    assert db.session.execute(insert_or_ignore(GroupLog, ["user_id", "group_id"], **values)).rowcount == 0
+    db.session.commit()
+    assert count(GroupLog) == 1
+
+    sql = str(insert_or_ignore(GroupLog, ["user_id", "group_id"], **values).compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (user_id, group_id) DO NOTHING" in sql
@@ -0,0 +1,43 @@
+import re
+from datetime import date
+
+from models.marathon import Marathon
+from models.workout import Workout
+from conftest import insert_rows, auth_headers
+
+
+# Count of the serialization phase of an endpoint in /metrics
+def serialization_count(client, endpoint):
+    text = client.get("/metrics").get_data(as_text=True)
+    match = re.search(rf'phase_duration_seconds_count{{blueprint="\w+",endpoint="{endpoint}",phase="serialization"}} (\d+)', text)
+    return int(match.group(1)) if match else 0
+
+
+# get_all_marathons serialises with fast_dump, update_marathon with schema.dump
+def test_serialization_timed_on_both_paths(client, runner_id):
+    marathon_id = insert_rows(Marathon, [{"name": "Marathon A", "event_date": date(2030, 1, 1), "location": "Gold Coast", "distance_kms": 10}])[0]
+    # The metrics of the process include the requests of other tests
+    before = {endpoint: serialization_count(client, endpoint) for endpoint in ("marathons.get_all_marathons", "marathons.update_marathon")}
+    assert client.get("/marathons/").status_code == 200
+    response = client.patch(f"/marathons/{marathon_id}", json={"name": "Marathon B"}, headers=auth_headers(runner_id, is_admin=True))
+    assert response.status_code == 200
+
+    assert serialization_count(client, "marathons.get_all_marathons") == before["marathons.get_all_marathons"] + 1
+    # Once per request, the nested schemas of marathon_schema aren't timed again
+    assert serialization_count(client, "marathons.update_marathon") == before["marathons.update_marathon"] + 1
+
+
+# Sum of db_queries_per_request of an endpoint in /metrics
+def query_sum(client, endpoint):
+    text = client.get("/metrics").get_data(as_text=True)
+    match = re.search(rf'db_queries_per_request_sum{{blueprint="\w+",endpoint="{endpoint}"}} (\d+)', text)
+    return int(match.group(1)) if match else 0
+
+
+# The export runs its query while the response is streamed, after the view returned
+def test_streamed_queries_counted(client, runner_id, headers):
+    insert_rows(Workout, [{"title": "Treadmill", "date": date(2030, 1, 1), "distance_kms": 5, "user_id": runner_id}])
+    before = query_sum(client, "workouts.export_workouts")
+    response = client.get("/workouts/export", headers=headers)
+    assert len(response.get_data(as_text=True).splitlines()) == 1
+    assert query_sum(client, "workouts.export_workouts") == before + 1
@@ -0,0 +1,65 @@
+import time
+import threading
+
+import pytest
+from flask import Flask
+
+from hashing import PasswordPool, PoolSaturatedError
+
+
+# Stands in for Flask-Bcrypt, each hash waits until the test lets it finish
+class SlowBcrypt:
+    def __init__(self):
+        self.calls = 0
+        self.finish = threading.Event()
+
+    def generate_password_hash(self, password):
+        self.calls += 1
+        self.finish.wait(5)
+        return b"hash"
+
+
+def make_pool(queue_size):
+    bcrypt = SlowBcrypt()
+    app = Flask(__name__)
+    app.config.update(BCRYPT_POOL_WORKERS=1, BCRYPT_POOL_QUEUE_SIZE=queue_size, BCRYPT_POOL_TIMEOUT=0.2)
+    return bcrypt, PasswordPool(bcrypt, app)
+
+
+def wait_for_in_flight(pool, count):
+    deadline = time.monotonic() + 5
+    while pool.stats()["in_flight"] != count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.stats()["in_flight"] == count
+
+
+# A call still running after its timeout keeps its slot, the next call fails fast
+def test_slot_kept_until_the_call_finishes():
+    bcrypt, pool = make_pool(queue_size=0)
+    with pytest.raises(PoolSaturatedError):
+        pool.generate_password_hash("password")
+    assert pool.stats()["in_flight"] == 1
+
+    start = time.perf_counter()
+    with pytest.raises(PoolSaturatedError):
+        pool.generate_password_hash("password")
+    assert time.perf_counter() - start < 0.1
+    assert bcrypt.calls == 1
+
+    bcrypt.finish.set()
+    wait_for_in_flight(pool, 0)
+    assert pool.generate_password_hash("password") == "hash"
+
+
+# A call that timed out waiting for a worker is cancelled and never runs
+def test_queued_call_cancelled_on_timeout():
+    bcrypt, pool = make_pool(queue_size=1)
+    with pytest.raises(PoolSaturatedError):
+        pool.generate_password_hash("password")
+    with pytest.raises(PoolSaturatedError):
+        pool.generate_password_hash("password")
+    assert pool.stats()["in_flight"] == 1
+
+    bcrypt.finish.set()
+    wait_for_in_flight(pool, 0)
+    assert bcrypt.calls == 1
@@ -0,0 +1,63 @@
+import bcrypt as pybcrypt
+import pytest
+
+from init import db, password_pool
+from models.user import User
+from hashing import hash_rounds
+from budgets import record_queries
+from conftest import insert_rows
+
+
+# The tests hash with BCRYPT_LOG_ROUNDS=4
+def add_user(rounds):
+    pw_hash = pybcrypt.hashpw(b"password", pybcrypt.gensalt(rounds)).decode("utf-8")
+    return insert_rows(User, [{"name": "Runner", "email": "runner@email.com", "password": pw_hash, "is_admin": False}])[0]
+
+
+def stored_hash(user_id):
+    db.session.expire_all()
+    return db.session.get(User, user_id).password
+
+
+def login(client, password="password"):
+    return client.post("/auth/login", json={"email": "runner@email.com", "password": password})
+
+
+# A hash more than one round above the cost is recreated on login, the new one logs in too
+# The login reads the user and their group, then writes the hash
+def test_rehashed_on_login(client):
+    user_id = add_user(6)
+    with record_queries() as recorder:
+        assert login(client).status_code == 200
+    assert recorder.count == 3
+    assert hash_rounds(stored_hash(user_id)) == 4
+    assert login(client).status_code == 200
+
+
+# Hashes at the cost or one round above are kept, no write
+@pytest.mark.parametrize("rounds", [4, 5])
+def test_current_hash_kept(client, rounds):
+    user_id = add_user(rounds)
+    before = stored_hash(user_id)
+    with record_queries() as recorder:
+        assert login(client).status_code == 200
+    assert recorder.count == 2
+    assert stored_hash(user_id) == before
+
+
+def test_not_rehashed_on_wrong_password(client):
+    user_id = add_user(6)
+    before = stored_hash(user_id)
+    assert login(client, "wrong").status_code == 400
+    assert stored_hash(user_id) == before
+
+
+@pytest.mark.parametrize("pw_hash, expected", [
+    ("$2b$03$" + "a" * 53, True),
+    ("$2b$04$" + "a" * 53, False),
+    ("$2b$05$" + "a" * 53, False),
+    ("$2b$06$" + "a" * 53, True),
+    ("not-a-bcrypt-hash", True),
+])
+def test_needs_rehash(app, pw_hash, expected):
+    assert password_pool.needs_rehash(pw_hash) is expected
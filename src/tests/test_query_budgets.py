@@ -0,0 +1,116 @@
+from datetime import date, timedelta
+
+import pytest
+from flask import Blueprint, Response, stream_with_context
+
+from init import db
+from models.user import User
+from models.group import Group
+from models.group_log import GroupLog
+from models.marathon import Marathon
+from models.marathon_log import MarathonLog
+from budgets import query_budget, assert_max_queries, record_queries, QueryBudgetExceeded
+from conftest import insert_rows
+
+
+# More rows than selectinload puts in one IN list
+ROWS = 600
+
+
+# ROWS groups with an admin and a member, each enrolled in its own upcoming marathon
+@pytest.fixture
+def dataset(app, runner_id):
+    today = date.today()
+    admins = insert_rows(User, [{"name": "Admin", "email": f"admin{i}@email.com", "password": "x", "is_admin": True} for i in range(ROWS)])
+    groups = insert_rows(Group, [{"name": "Group", "date_created": today, "created_by": admin} for admin in admins])
+    marathons = insert_rows(Marathon, [
+        {"name": "Marathon", "event_date": today + timedelta(days=i), "location": "Gold Coast", "distance_kms": 10}
+        for i in range(ROWS)
+    ])
+    insert_rows(GroupLog, [{"user_id": runner_id, "group_id": group, "entry_created": today} for group in groups])
+    insert_rows(MarathonLog, [{"group_id": group, "marathon_id": marathon, "entry_created": today} for group, marathon in zip(groups, marathons)])
+    return {"groups": groups, "marathons": marathons}
+
+
+# The list routes stay within their declared budget (enforced by QUERY_BUDGETS=raise)
+@pytest.mark.parametrize("path", [
+    "/groups/",
+    "/groups/?fields=id,name",
+    "/marathons/",
+    "/marathons/?limit=100&sort=-event_date",
+    "/me/calendar?limit=100",
+])
+def test_list_routes_within_budget_above_500_rows(client, headers, dataset, path):
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200
+
+
+def test_groups_list_statement_count(client, headers, dataset):
+    with assert_max_queries(4) as recorder:
+        response = client.get("/groups/", headers=headers)
+    assert len(response.get_json()) == ROWS
+    assert recorder.serialization_count == 0
+
+
+# The user is reloaded with its groups, their marathons, workouts and created group
+# The rename invalidates the leaderboards of its groups in one statement, after finding them
+def test_update_user_statement_count(client, runner_id, headers, dataset):
+    with assert_max_queries(9):
+        response = client.patch(f"/auth/users/{runner_id}", json={"name": "Runner Renamed"}, headers=headers)
+    assert response.status_code == 200
+    assert len(response.get_json()["group_logs"]) == ROWS
+
+
+def test_group_calendar_statement_count(client, headers, dataset):
+    group_id = dataset["groups"][0]
+    with assert_max_queries(2):
+        response = client.get(f"/groups/{group_id}/calendar", headers=headers)
+    assert [marathon["id"] for marathon in response.get_json()["marathons"]] == [dataset["marathons"][0]]
+
+
+def test_route_over_budget_raises(app, client):
+    bp = Blueprint("over_budget", __name__)
+
+    @bp.route("/over-budget")
+    @query_budget(1)
+    def over_budget():
+        db.session.scalar(db.select(User.id))
+        db.session.scalar(db.select(Group.id))
+        return {}, 200
+
+    app.register_blueprint(bp)
+    with pytest.raises(QueryBudgetExceeded, match="ran 2 statements"):
+        client.get("/over-budget")
+
+
+# Statements of a streamed response are checked once the stream is closed
+def test_streamed_route_over_budget_raises(app, client):
+    bp = Blueprint("streamed_over_budget", __name__)
+
+    @bp.route("/streamed-over-budget")
+    @query_budget(1)
+    def streamed_over_budget():
+        def generate():
+            yield str(db.session.scalar(db.select(User.id)))
+            yield str(db.session.scalar(db.select(Group.id)))
+        return Response(stream_with_context(generate()))
+
+    app.register_blueprint(bp)
+    # The generator runs while the body is read
+    with pytest.raises(QueryBudgetExceeded, match="ran 2 statements"):
+        client.get("/streamed-over-budget").get_data()
+
+
+def test_assert_max_queries_counts_lazy_loads_while_serialising(app, dataset):
+    from models.group import groups_schema
+    with pytest.raises(QueryBudgetExceeded, match="while serialising"):
+        with assert_max_queries(10):
+            groups = db.session.scalars(db.select(Group).limit(3)).all()
+            groups_schema.dump(groups)
+
+
+def test_record_queries(app):
+    with record_queries() as recorder:
+        db.session.scalar(db.select(User.id))
+    assert recorder.count == 1
+    assert "test_query_budgets.py" in recorder.report()
@@ -0,0 +1,139 @@
+# The replica is a second SQLite file that is never written to, like a replica lagging behind
+# Requests run outside of an app context so each one decides its engine, as in production
+import time
+from datetime import date
+
+import pytest
+
+from main import create_app
+from init import db, read_replica, response_cache
+from models.user import User
+from models.group import Group
+from models.cache_generation import CacheGeneration
+from budgets import record_queries
+from conftest import insert_rows, auth_headers
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'primary.db'}",
+        "SQLALCHEMY_BINDS": {"replica": f"sqlite:///{tmp_path / 'replica.db'}"},
+        "JWT_SECRET_KEY": "tests-secret-key-tests-secret-key-tests",
+        "BCRYPT_LOG_ROUNDS": 4,
+        "QUERY_BUDGETS": "raise",
+        "TESTING": True,
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.metadata.create_all(db.engines["replica"])
+    return app
+
+
+@pytest.fixture
+def runner_id(app):
+    with app.app_context():
+        return insert_rows(User, [{"name": "Runner", "email": "runner@email.com", "password": "x", "is_admin": False}])[0]
+
+
+@pytest.fixture
+def headers(app, runner_id):
+    with app.app_context():
+        return auth_headers(runner_id)
+
+
+# A group only the primary has
+@pytest.fixture
+def group(app, runner_id):
+    with app.app_context():
+        return insert_rows(Group, [{"name": "Group", "date_created": date(2030, 1, 1), "created_by": runner_id}])[0]
+
+
+def test_cached_route_filled_from_primary(app, client, runner_id):
+    with app.app_context():
+        admin = auth_headers(runner_id, is_admin=True)
+    body = {"name": "Marathon A", "event_date": "2030-02-01", "location": "Gold Coast", "distance_kms": 21}
+    assert client.post("/marathons/register", json=body, headers=admin).status_code == 201
+
+    # Anonymous reads aren't sticky, the replica doesn't have the marathon yet
+    response = client.get("/marathons/")
+    assert response.status_code == 200
+    assert [marathon["name"] for marathon in response.get_json()] == ["Marathon A"]
+    assert client.get("/marathons/").headers["X-Cache"] == "HIT"
+
+
+# Long after the last write the replica has caught up, misses read from it
+def test_cache_filled_from_replica_after_the_sticky_delay(app, client, runner_id):
+    with app.app_context():
+        admin = auth_headers(runner_id, is_admin=True)
+    body = {"name": "Marathon A", "event_date": "2030-02-01", "location": "Gold Coast", "distance_kms": 21}
+    assert client.post("/marathons/register", json=body, headers=admin).status_code == 201
+    with app.app_context():
+        db.session.execute(db.update(CacheGeneration).values(changed_at=db.func.datetime("now", "-1 hour")))
+        db.session.commit()
+    response_cache.generations.local.clear()
+
+    response = client.get("/marathons/")
+    assert response.get_json() == {"Error": "No marathons created yet."}
+
+
+def test_user_who_never_wrote_reads_from_replica(client, headers, group):
+    response = client.get("/groups/", headers=headers)
+    assert response.get_json() == {"Error": "No groups created yet."}
+
+
+# The client carries the last write token, whatever worker handles its next reads
+def test_recent_writer_reads_from_primary(client, runner_id, headers, group):
+    response = client.patch(f"/auth/users/{runner_id}", json={"name": "Runner Renamed"}, headers=headers)
+    assert response.status_code == 200
+    token = response.headers["X-Last-Write"]
+    assert client.get_cookie("last_write").value == token
+
+    with record_queries() as recorder:
+        response = client.get("/groups/", headers=headers)
+    assert [group["id"] for group in response.get_json()] == [group]
+    # The groups and their relationships, no lookup of the last write
+    assert all("groups" in statement or "group_logs" in statement or "marathon_logs" in statement for statement, _, _ in recorder.statements)
+
+    # API clients without cookies send the header back
+    client.delete_cookie("last_write")
+    assert client.get("/groups/", headers={**headers, "X-Last-Write": token}).status_code == 200
+    assert client.get("/groups/", headers=headers).get_json() == {"Error": "No groups created yet."}
+
+
+def test_last_write_token_of_another_user_ignored(app, client, runner_id, headers, group):
+    with app.app_context():
+        other_id = insert_rows(User, [{"name": "Other", "email": "other@email.com", "password": "x", "is_admin": False}])[0]
+        other_headers = auth_headers(other_id)
+    assert client.patch(f"/auth/users/{other_id}", json={"name": "Other Renamed"}, headers=other_headers).status_code == 200
+
+    assert client.get("/groups/", headers=headers).get_json() == {"Error": "No groups created yet."}
+    assert client.get("/groups/", headers={**headers, "X-Last-Write": f"{runner_id}.forged.token"}).get_json() == {"Error": "No groups created yet."}
+
+
+def test_sticky_reads_expire(client, runner_id, headers, group, monkeypatch):
+    monkeypatch.setattr(read_replica.signer, "get_timestamp", lambda: int(time.time()) - 3600)
+    assert client.patch(f"/auth/users/{runner_id}", json={"name": "Runner Renamed"}, headers=headers).status_code == 200
+    monkeypatch.undo()
+
+    response = client.get("/groups/", headers=headers)
+    assert response.get_json() == {"Error": "No groups created yet."}
+
+
+# Leaderboards load from the replica, unless the group just changed
+def test_leaderboard_read_from_replica(client, headers, group):
+    response = client.get(f"/groups/{group}/leaderboard", headers=headers)
+    assert response.status_code == 404
+
+
+# Another user joined the group, the board is loaded from the primary so the replica isn't cached
+def test_leaderboard_read_from_primary_after_a_change(app, client, headers, group):
+    with app.app_context():
+        member_id = insert_rows(User, [{"name": "Member", "email": "member@email.com", "password": "x", "is_admin": False}])[0]
+        member_headers = auth_headers(member_id)
+    assert client.post(f"/groups/{group}/join", headers=member_headers).status_code == 201
+
+    client.delete_cookie("last_write")
+    response = client.get(f"/groups/{group}/leaderboard", headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["group_id"] == group
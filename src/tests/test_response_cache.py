@@ -0,0 +1,62 @@
+from datetime import date
+
+from cache import ResponseCache, LRUTTLCache
+from budgets import record_queries
+from init import db, response_cache
+from models.marathon import Marathon
+from conftest import insert_rows, auth_headers
+
+
+def test_cached_until_a_write(client, runner_id):
+    insert_rows(Marathon, [{"name": "Marathon A", "event_date": date(2030, 1, 1), "location": "Gold Coast", "distance_kms": 10}])
+    assert client.get("/marathons/").headers["X-Cache"] == "MISS"
+    assert client.get("/marathons/").headers["X-Cache"] == "HIT"
+
+    admin = auth_headers(runner_id, is_admin=True)
+    body = {"name": "Marathon B", "event_date": "2030-02-01", "location": "Sunshine Coast", "distance_kms": 21}
+    assert client.post("/marathons/register", json=body, headers=admin).status_code == 201
+
+    response = client.get("/marathons/")
+    assert response.headers["X-Cache"] == "MISS"
+    assert [marathon["name"] for marathon in response.get_json()] == ["Marathon A", "Marathon B"]
+
+
+# Each worker process has its own backend, the generations are shared through the DB
+def test_invalidation_reaches_other_workers(app):
+    other_worker = ResponseCache(db)
+    other_worker.backend = LRUTTLCache()
+    other_worker.generations.local = LRUTTLCache(ttl=60)
+    calls = []
+
+    @other_worker.cached("marathons")
+    def view():
+        calls.append(1)
+        return {"calls": len(calls)}
+
+    with app.test_request_context("/marathons/"):
+        view()
+        view()
+    assert len(calls) == 1
+
+    # A write handled by this worker, the other one sees it once its copy of the generation expires
+    response_cache.invalidate("marathons")
+    with app.test_request_context("/marathons/"):
+        assert view().get_json() == {"calls": 1}
+    other_worker.generations.local.clear()
+    with app.test_request_context("/marathons/"):
+        assert view().get_json() == {"calls": 2}
+    assert other_worker.generation("marathons") == response_cache.generation("marathons") == 1
+
+
+def test_hits_run_no_query(client):
+    insert_rows(Marathon, [{"name": "Marathon A", "event_date": date(2030, 1, 1), "location": "Gold Coast", "distance_kms": 10}])
+    assert client.get("/marathons/").headers["X-Cache"] == "MISS"
+    with record_queries() as recorder:
+        assert client.get("/marathons/").headers["X-Cache"] == "HIT"
+    assert recorder.count == 0
+
+    # The generation is read again once the local copy expires, still one query for a hit
+    response_cache.generations.local.clear()
+    with record_queries() as recorder:
+        assert client.get("/marathons/").headers["X-Cache"] == "HIT"
+    assert recorder.count == 1
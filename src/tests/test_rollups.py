@@ -0,0 +1,106 @@
+from datetime import date
+
+import pytest
+
+from init import db
+from models.group import Group
+from models.group_log import GroupLog
+from models.workout import Workout
+from models.workout_rollup import WorkoutRollup
+from rollups import PERIODS, period_start, refresh_rollups
+from conftest import insert_rows
+
+
+# Rollups of the runner as {(period, period_start): (count, total_distance_kms, max_distance_kms)}
+def rollups(user_id):
+    rows = db.session.scalars(db.select(WorkoutRollup).filter_by(user_id=user_id)).all()
+    return {(row.period, row.period_start): (row.count, row.total_distance_kms, row.max_distance_kms) for row in rows}
+
+
+# Workouts logged with the routes are dated today, OLD is in other periods than today
+TODAY = date.today()
+OLD = date(2020, 1, 7)
+
+
+# Expected rollups of each period a date falls in
+def periods(workout_date, stats):
+    return {(period, period_start(period, workout_date)): stats for period in PERIODS}
+
+
+def log(client, headers, distance_kms):
+    response = client.post("/workouts/", json={"title": "Treadmill", "distance_kms": distance_kms}, headers=headers)
+    assert response.status_code == 201
+    return response.get_json()["id"]
+
+
+def log_old(runner_id, distance_kms):
+    workout_id = insert_rows(Workout, [{"title": "Treadmill", "date": OLD, "distance_kms": distance_kms, "user_id": runner_id}])[0]
+    refresh_rollups(runner_id, OLD)
+    db.session.commit()
+    return workout_id
+
+
+# The runner is in a group whose leaderboard is cached, so the routes run every statement of their budget
+@pytest.fixture
+def cached_leaderboard(client, runner_id, headers):
+    group_id = insert_rows(Group, [{"name": "Group", "date_created": TODAY, "created_by": runner_id}])[0]
+    insert_rows(GroupLog, [{"user_id": runner_id, "group_id": group_id, "entry_created": TODAY}])
+    assert client.get(f"/groups/{group_id}/leaderboard", headers=headers).status_code == 200
+
+
+def test_register_adds_to_rollups(client, runner_id, headers, cached_leaderboard):
+    log_old(runner_id, 3)
+    log(client, headers, 5)
+    log(client, headers, 10)
+    assert rollups(runner_id) == {**periods(OLD, (1, 3, 3)), **periods(TODAY, (2, 15, 10))}
+
+
+# The rows are updated in place, not deleted and inserted again
+def test_update_recomputes_rollups(client, runner_id, headers, cached_leaderboard):
+    log(client, headers, 5)
+    workout_id = log(client, headers, 10)
+    ids = set(db.session.scalars(db.select(WorkoutRollup.id)))
+
+    assert client.patch(f"/workouts/{workout_id}", json={"distance_kms": 2}, headers=headers).status_code == 200
+    db.session.expire_all()
+    assert rollups(runner_id) == periods(TODAY, (2, 7, 5))
+    assert set(db.session.scalars(db.select(WorkoutRollup.id))) == ids
+
+
+# Deleting lowers the maximum, and removes the periods left without workouts
+def test_delete_recomputes_rollups(client, runner_id, headers, cached_leaderboard):
+    old = log_old(runner_id, 3)
+    log(client, headers, 5)
+    longest = log(client, headers, 10)
+
+    assert client.delete(f"/workouts/{longest}", headers=headers).status_code == 200
+    assert client.delete(f"/workouts/{old}", headers=headers).status_code == 200
+    db.session.expire_all()
+    assert rollups(runner_id) == periods(TODAY, (1, 5, 5))
+
+
+# A period recomputed twice in a transaction, eg: by two requests, is upserted
+def test_refresh_twice(runner_id):
+    insert_rows(Workout, [{"title": "Treadmill", "date": OLD, "distance_kms": 5, "user_id": runner_id}])
+    refresh_rollups(runner_id, OLD)
+    refresh_rollups(runner_id, OLD)
+    db.session.commit()
+    assert rollups(runner_id) == periods(OLD, (1, 5, 5))
+
+
+def test_rebuild_rollups_command(app, runner_id):
+    insert_rows(Workout, [
+        {"title": "Treadmill", "date": OLD, "distance_kms": 5, "user_id": runner_id},
+        {"title": "Treadmill", "date": TODAY, "distance_kms": 8, "user_id": runner_id},
+    ])
+    # Out of date rollups, eg: after workouts were imported with SQL
+    insert_rows(WorkoutRollup, [{
+        "user_id": runner_id, "period": "week", "period_start": date(2019, 12, 30), "count": 1,
+        "total_distance_kms": 1, "total_calories_burnt": 0, "calories_count": 0,
+    }])
+
+    result = app.test_cli_runner().invoke(args=["db", "rebuild-rollups"])
+    assert result.exit_code == 0
+    assert "Workout rollups rebuilt!" in result.output
+    db.session.expire_all()
+    assert rollups(runner_id) == {**periods(OLD, (1, 5, 5)), **periods(TODAY, (1, 8, 8))}
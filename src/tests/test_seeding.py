@@ -0,0 +1,29 @@
+from datetime import date
+
+from init import db
+from models.marathon import Marathon
+from models.workout import Workout
+from seeding import seed_dataset
+
+
+def seeded_rows(**options):
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
+    seed_dataset(users=20, groups=2, marathons=10, workouts_per_user=5, **options)
+    marathons = db.session.execute(db.select(Marathon.name, Marathon.event_date, Marathon.location).order_by(Marathon.id)).all()
+    workouts = db.session.execute(db.select(Workout.user_id, Workout.date, Workout.distance_kms).order_by(Workout.id)).all()
+    return marathons, workouts
+
+
+# The data doesn't depend on the day it's generated
+def test_same_seed_and_anchor_date_give_the_same_rows(app):
+    first = seeded_rows(seed=1, anchor_date=date(2025, 1, 1))
+    assert seeded_rows(seed=1, anchor_date=date(2025, 1, 1)) == first
+    assert seeded_rows(seed=2, anchor_date=date(2025, 1, 1)) != first
+    assert all(workout_date <= date(2025, 1, 1) for _, workout_date, _ in first[1])
+
+
+def test_seed_command_anchor_date(app):
+    result = app.test_cli_runner().invoke(args=["db", "seed", "--users", "5", "--groups", "1", "--anchor-date", "2025-01-01"])
+    assert "around 2025-01-01" in result.output
+    assert db.session.scalar(db.select(db.func.max(Workout.date))) <= date(2025, 1, 1)
@@ -0,0 +1,52 @@
+from datetime import date
+
+import pytest
+
+from models.workout import Workout
+from budgets import record_queries
+from conftest import insert_rows
+
+
+@pytest.fixture
+def workout_id(runner_id):
+    return insert_rows(Workout, [{"title": "Treadmill", "date": date(2030, 1, 1), "distance_kms": 5, "user_id": runner_id}])[0]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("fields=id,title", {"id", "title"}),
+    ("fields= id, ,title ", {"id", "title"}),
+    ("exclude=user,calories_burnt", {"id", "title", "date", "distance_kms"}),
+    ("fields=id,user&exclude=user", {"id"}),
+    ("fields=", set()),
+])
+def test_fields_and_exclude(client, headers, workout_id, query, expected):
+    response = client.get(f"/workouts/{workout_id}?{query}", headers=headers)
+    assert response.status_code == 200
+    assert set(response.get_json()) == expected
+
+    response = client.get(f"/workouts/?{query}", headers=headers)
+    assert response.status_code == 200
+    assert [set(workout) for workout in response.get_json()] == [expected]
+
+
+# Only the columns of the requested fields are selected, the user is only joined when it's dumped
+def test_unused_columns_not_loaded(client, headers, workout_id):
+    with record_queries() as recorder:
+        assert client.get(f"/workouts/{workout_id}?fields=id,title", headers=headers).status_code == 200
+    sql = recorder.statements[0][0]
+    assert "distance_kms" not in sql and "users" not in sql
+
+    with record_queries() as recorder:
+        assert client.get(f"/workouts/{workout_id}?fields=user", headers=headers).status_code == 200
+    assert "users" in recorder.statements[0][0]
+
+
+# Unknown fields are refused before any query, except reading the generation of a cached route
+@pytest.mark.parametrize("path", ["/workouts/", "/workouts/1", "/marathons/", "/marathons/1", "/groups/", "/groups/1"])
+@pytest.mark.parametrize("query", ["fields=id,password", "exclude=password", "fields=id&exclude=password"])
+def test_unknown_fields(client, headers, path, query):
+    with record_queries() as recorder:
+        response = client.get(f"{path}?{query}", headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith("Unknown fields: password. Allowed fields are: ")
+    assert all("cache_generations" in statement[0] for statement in recorder.statements)
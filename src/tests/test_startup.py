@@ -0,0 +1,33 @@
+# Cold start budget of benchmarks.bench_startup, in the suite so a slow import fails the tests
+# STARTUP_BUDGET_MS raises the budget on slower machines
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+from benchmarks.bench_startup import parse_args, run
+
+
+def startup_env():
+    env = {**os.environ, "FLASK_DEBUG": "0", "DATABASE_URL": "sqlite://"}
+    env.setdefault("JWT_SECRET_KEY", "bench-startup-secret-key-of-32-bytes")
+    return env
+
+
+def test_cold_start_within_budget():
+    args = parse_args(["--runs", "3"])
+    budget_ms = float(os.environ.get("STARTUP_BUDGET_MS", args.budget_ms))
+    runs = [run(args, startup_env()) for _ in range(args.runs)]
+    median = statistics.median(result["total"] for result in runs) * 1000
+    assert median <= budget_ms, f"Cold start took {median:.0f}ms, budget is {budget_ms:.0f}ms"
+
+
+# Modules only some deployments use are imported when they're needed, not by create_app
+def test_optional_modules_not_imported():
+    code = (
+        "import sys, json; from main import create_app; create_app(); "
+        "print(json.dumps(sorted(name for name in sys.modules if name.split('.')[0] in ('multiprocessing', 'aiosqlite', 'asgi'))))"
+    )
+    output = subprocess.run([sys.executable, "-c", code], env=startup_env(), capture_output=True, text=True, check=True).stdout
+    assert json.loads(output.splitlines()[-1]) == []
@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from init import db
+from replicas import RoutingSession
+from models.group import Group
+from models.marathon import Marathon
+from models.workout import Workout
+from conftest import insert_rows, auth_headers
+
+
+# Another request updates the rows between the load and the flush of the route
+@contextmanager
+def concurrent_update():
+    def bump_versions(session, flush_context, instances):
+        for row in list(session.dirty) + list(session.deleted):
+            model = type(row)
+            if hasattr(model, "version"):
+                session.connection().execute(db.update(model).where(model.id == row.id).values(version=model.version + 1))
+
+    event.listen(RoutingSession, "before_flush", bump_versions)
+    try:
+        yield
+    finally:
+        event.remove(RoutingSession, "before_flush", bump_versions)
+
+
+@pytest.fixture
+def rows(runner_id):
+    group = insert_rows(Group, [{"name": "Group", "date_created": date(2030, 1, 1), "created_by": runner_id}])[0]
+    marathon = insert_rows(Marathon, [{"name": "Marathon", "event_date": date(2030, 1, 1), "location": "Gold Coast", "distance_kms": 10}])[0]
+    workout = insert_rows(Workout, [{"title": "Treadmill", "date": date(2030, 1, 1), "distance_kms": 5, "user_id": runner_id}])[0]
+    return {"group": group, "marathon": marathon, "workout": workout}
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("patch", "/auth/users/{user}", {"name": "Runner Renamed"}),
+    ("patch", "/groups/{group}", {"name": "Group Renamed"}),
+    ("patch", "/marathons/{marathon}", {"name": "Marathon Renamed"}),
+    ("delete", "/marathons/{marathon}", None),
+    ("patch", "/workouts/{workout}", {"title": "Outside run"}),
+])
+def test_concurrent_update_conflicts(client, runner_id, rows, method, path, body):
+    admin = auth_headers(runner_id, is_admin=True, group_id=rows["group"])
+    with concurrent_update():
+        response = getattr(client, method)(path.format(user=runner_id, **rows), json=body, headers=admin)
+    assert response.status_code == 409
+    assert response.get_json() == {"error": "The resource was changed by another request, please reload it and try again."}
+
+
+def test_update_without_conflict(client, runner_id, rows):
+    response = client.patch(f"/marathons/{rows['marathon']}", json={"name": "Marathon Renamed"}, headers=auth_headers(runner_id, is_admin=True))
+    assert response.status_code == 200
+    assert db.session.get(Marathon, rows["marathon"]).version == 2
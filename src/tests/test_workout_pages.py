@@ -0,0 +1,84 @@
+from datetime import date
+
+import pytest
+
+from models.user import User
+from models.workout import Workout
+from utils import encode_cursor
+from conftest import insert_rows
+
+
+def add_workouts(user_id, dates):
+    return insert_rows(Workout, [{"title": "Treadmill", "date": workout_date, "distance_kms": 5, "user_id": user_id} for workout_date in dates])
+
+
+# Each page's ids, following the X-Next-Cursor header
+def pages(client, headers, limit):
+    result, cursor = [], None
+    while True:
+        response = client.get(f"/workouts/?limit={limit}" + (f"&cursor={cursor}" if cursor else ""), headers=headers)
+        assert response.status_code == 200
+        result.append([workout["id"] for workout in response.get_json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return result
+
+
+# Latest first, ties by id, each workout once and only the user's
+def test_pages_in_order(client, runner_id, headers):
+    dates = [date(2030, 1, day) for day in (3, 1, 3, 2, 3, 1, 2)]
+    workouts = add_workouts(runner_id, dates)
+    other_id = insert_rows(User, [{"name": "Other", "email": "other@email.com", "password": "x", "is_admin": False}])[0]
+    add_workouts(other_id, dates)
+
+    result = pages(client, headers, 2)
+    assert [len(page) for page in result] == [2, 2, 2, 1]
+    assert sum(result, []) == [workout for _, workout in sorted(zip(dates, workouts), reverse=True)]
+
+
+# A workout logged between two pages doesn't shift the next page
+def test_insert_between_pages(client, runner_id, headers):
+    add_workouts(runner_id, [date(2030, 1, day) for day in (1, 2, 3, 4)])
+    first = client.get("/workouts/?limit=2", headers=headers)
+    add_workouts(runner_id, [date(2030, 1, 5)])
+
+    second = client.get(f"/workouts/?limit=2&cursor={first.headers['X-Next-Cursor']}", headers=headers)
+    assert [workout["date"] for workout in first.get_json() + second.get_json()] == ["2030-01-04", "2030-01-03", "2030-01-02", "2030-01-01"]
+    assert "X-Next-Cursor" not in second.headers
+
+
+def test_no_workouts(client, headers):
+    response = client.get("/workouts/", headers=headers)
+    assert response.status_code == 400
+    assert response.get_json() == {"Error": "No workout logs to display for this user."}
+
+
+@pytest.mark.parametrize("query, error", [
+    ("cursor=not-a-cursor", "Invalid cursor."),
+    (f"cursor={encode_cursor('2030-01-01')}", "Invalid cursor."),
+    (f"cursor={encode_cursor('not-a-date', 1)}", "Invalid cursor."),
+    ("limit=0", None),
+    ("limit=ten", "Limit must be a number."),
+])
+def test_invalid_parameters(client, runner_id, headers, query, error):
+    add_workouts(runner_id, [date(2030, 1, 1)])
+    response = client.get(f"/workouts/?{query}", headers=headers)
+    assert response.status_code == 400
+    if error:
+        assert response.get_json() == {"error": error}
+
+
+# A page is revalidated with its ETag until the user's workouts change
+def test_page_revalidated(client, runner_id, headers):
+    add_workouts(runner_id, [date(2030, 1, day) for day in (1, 2, 3)])
+    first = client.get("/workouts/?limit=2", headers=headers)
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get(f"/workouts/?limit=2&cursor={cursor}", headers=headers)
+    assert first.headers["ETag"] != second.headers["ETag"]
+
+    revalidate = {**headers, "If-None-Match": second.headers["ETag"]}
+    assert client.get(f"/workouts/?limit=2&cursor={cursor}", headers=revalidate).status_code == 304
+    add_workouts(runner_id, [date(2029, 12, 31)])
+    response = client.get(f"/workouts/?limit=2&cursor={cursor}", headers=revalidate)
+    assert response.status_code == 200
+    assert [workout["date"] for workout in response.get_json()] == ["2030-01-01", "2029-12-31"]
@@ -0,0 +1,88 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from init import db
+from models.user import User
+from models.workout import Workout
+from rollups import rebuild_rollups
+from budgets import record_queries
+from controllers.workout_controller import _workout_stats
+from conftest import insert_rows
+
+
+# Workouts over two years, some without calories, plus another user's
+@pytest.fixture
+def workouts(runner_id):
+    other_id = insert_rows(User, [{"name": "Other", "email": "other@email.com", "password": "x", "is_admin": False}])[0]
+    generator = random.Random(0)
+    rows = [
+        {
+            "title": "Treadmill",
+            "date": date(2029, 12, 1) + timedelta(days=generator.randrange(60)),
+            "distance_kms": generator.randrange(1, 43),
+            "calories_burnt": generator.choice([None, generator.randrange(100, 3000)]),
+            "user_id": user_id,
+        }
+        for user_id in (runner_id, other_id) for _ in range(80)
+    ]
+    # A week whose workouts have no calories
+    rows += [{"title": "Treadmill", "date": date(2030, 3, 4), "distance_kms": 7, "calories_burnt": None, "user_id": runner_id}]
+    insert_rows(Workout, rows)
+    rebuild_rollups()
+    db.session.commit()
+
+
+def stats(client, headers, query):
+    with record_queries() as recorder:
+        response = client.get(f"/workouts/stats?{query}", headers=headers)
+    assert response.status_code == 200
+    return response.get_json()["stats"], recorder.statements[0][0]
+
+
+# Whole periods are read from the rollups, with the same stats the GROUP BY gives
+@pytest.mark.parametrize("period, date_from, date_to", [
+    ("week", None, None),
+    ("month", None, None),
+    ("year", None, None),
+    ("week", date(2029, 12, 10), date(2030, 1, 6)),
+    ("month", date(2030, 1, 1), date(2030, 3, 31)),
+    ("year", date(2030, 1, 1), None),
+])
+def test_rollups_match_group_by(client, runner_id, headers, workouts, period, date_from, date_to):
+    query = f"period={period}" + (f"&from={date_from}" if date_from else "") + (f"&to={date_to}" if date_to else "")
+    buckets, sql = stats(client, headers, query)
+    assert "workout_rollups" in sql
+    assert buckets
+    assert buckets == _workout_stats(runner_id, period, date_from, date_to)
+
+
+# Bounds inside a period are computed from the workouts
+def test_partial_periods_use_group_by(client, runner_id, headers, workouts):
+    buckets, sql = stats(client, headers, "period=month&from=2030-01-15&to=2030-03-10")
+    assert "GROUP BY" in sql
+    assert [bucket["period_start"] for bucket in buckets] == ["2030-01-01", "2030-03-01"]
+    expected = db.session.scalar(db.select(db.func.count()).select_from(Workout).where(
+        Workout.user_id == runner_id, Workout.date.between(date(2030, 1, 15), date(2030, 3, 10))
+    ))
+    assert sum(bucket["count"] for bucket in buckets) == expected
+
+
+def test_week_without_calories(client, headers, workouts):
+    buckets, _ = stats(client, headers, "period=week&from=2030-03-04&to=2030-03-10")
+    assert buckets == [{
+        "period_start": "2030-03-04", "count": 1, "total_distance_kms": 7, "total_calories_burnt": None,
+        "avg_distance_kms": 7.0, "avg_calories_burnt": None, "max_distance_kms": 7, "max_calories_burnt": None,
+    }]
+
+
+@pytest.mark.parametrize("query, error", [
+    ("period=day", "Period must be one of: week, month, year."),
+    ("from=2030-13-01", "Invalid date format. Use YYYY-MM-DD."),
+    ("from=2030-02-01&to=2030-01-01", "The from date must be before the to date."),
+])
+def test_invalid_parameters(client, headers, query, error):
+    response = client.get(f"/workouts/stats?{query}", headers=headers)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
@@ -1,13 +1,73 @@
 # Import functools to use wraps method
 import functools
+# To build opaque cursors for paginated routes
+import base64
+import json
+# To find the first and last day of periods
+from datetime import timedelta
 
-from flask_jwt_extended import get_jwt_identity
+from flask import request, g
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from flask_jwt_extended import get_jwt_identity, get_jwt, create_access_token
 
 from init import db
 from models.user import User
 from models.group import Group
 
 
+# Claims added to the JWT when the user logs in, admin routes are authorised from them
+# token_version tells if the claims are still up to date with the user's row
+def user_claims(user):
+    group = user.group_created[0] if user.group_created else None
+    return {
+        "is_admin": bool(user.is_admin),
+        "group_id": group.id if group else None,
+        "token_version": user.token_version,
+    }
+
+
+# Access token of a user with the claims of user_claims(), valid for a day
+def issue_token(user_id, claims):
+    return create_access_token(identity=str(user_id), additional_claims=claims, expires_delta=timedelta(days=1))
+
+
+# Increase the token version of a user, call it when is_admin or the owned group changes
+# Tokens issued before the change stop being trusted and admin checks read from the DB
+# Returns the new version, to issue the user a token with the new claims
+def bump_token_version(user_id):
+    stmt = db.update(User).filter_by(id=user_id).values(token_version=User.token_version + 1).returning(User.token_version)
+    g.pop("admin_claims", None)
+    return db.session.scalar(stmt)
+
+
+# Fetch the current token version of a user, None if the user doesn't exist
+# Read from the DB on every request (one primary key lookup), so a demoted or deleted
+# admin loses access on every worker at once
+def current_token_version(user_id):
+    return db.session.scalar(db.select(User.token_version).filter_by(id=user_id))
+
+
+# Return (is_admin, group_id) of the current user, checked once per request
+# Read from the JWT claims, or from the DB if the token is out of date
+def get_admin_claims():
+    if "admin_claims" not in g:
+        g.admin_claims = _admin_claims()
+    return g.admin_claims
+
+
+def _admin_claims():
+    user_id = int(get_jwt_identity())
+    claims = get_jwt()
+    if "token_version" in claims and claims["token_version"] == current_token_version(user_id):
+        return claims["is_admin"], claims["group_id"]
+
+    # Token issued before the user's last change, or by an older version of the app
+    user = db.session.get(User, user_id)
+    group_id = db.session.scalar(db.select(Group.id).filter_by(created_by=user_id)) if user else None
+    return bool(user and user.is_admin), group_id
+
+
 # Decorator to allow admin to perform specific functions
 # Implement the function inside of the decorator
 # Decorator and wraps method takes the 'function' parameter
@@ -15,14 +75,11 @@ def auth_as_admin_decorator(fn):
     @functools.wraps(fn)
     # *args and *kwargs to accept different types of arguments 
     def wrapper(*args, **kwargs):
-        # Get user id with get_jwt_identity
-        user_id = get_jwt_identity()
-        # fetch user from DB using stmt
-        stmt = db.select(User).filter_by(id=user_id)
-        user = db.session.scalar(stmt)
+        # Get admin flag from the token claims
+        is_admin, group_id = get_admin_claims()
         
         # IF user is admin execute the function that called this decorator
-        if user and user.is_admin:
+        if is_admin:
             return fn(*args, **kwargs)
         # Else return error message
         else:
@@ -34,14 +91,114 @@ def auth_as_admin_decorator(fn):
 def admin_group_check_decorator(fn):
     @functools.wraps(fn)
     def wrapper(*args, **kwargs):
-        # Get user id with get_jwt_identity
-        user_id = get_jwt_identity()  
-
-        # Check if the admin has already created a group user FK in groups table
-        existing_group = Group.query.filter_by(created_by=user_id).first()
-        if existing_group:
+        # Check if the admin has already created a group using the token claims
+        is_admin, group_id = get_admin_claims()
+        if group_id is not None:
             return {"error": "Admin can only create one group."}, 403
 
         # Execute the function
         return fn(*args, **kwargs)
     return wrapper
+
+
+# INSERT statement for the app's database, supports ON CONFLICT clauses
+def dialect_insert(model):
+    dialect = db.session.get_bind().dialect.name
+    insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+    return insert(model)
+
+
+# INSERT ... ON CONFLICT DO NOTHING statement for the app's database
+# index_elements are the columns of the unique constraint that can conflict
+def insert_or_ignore(model, index_elements, **values):
+    return dialect_insert(model).values(**values).on_conflict_do_nothing(index_elements=index_elements)
+
+
+# Periods workouts can be grouped by, weeks start on Monday
+PERIODS = ("week", "month", "year")
+
+
+# SQL expression of the first day of the period a date column falls in
+def period_start_expression(period, column):
+    if db.session.get_bind().dialect.name == "sqlite":
+        formats = {"week": func.date(column, "weekday 0", "-6 days"), "month": func.strftime("%Y-%m-01", column), "year": func.strftime("%Y-01-01", column)}
+        return formats[period]
+    return func.date_trunc(period, column).cast(db.Date)
+
+
+# First day of the period a date falls in, same result as period_start_expression
+def period_start(period, day):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+# Last day of the period a date falls in
+def period_end(period, day):
+    if period == "week":
+        return period_start(period, day) + timedelta(days=6)
+    if period == "month":
+        next_month = day.replace(day=28) + timedelta(days=4)
+        return next_month - timedelta(days=next_month.day)
+    return day.replace(month=12, day=31)
+
+
+# Page sizes allowed for routes using cursor pagination
+DEFAULT_PAGE_LIMIT = 20
+MAX_PAGE_LIMIT = 100
+
+
+# Fetch the '?limit=' query parameter, raises ValueError if it is not a valid page size
+def get_page_limit():
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        raise ValueError("Limit must be a number.")
+    if limit < 1 or limit > MAX_PAGE_LIMIT:
+        raise ValueError(f"Limit must be between 1 and {MAX_PAGE_LIMIT}.")
+    return limit
+
+
+# Encode the sort key values of the last row of a page into an opaque cursor
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("utf-8").rstrip("=")
+
+
+# Decode a cursor back into the sort key values, raises ValueError if it was tampered with
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("utf-8")))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+# Build a schema object limited by the '?fields=' and '?exclude=' query parameters
+# eg: /groups/?fields=id,name, raises ValueError for unknown field names
+def sparse_schema(schema_class, many=False):
+    only = _split_fields(request.args.get("fields"))
+    exclude = _split_fields(request.args.get("exclude")) or ()
+    return _build_schema(schema_class, many, only, exclude)
+
+
+# Split a comma separated list of field names into a tuple
+def _split_fields(value):
+    if value is None:
+        return None
+    return tuple(name.strip() for name in value.split(",") if name.strip())
+
+
+# Schema objects are cached per field selection, building them is expensive
+@functools.lru_cache(maxsize=256)
+def _build_schema(schema_class, many, only, exclude):
+    allowed = schema_class.Meta.fields
+    unknown = [name for name in (only or ()) + exclude if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed fields are: {', '.join(allowed)}.")
+    return schema_class(many=many, only=only, exclude=exclude)